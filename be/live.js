@@ -6,6 +6,37 @@
       modules: null,
       port: null,
       socket: null,
+      sessionId: null,
+      // ID of the FE request being handled, echoed back in its result
+      curRequestId: null,
+      // Identifies this BE instance (page load).  Module versions are only comparable
+      // within the same epoch.
+      epoch: null,
+      // That many latest change descriptors are kept per module, for delta refreshes
+      changeLogSize: 1000,
+      // Limits of serialization for browsing: nesting deeper than maxDepth or more than
+      // maxNodes nodes in total are left as 'unexpanded' placeholders.  Nodes are
+      // counted breadth-first (see browseExpansion), so shallow values are expanded
+      // before deep ones.  All top-level entries of a module are always sent, since the
+      // module browser cannot show a module partially; in a module with more than
+      // maxNodes entries, each top-level composite is a placeholder.
+      browseLimits: {
+         maxDepth: 8,
+         maxNodes: 3000
+      },
+      // Function sources sent over the current socket: {hash: source}.  Functions are
+      // only sent in full once per socket; later they're referred to by hash.
+      sentSources: null,
+      // {function: {source, hash}}
+      functionHashes: null,
+      // Whether any function was serialized since the last message was sent
+      functionsEmitted: false,
+      // Encoding of serialized values: 'dicts' or 'compact' (see jsvalue-protocol.txt).
+      // Chosen by the FE for each connection.
+      encoding: 'dicts',
+      // When not null, results of operations are collected here instead of being sent
+      // (this is how batch works)
+      batchResults: null,
 
       bootload: function ({projectPath, port, project, sources}) {
          let 
@@ -19,10 +50,7 @@
             );
 
          // The bootstrapper needs to be added to this array manually
-         modules.push(Object.assign({}, bootstrapper, {
-            projectId: project['projectId'],
-            value: $,
-         }));
+         modules.push($.makeModule(bootstrapper, project['projectId'], $));
 
          $.projects = {
             [project['projectId']]: {
@@ -35,7 +63,11 @@
          $.modules = $.byId(modules);
       
          $.port = port;
+         // Identifies this BE to the FE, across socket reconnects
+         $.sessionId = $.randomHexId();
+         $.epoch = $.randomHexId();
          $.orderedKeysMap = new WeakMap;
+         $.functionHashes = new WeakMap;
          $.inspectionSpaces = {};
       
          $.resetSocket();
@@ -44,6 +76,13 @@
          window.live = $;
       },
 
+      randomHexId: function () {
+         return Array.from(
+            crypto.getRandomValues(new Uint8Array(16)),
+            b => b.toString(16).padStart(2, '0')
+         ).join('');
+      },
+
       byId: function (things) {
          let res = {};
          for (let thing of things) {
@@ -61,7 +100,12 @@
       },
 
       resetSocket: function () {
-         $.socket = new WebSocket(`ws://localhost:${$.port}/ws`);
+         // The FE may have restarted, so it doesn't necessarily know any of the sources
+         $.sentSources = new Map;
+         $.encoding = 'dicts';
+         $.socket = new WebSocket(
+            `ws://localhost:${$.port}/ws?session=${$.sessionId}`
+         );
          $.socket.onmessage = $.onSocketMessage;
          $.socket.onopen = $.onSocketOpen;
          $.socket.onclose = $.onSocketClose;
@@ -70,6 +114,7 @@
       onSocketMessage: function (evt) {
          let msg = JSON.parse(evt.data);
 
+         $.curRequestId = msg['requestId'];
          try {
             $.opHandlers[msg['operation']].call(null, msg['args']);
          }
@@ -78,15 +123,37 @@
                message: e.stack
             });
          }
+         finally {
+            $.curRequestId = null;
+         }
       },
 
       send: function (message) {
+         if ($.functionsEmitted) {
+            // Tells the FE to look for function sources and hashes in this message
+            message['hasFunctions'] = true;
+            if ($.batchResults === null) {
+               $.functionsEmitted = false;
+            }
+         }
+
          $.socket.send(JSON.stringify(message));
       },
 
+      respond: function (result) {
+         if ($.batchResults !== null) {
+            $.batchResults.push(result);
+         }
+         else {
+            $.send(Object.assign({
+               type: 'result',
+               requestId: $.curRequestId
+            }, result));
+         }
+      },
+
       opExc: function (error, info) {
-         $.send({
-            type: 'result',
+         $.respond({
             success: false,
             error: error,
             info: info
@@ -94,8 +161,7 @@
       },
 
       opReturn: function (value=null) {
-         $.send({
-            type: 'result',
+         $.respond({
             success: true,
             value: value
          });
@@ -117,11 +183,112 @@
             desc['projectId'] = module.projectId;
             desc['moduleId'] = module.id;
             desc['moduleName'] = module.name;
+            desc['version'] = ++module.version;
          }
 
+         $.logModuleChanges(module, descriptors);
          $.persist(descriptors);
       },
 
+      logModuleChanges: function (module, descriptors) {
+         // Function sources are logged along, since the descriptors may be served over
+         // a later socket that the sources have not been sent to
+         for (let desc of descriptors) {
+            let sources = new Map;
+            for (let hash of $.functionHashesIn(desc)) {
+               sources.set(hash, $.sentSources.get(hash));
+            }
+            module.changeLog.push({desc, sources});
+         }
+
+         let excess = module.changeLog.length - $.changeLogSize;
+         if (excess > 0) {
+            module.changeLog.splice(0, excess);
+         }
+      },
+
+      moduleChangesSince: function (module, sinceVersion) {
+         // Return descriptors of all the changes made after sinceVersion, or null if
+         // some of them are no longer in the change log
+         let oldestLogged = module.version - module.changeLog.length;
+
+         if (sinceVersion < oldestLogged || sinceVersion > module.version) {
+            return null;
+         }
+
+         return Array.from(
+            module.changeLog.slice(sinceVersion - oldestLogged),
+            ({desc, sources}) => $.withUnsentSources(desc, sources)
+         );
+      },
+
+      functionHashesIn: function (x, hashes=new Set) {
+         // Hashes of the functions referred to in x (a descriptor or a part of it)
+         if (x instanceof Array) {
+            if (x[0] === 'f') {
+               hashes.add(x[1]);
+            }
+            else {
+               for (let item of x) {
+                  $.functionHashesIn(item, hashes);
+               }
+            }
+         }
+         else if (x !== null && typeof x === 'object') {
+            if (x['type'] === 'function') {
+               hashes.add(x['hash']);
+            }
+            else {
+               for (let value of Object.values(x)) {
+                  $.functionHashesIn(value, hashes);
+               }
+            }
+         }
+
+         return hashes;
+      },
+
+      withUnsentSources: function (x, sources) {
+         // Return x (a logged descriptor or a part of it) with sources put into
+         // references to functions whose sources were not sent over the current socket.
+         // x itself is left intact, it's in the change log.
+         if (x instanceof Array) {
+            if (x[0] === 'f') {
+               let source = $.unsentSource(x[1], sources);
+               return source === undefined ? x : ['f', x[1], source];
+            }
+
+            return Array.from(x, item => $.withUnsentSources(item, sources));
+         }
+
+         if (x !== null && typeof x === 'object') {
+            if (x['type'] === 'function') {
+               let source = $.unsentSource(x['hash'], sources);
+               return source === undefined ? x : Object.assign({}, x, {value: source});
+            }
+
+            return Object.fromEntries(
+               Object.entries(x).map(([k, v]) => [k, $.withUnsentSources(v, sources)])
+            );
+         }
+
+         return x;
+      },
+
+      unsentSource: function (hash, sources) {
+         // Source of the function to be sent along with a reference to it, or undefined
+         // if it was already sent over the current socket
+         $.functionsEmitted = true;
+
+         if ($.sentSources.has(hash)) {
+            return undefined;
+         }
+
+         let source = sources.get(hash);
+         $.sentSources.set(hash, source);
+         return source;
+      },
+
       evalFBody: function ($obj, code) {
          let func = new Function('$', "'use strict';\n" + code);
          return func.call(null, $obj);
@@ -195,60 +362,241 @@
          }
       },
 
-      serialize: function serialize(obj) {
+      serialize: function serialize(obj, expanded=null) {
+         // expanded: Set of composites to serialize with their children (as returned by
+         // browseExpansion), or null for everything (persist descriptors must always be
+         // complete)
          switch (typeof obj) {
             case 'function':
-            return {
-               type: 'function',
-               value: obj.toString()
-            };
+            return $.jsFunction(obj);
       
             case 'string':
-            return {
-               type: 'leaf',
-               value: JSON.stringify(obj)
-            };
+            return $.jsLeaf(JSON.stringify(obj));
       
             case 'number':
             case 'boolean':
             case 'undefined':
-            return {
-               type: 'leaf',
-               value: String(obj)
-            };
+            return $.jsLeaf(String(obj));
          }
       
          if (obj === null) {
-            return {
-               type: 'leaf',
-               value: 'null'
-            };
+            return $.jsLeaf('null');
          }
       
          if (obj instanceof RegExp) {
-            return {
-               type: 'leaf',
-               value: obj.toString()
-            };
+            return $.jsLeaf(obj.toString());
          }
       
          if (obj instanceof Array) {
-            return {
-               type: 'array',
-               value: Array.from(obj, serialize)
-            };
+            if (expanded !== null && !expanded.has(obj)) {
+               return $.unexpanded('array', obj.length);
+            }
+
+            return $.jsArray(Array.from(obj, item => serialize(item, expanded)));
          }
       
          if (Object.getPrototypeOf(obj) !== Object.prototype) {
             console.log(obj);
             throw new Error(`Cannot serialize objects with non-standard prototype`);
          }
+
+         let entries = Array.from($.entries(obj));
+
+         if (expanded !== null && !expanded.has(obj)) {
+            return $.unexpanded('object', entries.length);
+         }
       
+         return $.jsObject(
+            Array.from(entries, ([k, v]) => [k, serialize(v, expanded)])
+         );
+      },
+
+      // Constructors of serialized values (see jsvalue-protocol.txt), in the encoding
+      // the FE asked for
+      jsLeaf: function (text) {
+         if ($.encoding === 'compact') {
+            return ['l', text];
+         }
+
+         return {
+            type: 'leaf',
+            value: text
+         };
+      },
+
+      jsFunction: function (func) {
+         if ($.encoding === 'compact') {
+            let {hash, source} = $.functionRef(func);
+            return source === undefined ? ['f', hash] : ['f', hash, source];
+         }
+
+         return $.serializeFunction(func, {type: 'function'});
+      },
+
+      jsArray: function (items) {
+         if ($.encoding === 'compact') {
+            return ['a', ...items];
+         }
+
+         return {
+            type: 'array',
+            value: items
+         };
+      },
+
+      jsObject: function (entries) {
+         if ($.encoding === 'compact') {
+            let res = ['o'];
+            for (let [k, v] of entries) {
+               res.push(k, v);
+            }
+            return res;
+         }
+
          return {
             type: 'object',
-            value: Object.fromEntries(
-               Array.from($.entries(obj), ([k, v]) => [k, serialize(v)])
-            )
+            value: Object.fromEntries(entries)
+         };
+      },
+
+      serializeFunction: function (func, res) {
+         // Add 'hash' to res, and 'value' only if the source was not sent before
+         let {hash, source} = $.functionRef(func);
+
+         res['hash'] = hash;
+         if (source !== undefined) {
+            res['value'] = source;
+         }
+
+         return res;
+      },
+
+      functionRef: function (func) {
+         // Return {hash, source}.  source is undefined if it was already sent over the
+         // current socket.
+         let {source, hash} = $.functionSourceAndHash(func);
+
+         $.functionsEmitted = true;
+
+         if ($.sentSources.has(hash)) {
+            return {hash, source: undefined};
+         }
+
+         $.sentSources.set(hash, source);
+         return {hash, source};
+      },
+
+      functionSourceAndHash: function (func) {
+         let cached = $.functionHashes.get(func);
+
+         if (cached === undefined) {
+            let source = func.toString();
+            cached = {
+               source,
+               hash: `${$.cyrb53(source).toString(16)}-${source.length}`
+            };
+            $.functionHashes.set(func, cached);
+         }
+
+         return cached;
+      },
+
+      cyrb53: function (str, seed=0) {
+         // Fast non-cryptographic 53-bit string hash
+         let h1 = 0xdeadbeef ^ seed, h2 = 0x41c6ce57 ^ seed;
+
+         for (let i = 0; i < str.length; i++) {
+            let ch = str.charCodeAt(i);
+            h1 = Math.imul(h1 ^ ch, 2654435761);
+            h2 = Math.imul(h2 ^ ch, 1597334677);
+         }
+
+         h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^
+              Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+         h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^
+              Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+
+         return 4294967296 * (2097151 & h2) + (h1 >>> 0);
+      },
+
+      browseExpansion: function (values, depth=0, nodesLeft=$.browseLimits.maxNodes) {
+         // Set of composites among values (which are at depth) and their descendants to
+         // be serialized with their children for browsing.  Nodes are counted level by
+         // level, so that a deep or wide subtree of one value cannot use up the budget
+         // before shallower parts of other values are expanded.
+         let expanded = new Set();
+         let level = values;
+
+         for (; level.length > 0 && depth <= $.browseLimits.maxDepth; depth += 1) {
+            let nextLevel = [];
+
+            for (let obj of level) {
+               let children = $.compositeChildren(obj);
+               // The top-level value is always expanded, otherwise there'd be no progress
+               if (children === null || (depth > 0 && children.length > nodesLeft)) {
+                  continue;
+               }
+
+               nodesLeft -= children.length;
+               expanded.add(obj);
+               for (let child of children) {
+                  nextLevel.push(child);
+               }
+            }
+
+            level = nextLevel;
+         }
+
+         return expanded;
+      },
+
+      compositeChildren: function (obj) {
+         // Child values of an array or a plain object, null for anything else
+         if (obj instanceof Array) {
+            return obj;
+         }
+         if (typeof obj === 'object' && obj !== null &&
+               Object.getPrototypeOf(obj) === Object.prototype) {
+            return Array.from($.entries(obj), ([k, v]) => v);
+         }
+
+         return null;
+      },
+
+      unexpanded: function (kind, size) {
+         if ($.encoding === 'compact') {
+            return ['u', kind, size];
+         }
+
+         return {
+            type: 'unexpanded',
+            kind,
+            size
+         };
+      },
+
+      serializeModule: function (module, browse=false) {
+         let entries = Array.from($.entries(module.value));
+         let expanded = null;
+
+         if (browse) {
+            // The module object itself is always expanded
+            let tracked = entries.filter(([key]) => !$.isKeyUntracked(module, key));
+            expanded = $.browseExpansion(
+               tracked.map(([key, value]) => value),
+               1,
+               $.browseLimits.maxNodes - entries.length
+            );
+         }
+
+         return {
+            object: $.jsObject(entries.map(([key, value]) => [
+               key,
+               $.isKeyUntracked(module, key) ?
+                  $.serialize('new Object()') : $.serialize(value, expanded)
+            ])),
+            epoch: $.epoch,
+            version: module.version
          };
       },
 
@@ -463,7 +811,7 @@
          };
       
          if (deeply) {
-            res['value'] = func.toString();
+            $.serializeFunction(func, res);
          }
       
          return res;
@@ -480,7 +828,19 @@
             value['init'].call(null);
          }
    
-         return Object.assign({}, module, {projectId, value});
+         return $.makeModule(module, projectId, value);
+      },
+
+      makeModule: function (module, projectId, value) {
+         return Object.assign({}, module, {
+            projectId,
+            value,
+            // Incremented with each change descriptor sent for the module
+            version: 0,
+            // Latest change descriptors, ending with the one of the current version:
+            // [{desc, sources: Map {hash: source} of the functions desc refers to}]
+            changeLog: []
+         });
       },
 
       loadModules: function (modules, sources, projectId) {
@@ -500,6 +860,39 @@
       },
 
       opHandlers: {
+         batch: function ({operations}) {
+            if ($.batchResults !== null) {
+               throw new Error("Nested batches are not supported");
+            }
+
+            let results = [];
+
+            $.batchResults = results;
+            try {
+               for (let {operation, args} of operations) {
+                  let nResults = results.length;
+
+                  try {
+                     $.opHandlers[operation].call(null, args);
+                  }
+                  catch (e) {
+                     results.length = nResults;
+                     $.opExc('generic', {
+                        message: e.stack
+                     });
+                  }
+
+                  if (results.length === nResults) {
+                     $.opReturn();
+                  }
+               }
+            }
+            finally {
+               $.batchResults = null;
+            }
+
+            $.opReturn(results);
+         },
          getProjects: function () {
             $.opReturn(
                   Object.values($.projects).map(proj => ({
@@ -579,32 +972,51 @@
 
             $.opReturn();
          },
+         setEncoding: function ({encoding}) {
+            if (encoding !== 'dicts' && encoding !== 'compact') {
+               throw new Error(`Unknown encoding: ${encoding}`);
+            }
+
+            $.encoding = encoding;
+            $.opReturn();
+         },
+         getFunctionSources: function ({hashes}) {
+            let sources = {};
+
+            for (let hash of hashes) {
+               sources[hash] = $.sentSources.has(hash) ? $.sentSources.get(hash) : null;
+            }
+
+            $.opReturn(sources);
+         },
          getKeyAt: function ({mid, path}) {
             $.opReturn($.keyAt($.moduleObject(mid), path));
          },
          getValueAt: function ({mid, path}) {
-            $.opReturn(
-               $.serialize($.valueAt($.moduleObject(mid), path))
-            );
+            let value = $.valueAt($.moduleObject(mid), path);
+            $.opReturn($.serialize(value, $.browseExpansion([value])));
          },
          getModuleObject: function ({mid}) {
+            $.opReturn($.serializeModule($.modules[mid], true));
+         },
+         getModuleChanges: function ({mid, epoch, sinceVersion}) {
             let
-               result = {},
-               module = $.modules[mid];
-         
-            for (let [key, value] of $.entries(module.value)) {
-               if ($.isKeyUntracked(module, key)) {
-                  result[key] = $.serialize('new Object()');
-               }
-               else {
-                  result[key] = $.serialize(value);
-               }
+               module = $.modules[mid],
+               descriptors = epoch === $.epoch ?
+                  $.moduleChangesSince(module, sinceVersion) : null;
+
+            if (descriptors === null) {
+               $.opReturn({
+                  type: 'snapshot',
+                  snapshot: $.serializeModule(module, true)
+               });
+            }
+            else {
+               $.opReturn({
+                  type: 'delta',
+                  descriptors: descriptors
+               });
             }
-         
-            $.opReturn({
-               'type': 'object',
-               'value': result
-            });
          },
          replace: function ({mid, path, codeNewValue}) {
             let 
@@ -692,7 +1104,6 @@
             let 
                module = $.modules[mid],
                {parent, key} = $.parentKeyAt(module.value, path),
-               value = parent[key],
                newPos;
          
             if (parent instanceof Array) {
@@ -706,19 +1117,12 @@
             let newPath = path.slice(0, -1);
             newPath.push(newPos);
          
-            $.persistInModule(module, [
-               {
-                  operation: 'delete',
-                  path: path
-               }, 
-               {
-                  operation: 'insert',
-                  path: newPath,
-                  key: parent instanceof Array ? null : key,
-                  value: $.isKeyUntracked(module, key) ?
-                     $.serialize('new Object()') : $.serialize(value)
-               }
-            ]);
+            // The entry's source text is relocated as is, nothing is serialized
+            $.persistInModule(module, {
+               operation: 'move',
+               path: path,
+               newPath: newPath
+            });
             $.opReturn(newPath);
          },
          deleteEntry: function ({mid, path}) {
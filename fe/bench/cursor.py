@@ -0,0 +1,132 @@
+"""Benchmark JS-aware navigation of module sources
+
+Run from the fe/ directory:
+
+    python -m bench.cursor [module.js]
+
+This times the pure-Python scanning (js_text) that cursors do over a snapshot of the view
+text, and counts the tokens it passes by.  Cursors used to do a view.find() and a
+view.substr() per token, which can only be timed inside Sublime.  To compare with the
+cursors of some git revision (e.g. one from before the snapshot scanning) on a real view,
+open a module source and run this in the Sublime console:
+
+    import bench.cursor; bench.cursor.compare_in_view(window.active_view(), 'REVISION')
+
+Without the argument, a synthetic module is used.
+"""
+
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import types
+
+from copy import copy
+
+from headless_be.loadgen import generate_module_value
+from headless_be.loadgen import module_template
+from headless_be.loadgen import render
+from live.shared.js_text import js_go
+from live.shared.js_text import re_of_interest
+from live.shared.source_index import SourceIndex
+from live.shared.source_index import re_module_root
+
+
+def synthetic_source(n_entries=5000):
+    value = generate_module_value(random.Random(0), n_entries, 3)
+    return module_template.format(value=render(value, 1))
+
+
+def measure(fn, repeat=3):
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def walk_top_level(text):
+    """Go over top-level entries one by one, like StructuredCursor.goto_nth_entry()"""
+    pos = re_module_root.search(text).end() + 1
+    n = 1
+    while True:
+        found, pos = js_go(text, pos, r',\s*', including=True)
+        if not found:
+            return n
+        n += 1
+
+
+def walk_entries(cur):
+    """Visit all entries nested in the container cur has just entered
+
+    :return: number of entries visited
+    """
+    n = 0
+    cur.skip_ws()
+    while not cur.is_at_container_end:
+        n += 1
+        probe = copy(cur)
+        if probe.inside_what == 'object':
+            probe.goto_object_value()
+        if probe.looking_at_container is not None:
+            sub = copy(cur)
+            sub.enter()
+            n += walk_entries(sub)
+        cur.goto_next_entry_or_end()
+
+    return n
+
+
+def cursor_class_at(revision):
+    """StructuredCursor as defined in live/shared/js_cursor.py at the git revision"""
+    source = subprocess.check_output(
+        ['git', 'show', '{}:./live/shared/js_cursor.py'.format(revision)],
+        cwd=os.path.join(os.path.dirname(__file__), '..')
+    ).decode('utf8')
+    module = types.ModuleType('js_cursor_at_{}'.format(revision))
+    exec(compile(source, module.__name__, 'exec'), module.__dict__)
+    return module.StructuredCursor
+
+
+def compare_in_view(view, revision, repeat=3):
+    """Visit every entry of the module source in view with the cursors of the git
+    revision and with the current ones
+    """
+    from live.shared.js_cursor import StructuredCursor
+
+    for name, cursor_class in [(revision, cursor_class_at(revision)),
+                               ('current', StructuredCursor)]:
+        def walk():
+            # Same as PersistCursor.at_module_root()
+            cur = cursor_class(0, view, inside_what='array', root_nesting=1)
+            cur.go_past(r'let \$ = (?=\{)')
+            cur.enter()
+            return walk_entries(cur)
+
+        n = walk()
+        print("{:>10}: {} entries, {:8.1f} ms".format(
+            name, n, measure(walk, repeat) * 1000
+        ))
+
+
+def main(source_path=None):
+    if source_path is None:
+        text = synthetic_source()
+    else:
+        with open(source_path, 'r', encoding='utf8') as fl:
+            text = fl.read()
+
+    n_tokens = len(re.findall(re_of_interest, text))
+    print("{:.1f} KB, {} tokens of interest (2 Sublime API calls each when scanning "
+          "the view)".format(len(text) / 1024, n_tokens))
+    print("index: {:8.1f} ms".format(measure(lambda: SourceIndex(text)) * 1000))
+    print("walk top level ({} entries): {:8.1f} ms".format(
+        walk_top_level(text), measure(lambda: walk_top_level(text)) * 1000
+    ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,93 @@
+"""Benchmark decoding of BE messages
+
+Run from the fe/ directory:
+
+    python -m bench.decode [size_mb]
+
+Compares the old way (UTF-8 bytes -> str -> json.loads with OrderedDict) to what the
+decode worker does (decode_json).  Besides throughput, measures for how long the thread
+that decodes keeps another thread (think the eventloop) from running.
+"""
+
+import collections
+import json
+import sys
+import threading
+import time
+
+from live.common.json_decode import decode_json
+
+
+def make_message(size):
+    """Make a 'result' message resembling a big getModuleObject response"""
+    entries = []
+    total = 0
+    i = 0
+    while total < size:
+        entry = collections.OrderedDict([
+            ('type', 'function'),
+            ('value', 'function fn{}(a, b) {{\n   return a + b * {};\n}}'.format(i, i)),
+            ('props', {'name': 'fn{}'.format(i), 'length': 2}),
+            ('keys', ['alpha', 'beta', 'gamma', 'дельта'])
+        ])
+        entries.append(['key{}'.format(i), entry])
+        total += 150
+        i += 1
+
+    return json.dumps({
+        'type': 'result',
+        'success': True,
+        'value': {'type': 'object', 'value': entries}
+    }).encode('utf-8')
+
+
+def old_decode(data):
+    return json.loads(data.decode('utf-8'), object_pairs_hook=collections.OrderedDict)
+
+
+def measure(fn, data, repeat):
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_stall(fn, data):
+    """Longest time another thread is kept from running while fn(data) runs in a thread
+
+    The other thread wants to wake up every millisecond.  The decoded message is kept
+    till the end: freeing it takes a while too, but that's up to whoever consumes it.
+    """
+    done = threading.Event()
+    results = []
+    thread = threading.Thread(target=lambda: (results.append(fn(data)), done.set()))
+
+    longest = 0
+    last = time.perf_counter()
+    thread.start()
+    while not done.is_set():
+        time.sleep(0.001)
+        now = time.perf_counter()
+        longest = max(longest, now - last)
+        last = now
+
+    thread.join()
+    return longest
+
+
+def main(size_mb=20.0, repeat=3):
+    data = make_message(int(size_mb * 1024 * 1024))
+    mb = len(data) / (1024 * 1024)
+    print("Message size: {:.1f} MB".format(mb))
+
+    for name, fn in [('str + OrderedDict', old_decode), ('decode_json', decode_json)]:
+        elapsed = measure(fn, data, repeat)
+        stall = measure_stall(fn, data)
+        print("{:>20}: {:7.1f} ms, {:6.1f} MB/s, other thread stalled for {:6.1f} ms"
+              .format(name, elapsed * 1000, mb / elapsed, stall * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:2]))
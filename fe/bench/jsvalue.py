@@ -0,0 +1,102 @@
+"""Benchmark the dicts vs compact encodings of JS values
+
+Run from the fe/ directory:
+
+    python -m bench.jsvalue [snapshot.json]
+
+snapshot.json is a real module serialized in the dicts encoding.  To get one, run this in
+the console of the browser where the BE lives (the result is put into the clipboard):
+
+    live.encoding = 'dicts';
+    copy(JSON.stringify(live.serializeModule(live.modules['<module id>']).object))
+
+Without the argument, a synthetic module is used.
+"""
+
+import json
+import sys
+import time
+
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+from live.shared.jsvalue import jsval_type
+
+
+def to_compact(jsval):
+    jstype = jsval_type(jsval)
+    if jstype == 'leaf':
+        return ['l', jsval['value']]
+    elif jstype == 'function':
+        return ['f', jsval.get('hash', ''), jsval['value']]
+    elif jstype == 'unexpanded':
+        return ['u', jsval['kind'], jsval['size']]
+    elif jstype == 'object':
+        res = ['o']
+        for key, value in jsval_object_items(jsval):
+            res.append(key)
+            res.append(to_compact(value))
+        return res
+    else:
+        return ['a'] + [to_compact(value) for value in jsval_array_items(jsval)]
+
+
+def walk(jsval):
+    """Visit every node, the way an insert_js_value() does"""
+    jstype = jsval_type(jsval)
+    if jstype == 'object':
+        for key, value in jsval_object_items(jsval):
+            walk(value)
+    elif jstype == 'array':
+        for value in jsval_array_items(jsval):
+            walk(value)
+
+
+def synthetic_module(n_entries=20000):
+    def leaf(text):
+        return {'type': 'leaf', 'value': text}
+
+    return {
+        'type': 'object',
+        'value': {
+            'table{}'.format(i): {
+                'type': 'array',
+                'value': [
+                    leaf(str(i)),
+                    leaf('"name-{}"'.format(i)),
+                    {'type': 'object', 'value': {'x': leaf('1'), 'y': leaf('null')}},
+                    {'type': 'function', 'hash': 'h{}'.format(i),
+                     'value': 'function () {{ return {}; }}'.format(i)}
+                ]
+            }
+            for i in range(n_entries)
+        }
+    }
+
+
+def measure(fn, repeat=3):
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(snapshot_path=None):
+    if snapshot_path is None:
+        dicts = synthetic_module()
+    else:
+        with open(snapshot_path, 'r') as fl:
+            dicts = json.load(fl)
+
+    for name, jsval in [('dicts', dicts), ('compact', to_compact(dicts))]:
+        data = json.dumps(jsval).encode('utf-8')
+        parse = measure(lambda: json.loads(data.decode('utf-8')))
+        walk_time = measure(lambda: walk(jsval))
+        print("{:>8}: {:8.1f} KB, parse {:6.1f} ms, walk {:6.1f} ms".format(
+            name, len(data) / 1024, parse * 1000, walk_time * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,80 @@
+"""Benchmark navigation of module browser node trees
+
+Nodes keep their positions, depth and root, so that getting a node's path or its
+siblings doesn't depend on the number of siblings.  Nodes need the sublime module, so run
+this in the Sublime console:
+
+    import bench.nodes; bench.nodes.main(window.new_file())
+
+The tree is an object with n_keys keys, each holding a small object.
+"""
+
+from bench.render import measure
+from headless_be.backend import Backend
+from headless_be.model import JsObject
+from headless_be.model import number_leaf
+from live.shared.js_render import TextCursor
+
+
+def wide_jsval(n_keys):
+    backend = Backend()
+    backend.encoding = 'compact'
+    return backend.serialize(JsObject(
+        ('key{}'.format(i), JsObject([
+            ('a', number_leaf(i)), ('b', number_leaf(-i)), ('c', number_leaf(i * 2))
+        ]))
+        for i in range(n_keys)
+    ))
+
+
+def main(view, n_keys=5000, repeat=3):
+    import sublime
+
+    from live.code.browser.nodes import render_nodes
+    from live.sublime.edit import call_ensuring_edit_for
+    from live.sublime.edit import edit_for
+
+    tcur = TextCursor()
+    root, _ = render_nodes(tcur, wide_jsval(int(n_keys)))
+
+    def put_in_view():
+        view.erase(edit_for[view], sublime.Region(0, view.size()))
+        view.insert(edit_for[view], 0, tcur.text)
+
+    call_ensuring_edit_for(view, put_in_view)
+    root.put_online(view)
+
+    values = root.value_nodes
+    leaves = [leaf for value in values for leaf in value.value_nodes]
+
+    def paths():
+        for leaf in leaves:
+            leaf.path
+
+    def siblings():
+        for value in values:
+            value.following_sibling
+            value.preceding_sibling
+            value.keyval_match
+
+    def depths():
+        for leaf in leaves:
+            leaf.depth
+            leaf.is_online
+
+    # Every get_regions() call returns all the regions under the key, so sample
+    sample = values[::max(1, len(values) // 100)]
+
+    def regions():
+        for value in sample:
+            value.region
+
+    print("{} keys, {} leaves".format(len(values), len(leaves)))
+    for name, fn, n in [('path', paths, len(leaves)),
+                        ('siblings', siblings, len(values)),
+                        ('depth', depths, len(leaves)),
+                        ('region', regions, len(sample))]:
+        best = measure(fn, repeat)
+        print("{:>8}: {:8.2f} us per node".format(name, best / n * 10 ** 6))
+
+    root.put_offline()
@@ -0,0 +1,100 @@
+"""Benchmark rendering of JS values into text
+
+Run from the fe/ directory:
+
+    python -m bench.render [n_entries]
+
+This times rendering of a synthetic module value with a TextCursor, and counts the
+inserts a StructuredCursor would make for the same text (each one a Sublime API call).
+To compare the two on a real view, run this in the Sublime console:
+
+    import bench.render; bench.render.compare_in_view(window.new_file())
+"""
+
+import random
+import sys
+import time
+
+from headless_be.backend import Backend
+from headless_be.loadgen import generate_module_value
+from live.shared.js_render import TextCursor
+from live.shared.js_render import js_value_text
+from live.shared.js_render import render_js_value
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+from live.shared.jsvalue import jsval_type
+
+
+def synthetic_jsval(n_entries):
+    backend = Backend()
+    backend.encoding = 'compact'
+    return backend.serialize(generate_module_value(random.Random(0), n_entries, 3))
+
+
+def count_nodes(jsval):
+    jstype = jsval_type(jsval)
+    if jstype == 'object':
+        return 1 + sum(count_nodes(value) for key, value in jsval_object_items(jsval))
+    if jstype == 'array':
+        return 1 + sum(count_nodes(value) for value in jsval_array_items(jsval))
+    return 1
+
+
+def measure(fn, repeat=3):
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare_in_view(view, n_entries=3000, repeat=3):
+    """Insert a synthetic module value into view piece by piece, and in one go"""
+    import sublime
+
+    from live.shared.js_cursor import StructuredCursor
+    from live.sublime.edit import call_ensuring_edit_for
+    from live.sublime.edit import edit_for
+
+    jsval = synthetic_jsval(n_entries)
+
+    def by_cursor(cur):
+        render_js_value(cur, jsval)
+
+    def at_once(cur):
+        cur.insert(js_value_text(cur, jsval))
+
+    for name, insert in [('cursor', by_cursor), ('at once', at_once)]:
+        best = float('inf')
+        for i in range(repeat):
+            def run():
+                view.erase(edit_for[view], sublime.Region(0, view.size()))
+                start = time.perf_counter()
+                insert(StructuredCursor(0, view))
+                return time.perf_counter() - start
+
+            best = min(best, call_ensuring_edit_for(view, run))
+
+        print("{:>8}: {:8.1f} ms".format(name, best * 1000))
+
+
+def main(n_entries=3000):
+    jsval = synthetic_jsval(int(n_entries))
+
+    cur = TextCursor()
+    render_js_value(cur, jsval)
+    print("{} nodes, {:.1f} KB of text, {} inserts with a StructuredCursor".format(
+        count_nodes(jsval), len(cur.text) / 1024, len(cur.pieces)
+    ))
+
+    def render():
+        cur = TextCursor()
+        render_js_value(cur, jsval)
+        return cur.text
+
+    print("render: {:8.1f} ms".format(measure(render) * 1000))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,12 @@
+"""Headless stand-in for be/live.js, in pure Python
+
+It speaks the same websocket protocol as the browser BE, so the FE (HTTP server, websocket,
+ws_handler, persist pipeline) can be exercised without a browser:
+
+    python -m headless_be run [--port 8088] [--churn 50]
+    python -m headless_be generate <dir> [--modules 3] [--entries 5000]
+
+JS values are kept in an in-memory object model (see model.py).  Modules are parsed
+rather than executed, so only data and function definitions are supported in them, and
+expressions sent by the FE (new values, REPL) are limited to literals and $-paths.
+"""
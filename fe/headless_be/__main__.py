@@ -0,0 +1,149 @@
+"""Run from the fe/ directory:
+
+    python -m headless_be run [--port 8088] [--churn EDITS_PER_SEC] [--seed N]
+
+Bootloads like be/_bootload_template.js does (fetching the project file and module
+sources from the FE server), connects to the FE and serves its requests.  With --churn,
+random edits are made to modules of the projects the FE loads, so that persist
+descriptors keep flowing (the BE's own project is never edited).
+
+    python -m headless_be generate DIR [--modules 3] [--entries 5000] [--depth 3]
+
+Writes a synthetic project into DIR.  Open DIR in Sublime and load it as a LiveJS project
+to have it loaded into the BE.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import urllib.request
+
+from .backend import Backend
+from .loadgen import random_edit
+from .loadgen import write_project
+from .wsclient import ConnectionClosed
+from .wsclient import WsClient
+
+
+def fetch(host, port, path):
+    url = 'http://{}:{}{}'.format(host, port, path)
+    with urllib.request.urlopen(url) as response:
+        return response.read().decode('utf8')
+
+
+def bootload(be, host, port):
+    bootload_code = fetch(host, port, '/')
+
+    def constant(name):
+        start = bootload_code.index(name + ' = ') + len(name + ' = ')
+        value, end = json.JSONDecoder().raw_decode(bootload_code, start)
+        return value
+
+    project_path = constant('PROJECT_PATH')
+    project = json.loads(fetch(host, port, '/bootload/' + constant('PROJECT_FILE_NAME')))
+    sources = {
+        module['id']: fetch(host, port, '/bootload/{}.js'.format(module['name']))
+        for module in project['modules']
+    }
+
+    be.bootload(project_path, project, sources)
+    print("Bootloaded project {} ({} modules)".format(
+        project['projectName'], len(project['modules'])
+    ))
+
+
+def serve(be, client, rng, churn):
+    interval = 1.0 / churn if churn else None
+    next_edit_at = time.perf_counter() + interval if interval else None
+    n_messages = n_edits = 0
+
+    try:
+        while True:
+            timeout = None
+            if next_edit_at is not None:
+                timeout = max(0.0, next_edit_at - time.perf_counter())
+
+            message = client.recv_message(timeout)
+            if message is not None:
+                be.handle_message(message)
+                n_messages += 1
+
+            if next_edit_at is not None and time.perf_counter() >= next_edit_at:
+                if random_edit(be, rng) is not None:
+                    n_edits += 1
+                # Don't try to catch up if we're lagging behind
+                next_edit_at = max(next_edit_at + interval, time.perf_counter())
+    finally:
+        print("Served {} requests, made {} edits".format(n_messages, n_edits))
+
+
+def run(args):
+    be = Backend()
+    bootload(be, args.host, args.port)
+
+    client = WsClient(args.host, args.port, '/ws?session={}'.format(be.session_id))
+    rng = random.Random(args.seed)
+
+    while True:
+        try:
+            client.connect()
+        except (OSError, ConnectionClosed) as e:
+            print("Could not connect to the FE: {}".format(e))
+            time.sleep(1.0)
+            continue
+
+        print("Connected to the FE as session {}".format(be.session_id))
+        be.connected(client.send_text)
+        try:
+            serve(be, client, rng, args.churn)
+        except (OSError, ConnectionClosed) as e:
+            print("Disconnected: {}".format(e))
+        finally:
+            client.close()
+
+        time.sleep(1.0)
+
+
+def generate(args):
+    write_project(args.dir, random.Random(args.seed), args.modules, args.entries,
+                  args.depth)
+    print("Generated project in {}".format(args.dir))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m headless_be')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="connect to the FE and serve it")
+    run_parser.add_argument('--host', default='localhost')
+    run_parser.add_argument('--port', type=int, default=8088)
+    run_parser.add_argument('--churn', type=float, default=0,
+                            help="random edits per second")
+    run_parser.add_argument('--seed', type=int, default=None)
+    run_parser.set_defaults(func=run)
+
+    gen_parser = subparsers.add_parser('generate', help="write a synthetic project")
+    gen_parser.add_argument('dir')
+    gen_parser.add_argument('--modules', type=int, default=3)
+    gen_parser.add_argument('--entries', type=int, default=5000,
+                            help="top-level entries per module")
+    gen_parser.add_argument('--depth', type=int, default=3,
+                            help="max nesting of generated values")
+    gen_parser.add_argument('--seed', type=int, default=None)
+    gen_parser.set_defaults(func=generate)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,697 @@
+"""The headless BE proper: state and operation handlers, mirroring be/live.js
+
+Backend is not concerned with transport.  Incoming messages are fed to handle_message(),
+outgoing ones are passed to the send callback given to connected().
+"""
+
+import binascii
+import json
+import os
+import traceback
+
+from .jsparse import parse_expression
+from .jsparse import parse_module_source
+from .model import JsFunction
+from .model import JsLeaf
+from .model import JsObject
+from .model import string_leaf
+
+
+# Untracked values are shown like this in module browsers (same as in live.js)
+UNTRACKED_PLACEHOLDER = string_leaf('new Object()')
+
+# Stands in for Object.prototype when objects are inspected
+OBJECT_PROTOTYPE = JsObject()
+
+op_handlers = {}
+
+
+def op_handler(name):
+    def wrapper(fn):
+        assert name not in op_handlers
+        op_handlers[name] = fn
+        return fn
+
+    return wrapper
+
+
+class OpError(Exception):
+    """Makes the operation fail with the given error name and info"""
+
+    def __init__(self, error, **info):
+        self.error = error
+        self.info = info
+
+
+def function_hashes_in(x):
+    """Hashes of the functions referred to in x (a descriptor or a part of it)"""
+    hashes = set()
+    stack = [x]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            if item and item[0] == 'f':
+                hashes.add(item[1])
+            else:
+                stack.extend(item)
+        elif isinstance(item, dict):
+            if item.get('type') == 'function':
+                hashes.add(item['hash'])
+            else:
+                stack.extend(item.values())
+
+    return hashes
+
+
+def random_hex_id():
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+class Module:
+    def __init__(self, id, name, project_id, untracked, value):
+        self.id = id
+        self.name = name
+        self.project_id = project_id
+        self.untracked = untracked
+        self.value = value
+        # Incremented with each change descriptor sent for the module
+        self.version = 0
+        # Latest change descriptors, ending with the one of the current version:
+        # [(desc, {hash: source} of the functions desc refers to)]
+        self.change_log = []
+
+
+class Project:
+    def __init__(self, id, name, path, modules):
+        self.id = id
+        self.name = name
+        self.path = path
+        self.modules = {module.id: module for module in modules}
+
+
+class Backend:
+    change_log_size = 1000
+    browse_max_depth = 8
+    browse_max_nodes = 3000
+
+    def __init__(self):
+        self.projects = {}
+        self.modules = {}
+        # Survives reconnects, same as in live.js
+        self.session_id = random_hex_id()
+        self.epoch = random_hex_id()
+        self.bootstrap_project_id = None
+        self.inspection_spaces = {}
+        self.send_message = None
+        self.cur_request_id = None
+        self.batch_results = None
+        self.functions_emitted = False
+        self.sent_sources = {}
+        self.encoding = 'dicts'
+
+    def bootload(self, project_path, project, sources):
+        """Load the project the BE starts with (what $.bootload does in live.js)"""
+        self.load_project(project_path, project, sources)
+        self.bootstrap_project_id = project['projectId']
+
+    def connected(self, send_message):
+        """Start serving a new connection
+
+        :param send_message: callable taking a message (JSON str) to send to the FE
+        """
+        self.send_message = send_message
+        # The FE may have restarted, so it doesn't necessarily know any of the sources
+        self.sent_sources = {}
+        self.encoding = 'dicts'
+
+    def handle_message(self, text):
+        msg = json.loads(text)
+
+        self.cur_request_id = msg['requestId']
+        try:
+            self.run_op(msg['operation'], msg['args'])
+        finally:
+            self.cur_request_id = None
+
+    def run_op(self, operation, args):
+        try:
+            value = op_handlers[operation](self, **args)
+        except OpError as e:
+            self.respond({'success': False, 'error': e.error, 'info': e.info})
+        except Exception:
+            self.respond({
+                'success': False,
+                'error': 'generic',
+                'info': {'message': traceback.format_exc()}
+            })
+        else:
+            self.respond({'success': True, 'value': value})
+
+    def send(self, message):
+        if self.functions_emitted:
+            message['hasFunctions'] = True
+            if self.batch_results is None:
+                self.functions_emitted = False
+
+        self.send_message(json.dumps(message, ensure_ascii=False, separators=(',', ':')))
+
+    def respond(self, result):
+        if self.batch_results is not None:
+            self.batch_results.append(result)
+        else:
+            message = {'type': 'result', 'requestId': self.cur_request_id}
+            message.update(result)
+            self.send(message)
+
+    def persist_in_module(self, module, descriptors):
+        for desc in descriptors:
+            desc['projectId'] = module.project_id
+            desc['moduleId'] = module.id
+            desc['moduleName'] = module.name
+            module.version += 1
+            desc['version'] = module.version
+
+        # Function sources are logged along, since the descriptors may be served over a
+        # later connection that the sources have not been sent to
+        module.change_log.extend(
+            (desc, {hash: self.sent_sources[hash] for hash in function_hashes_in(desc)})
+            for desc in descriptors
+        )
+        del module.change_log[:-self.change_log_size]
+
+        self.send({'type': 'persist', 'descriptors': descriptors})
+
+    def module_changes_since(self, module, since_version):
+        oldest_logged = module.version - len(module.change_log)
+        if since_version < oldest_logged or since_version > module.version:
+            return None
+
+        return [self.with_unsent_sources(desc, sources)
+                for desc, sources in module.change_log[since_version - oldest_logged:]]
+
+    def with_unsent_sources(self, x, sources):
+        """Copy of x (a logged descriptor or a part of it) with sources put into references
+        to functions whose sources were not sent over this connection
+        """
+        if isinstance(x, list):
+            if x and x[0] == 'f':
+                source = self.unsent_source(x[1], sources)
+                return x if source is None else ['f', x[1], source]
+            return [self.with_unsent_sources(item, sources) for item in x]
+
+        if isinstance(x, dict):
+            if x.get('type') == 'function':
+                source = self.unsent_source(x['hash'], sources)
+                return x if source is None else dict(x, value=source)
+            return {k: self.with_unsent_sources(v, sources) for k, v in x.items()}
+
+        return x
+
+    def unsent_source(self, hash, sources):
+        """:return: source to send along with a reference, None if sent already"""
+        self.functions_emitted = True
+
+        if hash in self.sent_sources:
+            return None
+
+        self.sent_sources[hash] = sources[hash]
+        return sources[hash]
+
+    def load_project(self, project_path, project, sources):
+        if project['projectId'] in self.projects:
+            raise RuntimeError("Project is already loaded")
+        if any(m['id'] in self.modules for m in project['modules']):
+            raise RuntimeError("Duplicate module id")
+
+        modules = [
+            self.load_module(m, sources, project['projectId'])
+            for m in project['modules']
+        ]
+        self.projects[project['projectId']] = Project(
+            id=project['projectId'],
+            name=project['projectName'],
+            path=project_path,
+            modules=modules
+        )
+        self.modules.update((module.id, module) for module in modules)
+
+    def load_module(self, module, sources, project_id):
+        source = sources.get(module['id'])
+        if not source:
+            raise RuntimeError(
+                "Not provided source code for module {}".format(module['name'])
+            )
+
+        return Module(
+            id=module['id'],
+            name=module['name'],
+            project_id=project_id,
+            untracked=module.get('untracked', []),
+            value=parse_module_source(source)
+        )
+
+    # Serialization of tracked values (see jsvalue-protocol.txt)
+
+    def browse_expansion(self, values, depth=0, nodes_left=None):
+        """Set of ids of composites to serialize with their children, see live.js"""
+        if nodes_left is None:
+            nodes_left = self.browse_max_nodes
+        expanded = set()
+        level = values
+
+        while level and depth <= self.browse_max_depth:
+            next_level = []
+            for value in level:
+                children = composite_children(value)
+                if children is None or depth > 0 and len(children) > nodes_left:
+                    continue
+
+                nodes_left -= len(children)
+                expanded.add(id(value))
+                next_level.extend(children)
+
+            level = next_level
+            depth += 1
+
+        return expanded
+
+    def serialize(self, value, expanded=None):
+        if isinstance(value, JsLeaf):
+            return self.js_leaf(value.text)
+        if isinstance(value, JsFunction):
+            return self.js_function(value)
+        if isinstance(value, list):
+            if expanded is not None and id(value) not in expanded:
+                return self.unexpanded('array', len(value))
+            return self.js_array([self.serialize(item, expanded) for item in value])
+
+        if expanded is not None and id(value) not in expanded:
+            return self.unexpanded('object', len(value))
+        return self.js_object([
+            (key, self.serialize(item, expanded)) for key, item in value.items()
+        ])
+
+    def js_leaf(self, text):
+        if self.encoding == 'compact':
+            return ['l', text]
+        return {'type': 'leaf', 'value': text}
+
+    def js_function(self, func):
+        if self.encoding == 'compact':
+            hash, source = self.function_ref(func)
+            return ['f', hash] if source is None else ['f', hash, source]
+        return self.serialize_function(func, {'type': 'function'})
+
+    def js_array(self, items):
+        if self.encoding == 'compact':
+            return ['a'] + items
+        return {'type': 'array', 'value': items}
+
+    def js_object(self, entries):
+        if self.encoding == 'compact':
+            res = ['o']
+            for key, value in entries:
+                res.append(key)
+                res.append(value)
+            return res
+        return {'type': 'object', 'value': dict(entries)}
+
+    def unexpanded(self, kind, size):
+        if self.encoding == 'compact':
+            return ['u', kind, size]
+        return {'type': 'unexpanded', 'kind': kind, 'size': size}
+
+    def serialize_function(self, func, res):
+        res['hash'], source = self.function_ref(func)
+        if source is not None:
+            res['value'] = source
+        return res
+
+    def function_ref(self, func):
+        """:return: (hash, source), source is None if it was sent over this connection"""
+        self.functions_emitted = True
+
+        hash = func.hash
+        if hash in self.sent_sources:
+            return hash, None
+
+        self.sent_sources[hash] = func.source
+        return hash, func.source
+
+    def serialize_module(self, module, browse=False):
+        items = module.value.items()
+        expanded = None
+        if browse:
+            # The module object itself is always expanded
+            expanded = self.browse_expansion(
+                [value for key, value in items if key not in module.untracked],
+                1, self.browse_max_nodes - len(items)
+            )
+
+        return {
+            'object': self.js_object([
+                (key, self.serialize(UNTRACKED_PLACEHOLDER) if key in module.untracked
+                 else self.serialize(value, expanded))
+                for key, value in items
+            ]),
+            'epoch': self.epoch,
+            'version': module.version
+        }
+
+    # Inspection (REPL)
+
+    def inspection_space(self, space_id):
+        space = self.inspection_spaces.get(space_id)
+        if space is None:
+            space = self.inspection_spaces[space_id] = {
+                'obj2id': {},
+                'id2obj': {},
+                'nextId': 1
+            }
+        return space
+
+    def inspectee_id(self, space, obj):
+        # Lists are unhashable, so objects are keyed by identity.  id2obj keeps them alive.
+        inspectee_id = space['obj2id'].get(id(obj))
+        if inspectee_id is None:
+            inspectee_id = space['nextId']
+            space['nextId'] += 1
+            space['obj2id'][id(obj)] = inspectee_id
+            space['id2obj'][inspectee_id] = obj
+        return inspectee_id
+
+    def inspect(self, space, obj, deeply):
+        if isinstance(obj, JsLeaf):
+            return {'type': 'leaf', 'value': obj.text}
+
+        if isinstance(obj, JsFunction):
+            res = {'type': 'function', 'id': self.inspectee_id(space, obj)}
+            if deeply:
+                self.serialize_function(obj, res)
+            return res
+
+        if isinstance(obj, list):
+            res = {'type': 'array', 'id': self.inspectee_id(space, obj)}
+            if deeply:
+                res['value'] = [self.inspect(space, item, False) for item in obj]
+            return res
+
+        res = {'type': 'object', 'id': self.inspectee_id(space, obj)}
+        if deeply:
+            attrs = {'__proto': self.inspect(space, OBJECT_PROTOTYPE, False)}
+            for key, value in obj.items():
+                attrs[key] = self.inspect(space, value, False)
+            res['value'] = attrs
+        return res
+
+
+def value_at(root, path):
+    value = root
+    for n in path:
+        value = nth_value(value, n)
+    return value
+
+
+def nth_value(obj, n):
+    if isinstance(obj, list):
+        return obj[n]
+    return obj[obj.keys[n]]
+
+
+def composite_children(value):
+    """Child values of an array or an object, None for anything else"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, JsObject):
+        return [item for key, item in value.items()]
+    return None
+
+
+def parent_key_at(root, path):
+    if not path:
+        raise RuntimeError("Path cannot be empty")
+
+    parent = value_at(root, path[:-1])
+    if isinstance(parent, list):
+        return parent, path[-1]
+    return parent, parent.keys[path[-1]]
+
+
+def check_object(obj):
+    if not isinstance(obj, JsObject):
+        raise RuntimeError("Object/array mismatch: expected object")
+
+
+def check_array(obj):
+    if not isinstance(obj, list):
+        raise RuntimeError("Object/array mismatch: expected array")
+
+
+def move_new_pos(length, i, fwd):
+    if fwd:
+        return 0 if i == length - 1 else i + 1
+    else:
+        return length - 1 if i == 0 else i - 1
+
+
+def move_list_item(items, pos, fwd):
+    new_pos = move_new_pos(len(items), pos, fwd)
+    items.insert(new_pos, items.pop(pos))
+    return new_pos
+
+
+@op_handler('batch')
+def batch(be, operations):
+    if be.batch_results is not None:
+        raise RuntimeError("Nested batches are not supported")
+
+    results = be.batch_results = []
+    try:
+        for op in operations:
+            be.run_op(op['operation'], op['args'])
+    finally:
+        be.batch_results = None
+
+    return results
+
+
+@op_handler('getProjects')
+def get_projects(be):
+    return [
+        {'id': proj.id, 'name': proj.name, 'path': proj.path}
+        for proj in be.projects.values()
+    ]
+
+
+@op_handler('getProjectModules')
+def get_project_modules(be, projectId):
+    return [
+        {'id': module.id, 'name': module.name}
+        for module in be.projects[projectId].modules.values()
+    ]
+
+
+@op_handler('getProjectArbitraryModule')
+def get_project_arbitrary_module(be, projectId):
+    module = next(iter(be.projects[projectId].modules.values()))
+    return {'id': module.id, 'name': module.name}
+
+
+@op_handler('loadProject')
+def load_project(be, projectPath, project, sources):
+    be.load_project(projectPath, project, sources)
+
+
+@op_handler('loadModule')
+def load_module(be, projectId, moduleId, name, source, untracked):
+    project = be.projects.get(projectId)
+    if project is None:
+        raise RuntimeError("Project with given ID is not loaded")
+    if moduleId in be.modules:
+        raise RuntimeError("Module ID duplicated")
+    if any(m.name == name for m in project.modules.values()):
+        raise RuntimeError('Cannot add module "{}": duplicate name'.format(name))
+
+    module = be.load_module(
+        {'id': moduleId, 'name': name, 'untracked': untracked},
+        {moduleId: source},
+        projectId
+    )
+    be.modules[module.id] = module
+    project.modules[module.id] = module
+
+
+@op_handler('setEncoding')
+def set_encoding(be, encoding):
+    if encoding not in ('dicts', 'compact'):
+        raise RuntimeError("Unknown encoding: {}".format(encoding))
+    be.encoding = encoding
+
+
+@op_handler('getFunctionSources')
+def get_function_sources(be, hashes):
+    return {hash: be.sent_sources.get(hash) for hash in hashes}
+
+
+@op_handler('getKeyAt')
+def get_key_at(be, mid, path):
+    parent, key = parent_key_at(be.modules[mid].value, path)
+    check_object(parent)
+    return key
+
+
+@op_handler('getValueAt')
+def get_value_at(be, mid, path):
+    value = value_at(be.modules[mid].value, path)
+    return be.serialize(value, be.browse_expansion([value]))
+
+
+@op_handler('getModuleObject')
+def get_module_object(be, mid):
+    return be.serialize_module(be.modules[mid], True)
+
+
+@op_handler('getModuleChanges')
+def get_module_changes(be, mid, epoch, sinceVersion):
+    module = be.modules[mid]
+    descriptors = None
+    if epoch == be.epoch:
+        descriptors = be.module_changes_since(module, sinceVersion)
+
+    if descriptors is None:
+        return {
+            'type': 'snapshot',
+            'snapshot': be.serialize_module(module, True)
+        }
+    else:
+        return {'type': 'delta', 'descriptors': descriptors}
+
+
+@op_handler('replace')
+def replace(be, mid, path, codeNewValue):
+    module = be.modules[mid]
+    parent, key = parent_key_at(module.value, path)
+    new_value = parse_expression(codeNewValue, module.value)
+
+    parent[key] = new_value
+
+    be.persist_in_module(module, [{
+        'operation': 'replace',
+        'path': path,
+        'newValue': be.serialize(new_value)
+    }])
+
+
+@op_handler('renameKey')
+def rename_key(be, mid, path, newName):
+    module = be.modules[mid]
+    parent, key = parent_key_at(module.value, path)
+    check_object(parent)
+
+    if newName in parent:
+        raise OpError(
+            'duplicate_key',
+            objPath=path,
+            duplicatedKey=newName,
+            message="Cannot rename to {}: duplicate property name".format(newName)
+        )
+
+    parent.rename(key, newName)
+    be.persist_in_module(module, [{
+        'operation': 'rename_key',
+        'path': path,
+        'newName': newName
+    }])
+
+
+@op_handler('addArrayEntry')
+def add_array_entry(be, mid, parentPath, pos, codeValue):
+    module = be.modules[mid]
+    parent = value_at(module.value, parentPath)
+    value = parse_expression(codeValue, module.value)
+    check_array(parent)
+
+    parent.insert(pos, value)
+    be.persist_in_module(module, [{
+        'operation': 'insert',
+        'path': parentPath + [pos],
+        'key': None,
+        'value': be.serialize(value)
+    }])
+
+
+@op_handler('addObjectEntry')
+def add_object_entry(be, mid, parentPath, pos, key, codeValue):
+    module = be.modules[mid]
+    parent = value_at(module.value, parentPath)
+    value = parse_expression(codeValue, module.value)
+    check_object(parent)
+
+    if key in parent:
+        raise RuntimeError("Cannot insert property {}: it already exists".format(key))
+
+    parent.insert(pos, key, value)
+    be.persist_in_module(module, [{
+        'operation': 'insert',
+        'path': parentPath + [pos],
+        'key': key,
+        'value': be.serialize(value)
+    }])
+
+
+@op_handler('move')
+def move(be, mid, path, fwd):
+    module = be.modules[mid]
+    parent, key = parent_key_at(module.value, path)
+
+    if isinstance(parent, list):
+        new_pos = move_list_item(parent, key, fwd)
+    else:
+        new_pos = move_list_item(parent.keys, parent.keys.index(key), fwd)
+
+    new_path = path[:-1] + [new_pos]
+
+    be.persist_in_module(module, [{
+        'operation': 'move',
+        'path': path,
+        'newPath': new_path
+    }])
+    return new_path
+
+
+@op_handler('deleteEntry')
+def delete_entry(be, mid, path):
+    module = be.modules[mid]
+    parent, key = parent_key_at(module.value, path)
+
+    del parent[key]
+    be.persist_in_module(module, [{
+        'operation': 'delete',
+        'path': path
+    }])
+
+
+@op_handler('replEval')
+def repl_eval(be, mid, spaceId, code):
+    obj = parse_expression(code, be.modules[mid].value)
+    return be.inspect(be.inspection_space(spaceId), obj, True)
+
+
+@op_handler('inspectObjectById')
+def inspect_object_by_id(be, spaceId, id):
+    space = be.inspection_space(spaceId)
+    obj = space['id2obj'].get(id)
+    if obj is None:
+        raise RuntimeError("Unknown object id: {}".format(id))
+
+    return be.inspect(space, obj, True)
+
+
+@op_handler('inspectGetterValue')
+def inspect_getter_value(be, spaceId, parentId, prop):
+    raise RuntimeError("The headless BE has no getters")
+
+
+@op_handler('deleteInspectionSpace')
+def delete_inspection_space(be, spaceId):
+    return be.inspection_spaces.pop(spaceId, None) is not None
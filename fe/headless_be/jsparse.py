@@ -0,0 +1,526 @@
+"""Parser of the JS subset the headless BE understands
+
+Values are literals: numbers, strings, template strings without substitutions, regexps,
+true/false/null/undefined/NaN/Infinity, arrays, objects and functions (including arrow
+functions and method shorthands).  Function bodies are not interpreted: only their
+source text is kept.
+
+In expressions coming from the FE, $-paths refer to the module object: $.a.b[0]['c'].
+"""
+
+import re
+
+from .model import JsFunction
+from .model import JsLeaf
+from .model import JsObject
+from .model import number_leaf
+from .model import string_leaf
+
+
+class ParseError(Exception):
+    pass
+
+
+re_ws = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+re_ident = re.compile(r'[A-Za-z_$][\w$]*')
+re_number = re.compile(
+    r'-?(?:0[xX][0-9a-fA-F]+|0[oO][0-7]+|0[bB][01]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)'
+)
+
+leaf_words = {'true', 'false', 'null', 'undefined', 'NaN', 'Infinity'}
+
+# After these words, a slash starts a regexp rather than being a division
+regexp_preceding_words = {
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw',
+    'case', 'do', 'else', 'yield', 'await'
+}
+
+simple_escapes = {
+    'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0'
+}
+
+
+def parse_expression(text, root=None):
+    """Parse text as a single value
+
+    :param root: what $ refers to (JsObject), or None if $-paths are not allowed
+    """
+    parser = Parser(text, root)
+    value = parser.value()
+    parser.skip_ws()
+    if parser.pos != len(text):
+        parser.fail("Unexpected trailing characters")
+    return value
+
+
+def parse_module_source(text):
+    """Parse the source of a module: the object literal assigned to $ in it
+
+    Modules look like this (see be/_new_module_template.js):
+
+        (function () {
+           'use strict';
+
+           let $ = {
+              ...
+           };
+
+           return $;
+        })();
+    """
+    mo = re.search(r'\blet\s+\$\s*=\s*', text)
+    if mo is None:
+        return parse_expression(text.strip().rstrip(';'))
+
+    parser = Parser(text, None)
+    parser.pos = mo.end()
+    value = parser.value()
+    if not isinstance(value, JsObject):
+        parser.fail("Module value must be an object literal")
+    return value
+
+
+class Parser:
+    def __init__(self, text, root):
+        self.text = text
+        self.root = root
+        self.pos = 0
+
+    def fail(self, message):
+        line = self.text.count('\n', 0, self.pos) + 1
+        raise ParseError("{} (line {}): {!r}".format(
+            message, line, self.text[self.pos:self.pos + 30]
+        ))
+
+    def skip_ws(self):
+        self.pos = re_ws.match(self.text, self.pos).end()
+
+    def peek(self):
+        return self.text[self.pos] if self.pos < len(self.text) else ''
+
+    def expect(self, s):
+        self.skip_ws()
+        if not self.text.startswith(s, self.pos):
+            self.fail("Expected {!r}".format(s))
+        self.pos += len(s)
+
+    def is_arrow_ahead(self, pos):
+        return self.text.startswith('=>', re_ws.match(self.text, pos).end())
+
+    def value(self):
+        self.skip_ws()
+        c = self.peek()
+
+        if c == '{':
+            return self.object()
+        if c == '[':
+            return self.array()
+        if c in ('"', "'"):
+            return string_leaf(self.string())
+        if c == '`':
+            return string_leaf(self.template())
+        if c == '/':
+            start = self.pos
+            self.pos = skip_regexp(self.text, self.pos)
+            return JsLeaf(self.text[start:self.pos])
+        if c == '(':
+            if self.is_arrow_ahead(skip_balanced(self.text, self.pos)):
+                return self.arrow_function(self.pos)
+            self.pos += 1
+            value = self.value()
+            self.expect(')')
+            return value
+        if self.text.startswith('-Infinity', self.pos):
+            self.pos += len('-Infinity')
+            return JsLeaf('-Infinity')
+
+        mo = re_number.match(self.text, self.pos)
+        if mo:
+            self.pos = mo.end()
+            return number_leaf(parse_number(mo.group()))
+
+        mo = re_ident.match(self.text, self.pos)
+        if mo is None:
+            self.fail("Unsupported expression")
+
+        word = mo.group()
+        if word in ('function', 'async'):
+            return self.function()
+        if self.is_arrow_ahead(mo.end()):
+            return self.arrow_function(self.pos)
+        if word in leaf_words:
+            self.pos = mo.end()
+            return JsLeaf(word)
+        if word == '$':
+            self.pos = mo.end()
+            return self.path()
+
+        self.fail("Unsupported expression")
+
+    def object(self):
+        self.expect('{')
+        obj = JsObject()
+
+        while True:
+            self.skip_ws()
+            if self.peek() == '}':
+                self.pos += 1
+                return obj
+
+            start = self.pos
+            key = self.key()
+            self.skip_ws()
+            if self.peek() == '(':
+                # Method shorthand: its source is what JS Function.toString() gives
+                self.pos = skip_balanced(self.text, self.pos)
+                self.skip_ws()
+                if self.peek() != '{':
+                    self.fail("Expected method body")
+                self.pos = skip_balanced(self.text, self.pos)
+                value = JsFunction(self.text[start:self.pos])
+            else:
+                self.expect(':')
+                value = self.value()
+
+            if key in obj:
+                self.fail("Duplicate key {!r}".format(key))
+            obj[key] = value
+
+            self.skip_ws()
+            if self.peek() == ',':
+                self.pos += 1
+            elif self.peek() != '}':
+                self.fail("Expected ',' or '}'")
+
+    def key(self):
+        c = self.peek()
+        if c in ('"', "'"):
+            return self.string()
+
+        mo = re_ident.match(self.text, self.pos) or re_number.match(self.text, self.pos)
+        if mo is None:
+            self.fail("Unsupported object key")
+        self.pos = mo.end()
+
+        if re_ident.match(mo.group()):
+            return mo.group()
+        return number_leaf(parse_number(mo.group())).text
+
+    def array(self):
+        self.expect('[')
+        items = []
+
+        while True:
+            self.skip_ws()
+            if self.peek() == ']':
+                self.pos += 1
+                return items
+
+            items.append(self.value())
+
+            self.skip_ws()
+            if self.peek() == ',':
+                self.pos += 1
+            elif self.peek() != ']':
+                self.fail("Expected ',' or ']'")
+
+    def string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        return self.string_body(quote)
+
+    def template(self):
+        self.pos += 1
+        return self.string_body('`')
+
+    def string_body(self, terminator):
+        pieces = []
+        text = self.text
+
+        while True:
+            if self.pos >= len(text):
+                self.fail("Unterminated string")
+
+            c = text[self.pos]
+            if c == terminator:
+                self.pos += 1
+                return ''.join(pieces)
+
+            if c == '\\':
+                pieces.append(self.escape())
+                continue
+
+            if terminator == '`' and text.startswith('${', self.pos):
+                self.fail("Template substitutions are not supported")
+            if c == '\n' and terminator != '`':
+                self.fail("Unterminated string")
+
+            pieces.append(c)
+            self.pos += 1
+
+    def escape(self):
+        text = self.text
+        c = text[self.pos + 1:self.pos + 2]
+        self.pos += 2
+
+        if c in simple_escapes:
+            return simple_escapes[c]
+        if c == '\n':
+            return ''  # line continuation
+        if c == 'x':
+            code = text[self.pos:self.pos + 2]
+            self.pos += 2
+            return chr(int(code, 16))
+        if c == 'u':
+            if self.peek() == '{':
+                end = text.index('}', self.pos)
+                code = text[self.pos + 1:end]
+                self.pos = end + 1
+            else:
+                code = text[self.pos:self.pos + 4]
+                self.pos += 4
+            return chr(int(code, 16))
+
+        return c
+
+    def function(self):
+        start = self.pos
+
+        if self.text.startswith('async', self.pos):
+            self.pos += len('async')
+            self.skip_ws()
+            if not self.text.startswith('function', self.pos):
+                return self.arrow_function(start)
+
+        self.pos += len('function')
+        self.skip_ws()
+        if self.peek() == '*':
+            self.pos += 1
+            self.skip_ws()
+
+        mo = re_ident.match(self.text, self.pos)
+        if mo:
+            self.pos = mo.end()
+            self.skip_ws()
+
+        if self.peek() != '(':
+            self.fail("Expected function parameters")
+        self.pos = skip_balanced(self.text, self.pos)
+        self.skip_ws()
+        if self.peek() != '{':
+            self.fail("Expected function body")
+        self.pos = skip_balanced(self.text, self.pos)
+
+        return JsFunction(self.text[start:self.pos])
+
+    def arrow_function(self, start):
+        self.pos = start
+        if self.text.startswith('async', self.pos):
+            self.pos += len('async')
+            self.skip_ws()
+
+        if self.peek() == '(':
+            self.pos = skip_balanced(self.text, self.pos)
+        else:
+            self.pos = re_ident.match(self.text, self.pos).end()
+
+        self.expect('=>')
+        self.skip_ws()
+
+        if self.peek() == '{':
+            self.pos = skip_balanced(self.text, self.pos)
+        else:
+            self.pos = skip_code(self.text, self.pos, stop=',;')
+            while self.text[self.pos - 1].isspace():
+                self.pos -= 1
+
+        return JsFunction(self.text[start:self.pos])
+
+    def path(self):
+        if self.root is None:
+            self.fail("$ cannot be referred to here")
+
+        value = self.root
+        while True:
+            if self.peek() == '.':
+                self.pos += 1
+                mo = re_ident.match(self.text, self.pos)
+                if mo is None:
+                    self.fail("Expected property name")
+                self.pos = mo.end()
+                key = mo.group()
+            elif self.peek() == '[':
+                self.pos += 1
+                key = self.value()
+                self.expect(']')
+                if not isinstance(key, JsLeaf):
+                    self.fail("Unsupported property key")
+                key = key.text
+            else:
+                return value
+
+            value = self.member(value, key)
+
+    def member(self, value, key):
+        """Property key (JS source text of a leaf, or an identifier) of value"""
+        if isinstance(value, list):
+            if key == 'length':
+                return number_leaf(len(value))
+            if key.isdigit():
+                index = int(key)
+                return value[index] if index < len(value) else JsLeaf('undefined')
+        elif isinstance(value, JsObject):
+            if key.startswith(('"', "'")):
+                key = Parser(key, None).string()
+            return value.values.get(key, JsLeaf('undefined'))
+
+        self.fail("Cannot read property {} of {}".format(key, describe(value)))
+
+
+def describe(value):
+    if isinstance(value, JsLeaf):
+        return value.text
+    if isinstance(value, JsFunction):
+        return 'function'
+    return type(value).__name__
+
+
+def parse_number(text):
+    negative = text.startswith('-')
+    body = text.lstrip('-')
+
+    if body[:2].lower() in ('0x', '0o', '0b'):
+        x = int(body, 0)
+    elif re.match(r'\d+$', body):
+        x = int(body)
+    else:
+        x = float(body)
+
+    return -x if negative else x
+
+
+def skip_balanced(text, pos):
+    """Skip the bracketed code starting at pos (which must be at an opening bracket)
+
+    :return: position right after the matching closing bracket
+    """
+    assert text[pos] in '([{'
+    end = skip_code(text, pos + 1, stop='')
+    if end >= len(text):
+        raise ParseError("Unbalanced brackets at {}".format(pos))
+    return end + 1
+
+
+def skip_code(text, pos, stop):
+    """Skip JS code up to an unmatched closing bracket or a character from stop at depth 0
+
+    Strings, template literals, comments and regexps are skipped as a whole.
+
+    :return: position of that bracket or character (len(text) if not found)
+    """
+    depth = 0
+    last = None  # position of the last significant character
+
+    while pos < len(text):
+        c = text[pos]
+
+        if c in ('"', "'"):
+            pos = skip_string(text, pos)
+        elif c == '`':
+            pos = skip_template(text, pos)
+        elif text.startswith('//', pos) or text.startswith('/*', pos):
+            pos = re_ws.match(text, pos).end()
+            continue
+        elif c == '/' and is_regexp_allowed(text, last):
+            pos = skip_regexp(text, pos)
+        elif c in '([{':
+            depth += 1
+            pos += 1
+        elif c in ')]}':
+            if depth == 0:
+                return pos
+            depth -= 1
+            pos += 1
+        elif depth == 0 and c in stop:
+            return pos
+        elif c.isspace():
+            pos += 1
+            continue
+        else:
+            pos += 1
+
+        last = pos - 1
+
+    return pos
+
+
+def is_regexp_allowed(text, last):
+    """Whether a slash after the character at position last starts a regexp"""
+    if last is None:
+        return True
+
+    c = text[last]
+    if c in ')]}"\'`':
+        return False
+    if not re.match(r'[\w$]', c):
+        return True
+
+    start = last
+    while start > 0 and re.match(r'[\w$]', text[start - 1]):
+        start -= 1
+    return text[start:last + 1] in regexp_preceding_words
+
+
+def skip_string(text, pos):
+    quote = text[pos]
+    pos += 1
+    while pos < len(text):
+        c = text[pos]
+        if c == '\\':
+            pos += 2
+        elif c == quote:
+            return pos + 1
+        else:
+            pos += 1
+
+    raise ParseError("Unterminated string")
+
+
+def skip_template(text, pos):
+    pos += 1
+    while pos < len(text):
+        c = text[pos]
+        if c == '\\':
+            pos += 2
+        elif c == '`':
+            return pos + 1
+        elif text.startswith('${', pos):
+            pos = skip_balanced(text, pos + 1)
+        else:
+            pos += 1
+
+    raise ParseError("Unterminated template literal")
+
+
+def skip_regexp(text, pos):
+    pos += 1
+    in_class = False
+    while pos < len(text):
+        c = text[pos]
+        if c == '\\':
+            pos += 2
+            continue
+        if c == '\n':
+            break
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            pos += 1
+            while pos < len(text) and text[pos].isalpha():
+                pos += 1
+            return pos
+        pos += 1
+
+    raise ParseError("Unterminated regexp")
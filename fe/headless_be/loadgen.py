@@ -0,0 +1,156 @@
+"""Load generation: synthetic projects of arbitrary size, and random edits of modules"""
+
+import json
+import os
+
+from .backend import op_handlers
+from .backend import random_hex_id
+from .model import JsFunction
+from .model import JsLeaf
+from .model import JsObject
+from .model import number_leaf
+from .model import string_leaf
+
+
+INDENT = '   '
+
+module_template = """\
+(function () {{
+   'use strict';
+
+   let $ = {value};
+
+   return $;
+}})();
+"""
+
+
+def generate_value(rng, depth):
+    """Random JS value, composites are nested at most depth levels"""
+    kind = rng.random()
+
+    if depth > 0 and kind < 0.15:
+        return [generate_value(rng, depth - 1) for i in range(rng.randint(0, 6))]
+    if depth > 0 and kind < 0.3:
+        return JsObject(
+            ('key{}'.format(i), generate_value(rng, depth - 1))
+            for i in range(rng.randint(0, 6))
+        )
+    if kind < 0.4:
+        return JsFunction('function (a, b) {{\n{0}return a * {1} + b;\n}}'.format(
+            INDENT, rng.randint(0, 10 ** 6)
+        ))
+    if kind < 0.7:
+        return number_leaf(rng.randint(-10 ** 6, 10 ** 6))
+    return string_leaf('str-{}'.format(rng.randint(0, 10 ** 6)))
+
+
+def generate_module_value(rng, n_entries, depth):
+    return JsObject(
+        ('entry{}'.format(i), generate_value(rng, depth)) for i in range(n_entries)
+    )
+
+
+def render(value, level=0):
+    """JS source of value, laid out the way the FE persists modules"""
+    if isinstance(value, JsLeaf):
+        return value.text
+    if isinstance(value, JsFunction):
+        return reindent_function(value.source, INDENT * level)
+
+    indent = INDENT * (level + 1)
+    if isinstance(value, list):
+        if not value:
+            return '[]'
+        items = ',\n'.join(indent + render(item, level + 1) for item in value)
+        return '[\n{}\n{}]'.format(items, INDENT * level)
+
+    if not value:
+        return '{}'
+    entries = ',\n'.join(
+        '{}{}: {}'.format(indent, key, render(item, level + 1))
+        for key, item in value.items()
+    )
+    return '{{\n{}\n{}}}'.format(entries, INDENT * level)
+
+
+def reindent_function(source, indent):
+    """Re-indent lines of source but the first one, so that the last one is at indent
+
+    This is how JsLayout.insert_function() (js_render.py) lays functions out.
+    """
+    line0, *lines = source.split('\n')
+    if not lines:
+        return source
+
+    n = len(lines[-1]) - len(lines[-1].lstrip(' '))
+    return '\n'.join([line0] + [
+        indent + line[n:] if line.strip() else '' for line in lines
+    ])
+
+
+def write_project(path, rng, n_modules, n_entries, depth):
+    """Write a project of n_modules modules with n_entries top-level entries each"""
+    os.makedirs(path, exist_ok=True)
+
+    modules = []
+    for i in range(n_modules):
+        name = 'module{}'.format(i)
+        value = generate_module_value(rng, n_entries, depth)
+        with open(os.path.join(path, name + '.js'), 'w') as file:
+            file.write(module_template.format(value=render(value, 1)))
+        modules.append({'id': random_hex_id(), 'name': name, 'untracked': []})
+
+    with open(os.path.join(path, 'project.live.json'), 'w') as file:
+        json.dump({
+            'projectId': random_hex_id(),
+            'projectName': os.path.basename(os.path.abspath(path)),
+            'modules': modules
+        }, file, indent=3)
+
+
+def random_edit(be, rng):
+    """Make a random change to a module of a project loaded into be by the FE
+
+    The BE's own project is never touched (its module files are the BE source code).
+
+    :return: operation name, or None if there's nothing to edit
+    """
+    modules = [
+        module for module in be.modules.values()
+        if module.project_id != be.bootstrap_project_id and len(module.value) > 0
+    ]
+    if not modules:
+        return None
+
+    module = rng.choice(modules)
+    path = []
+    value = module.value
+    # Descend into a random composite, then act on one of its entries
+    while len(value) > 0 and rng.random() < 0.5:
+        n = rng.randrange(len(value))
+        child = value[n] if isinstance(value, list) else value.values[value.keys[n]]
+        if not isinstance(child, (list, JsObject)) or len(child) == 0:
+            break
+        path.append(n)
+        value = child
+
+    pos = rng.randrange(len(value))
+    kind = rng.random()
+
+    if isinstance(value, list) and kind < 0.2:
+        operation, args = 'addArrayEntry', {
+            'parentPath': path, 'pos': pos, 'codeValue': str(rng.randint(0, 10 ** 6))
+        }
+    elif kind < 0.3 and len(value) > 1:
+        operation, args = 'deleteEntry', {'path': path + [pos]}
+    elif kind < 0.4 and len(value) > 1:
+        operation, args = 'move', {'path': path + [pos], 'fwd': rng.random() < 0.5}
+    else:
+        operation, args = 'replace', {
+            'path': path + [pos], 'codeNewValue': str(rng.randint(0, 10 ** 6))
+        }
+
+    # Called directly: this change is not a response to any FE request
+    op_handlers[operation](be, mid=module.id, **args)
+    return operation
@@ -0,0 +1,140 @@
+"""In-memory model of JS values a module consists of
+
+  * JsObject: plain object, keys are kept in order
+  * list: array
+  * JsFunction: function, represented by its source
+  * JsLeaf: anything else (number, string, regexp, null, ...), represented by the text
+    that would be produced by the BE serializer (see jsvalue-protocol.txt)
+"""
+
+import json
+import math
+
+
+class JsObject:
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, entries=()):
+        self.keys = []
+        self.values = {}
+        for key, value in entries:
+            self[key] = value
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        if key not in self.values:
+            self.keys.append(key)
+        self.values[key] = value
+
+    def __delitem__(self, key):
+        del self.values[key]
+        self.keys.remove(key)
+
+    def items(self):
+        return [(key, self.values[key]) for key in self.keys]
+
+    def insert(self, pos, key, value):
+        assert key not in self.values
+        self.keys.insert(pos, key)
+        self.values[key] = value
+
+    def rename(self, key, new_key):
+        assert new_key not in self.values
+        self.keys[self.keys.index(key)] = new_key
+        self.values[new_key] = self.values.pop(key)
+
+
+class JsFunction:
+    __slots__ = ('source', '_hash')
+
+    def __init__(self, source):
+        self.source = source
+        self._hash = None
+
+    @property
+    def hash(self):
+        """Same as what live.js computes: '<cyrb53 of source, hex>-<length in UTF-16>'"""
+        if self._hash is None:
+            self._hash = '{:x}-{}'.format(cyrb53(self.source), utf16_length(self.source))
+        return self._hash
+
+
+class JsLeaf:
+    __slots__ = ('text', )
+
+    def __init__(self, text):
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, JsLeaf) and self.text == other.text
+
+    def __repr__(self):
+        return 'JsLeaf({!r})'.format(self.text)
+
+
+def string_leaf(s):
+    """JsLeaf of a JS string (the way JSON.stringify() renders it)"""
+    return JsLeaf(json.dumps(s, ensure_ascii=False))
+
+
+def number_leaf(x):
+    """JsLeaf of a JS number (the way String() renders it)"""
+    if isinstance(x, int):
+        return JsLeaf(str(x))
+    if math.isnan(x):
+        return JsLeaf('NaN')
+    if math.isinf(x):
+        return JsLeaf('Infinity' if x > 0 else '-Infinity')
+    if x.is_integer() and abs(x) < 1e21:
+        return JsLeaf(str(int(x)))
+
+    text = repr(x)
+    if 'e' not in text:
+        return JsLeaf(text)
+
+    mantissa, exp = text.split('e')
+    exp = int(exp)
+    if -7 < exp < 0:
+        # JS only switches to exponential notation below 1e-6
+        sign = '-' if mantissa.startswith('-') else ''
+        digits = mantissa.lstrip('-').replace('.', '')
+        return JsLeaf('{}0.{}{}'.format(sign, '0' * (-exp - 1), digits))
+
+    return JsLeaf('{}e{}{}'.format(mantissa, '-' if exp < 0 else '+', abs(exp)))
+
+
+def utf16_units(s):
+    """:return: list of UTF-16 code units of s (what JS String.charCodeAt() gives)"""
+    data = s.encode('utf-16-le', 'surrogatepass')
+    return [data[i] | (data[i + 1] << 8) for i in range(0, len(data), 2)]
+
+
+def utf16_length(s):
+    return len(s.encode('utf-16-le', 'surrogatepass')) // 2
+
+
+def imul(a, b):
+    return (a * b) & 0xFFFFFFFF
+
+
+def cyrb53(s, seed=0):
+    """Port of $.cyrb53 from live.js, must give identical results"""
+    h1 = 0xdeadbeef ^ seed
+    h2 = 0x41c6ce57 ^ seed
+
+    for ch in utf16_units(s):
+        h1 = imul(h1 ^ ch, 2654435761)
+        h2 = imul(h2 ^ ch, 1597334677)
+
+    h1 = imul(h1 ^ (h1 >> 16), 2246822507) ^ imul(h2 ^ (h2 >> 13), 3266489909)
+    h2 = imul(h2 ^ (h2 >> 16), 2246822507) ^ imul(h1 ^ (h1 >> 13), 3266489909)
+
+    return 4294967296 * (2097151 & h2) + h1
@@ -0,0 +1,127 @@
+"""Minimal blocking websocket client (RFC 6455), enough to talk to the FE server"""
+
+import base64
+import os
+import select
+import socket
+import struct
+
+from live.lowlvl.websocket import OpCode
+from live.lowlvl.websocket import sec_websocket_accept
+from live.lowlvl.websocket import unmask
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class WsClient:
+    def __init__(self, host, port, path):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.sock = None
+        self.rbuf = bytearray()
+        # Fragments of the incoming message being received
+        self.fragments = []
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rbuf.clear()
+        self.fragments = []
+
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.sock.sendall((
+            'GET {} HTTP/1.1\r\n'
+            'Host: {}:{}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Key: {}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            '\r\n'
+        ).format(self.path, self.host, self.port, key).encode('ascii'))
+
+        while b'\r\n\r\n' not in self.rbuf:
+            self.recv_some()
+        head, _, rest = bytes(self.rbuf).partition(b'\r\n\r\n')
+        self.rbuf[:] = rest
+
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        if status_line.split()[1] != '101':
+            raise ConnectionClosed("Handshake failed: {}".format(status_line))
+
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('sec-websocket-accept') != \
+                sec_websocket_accept(key).decode('ascii'):
+            raise ConnectionClosed("Handshake failed: wrong Sec-WebSocket-Accept")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def recv_some(self):
+        data = self.sock.recv(256 * 1024)
+        if not data:
+            raise ConnectionClosed("Server closed the connection")
+        self.rbuf.extend(data)
+
+    def recv_exactly(self, n):
+        while len(self.rbuf) < n:
+            self.recv_some()
+        data = bytes(self.rbuf[:n])
+        del self.rbuf[:n]
+        return data
+
+    def send_text(self, text):
+        self.send_frame(OpCode.TEXT, text.encode('utf8'))
+
+    def send_frame(self, opcode, payload):
+        # Client frames must be masked
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(0x80 | len(payload))
+        elif len(payload) < (1 << 16):
+            header.append(0x80 | 126)
+            header.extend(struct.pack('>H', len(payload)))
+        else:
+            header.append(0x80 | 127)
+            header.extend(struct.pack('>Q', len(payload)))
+
+        mask_key = os.urandom(4)
+        self.sock.sendall(bytes(header) + mask_key + unmask(payload, mask_key))
+
+    def recv_message(self, timeout=None):
+        """Receive the next text message, answering PINGs on the way
+
+        :param timeout: seconds to wait for data, None to wait forever
+        :return: str, or None if timed out
+        """
+        while True:
+            if not self.rbuf:
+                readable, _, _ = select.select([self.sock], [], [], timeout)
+                if not readable:
+                    return None
+
+            b0, b1 = self.recv_exactly(2)
+            fin, opcode, length = bool(b0 & 0x80), b0 & 0x0F, b1 & 0x7F
+            if length == 126:
+                [length] = struct.unpack('>H', self.recv_exactly(2))
+            elif length == 127:
+                [length] = struct.unpack('>Q', self.recv_exactly(8))
+            payload = self.recv_exactly(length)
+
+            if opcode == OpCode.PING:
+                self.send_frame(OpCode.PONG, payload)
+            elif opcode == OpCode.CLOSE:
+                raise ConnectionClosed("Server sent CLOSE")
+            elif opcode in (OpCode.TEXT, OpCode.CONTINUATION):
+                self.fragments.append(payload)
+                if fin:
+                    message = b''.join(self.fragments).decode('utf8')
+                    self.fragments = []
+                    return message
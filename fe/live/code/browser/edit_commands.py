@@ -10,7 +10,8 @@ from live.projects.operations import project_for_window
 from live.settings import setting
 from live.shared.backend import BackendInteractingTextCommand
 from live.shared.backend import BackendInteractingWindowCommand
-from live.shared.backend import is_interaction_possible
+from live.shared.backend import is_sync_interaction_possible
+from live.shared.backend import session_for_window
 from live.shared.command import TextCommand
 from live.shared.input_handlers import ModuleInputHandler
 from live.sublime.edit import edit_for
@@ -22,7 +23,7 @@ from live.ws_handler import ws_handler
 __all__ = [
     'LivejsCbRefresh', 'LivejsBrowseModule', 'LivejsCbEdit', 'LivejsCbCommit',
     'LivejsCbCancelEdit', 'LivejsCbDelNode', 'LivejsCbMoveNodeFwd', 'LivejsCbMoveNodeBwd',
-    'LivejsCbAddNode'
+    'LivejsCbAddNode', 'LivejsCbExpandNode'
 ]
 
 
@@ -30,11 +31,33 @@ class LivejsCbRefresh(BackendInteractingTextCommand, ModuleBrowserCommandMixin):
     @method.primary
     def run(self):
         self.mbrowser.done_editing()
+
+        if self.mbrowser.is_offline or self.mbrowser.version is None:
+            yield from self._refresh_from_snapshot()
+            return
+
+        # Only fetch what changed since the version we display.  The BE falls back to a
+        # full snapshot if it no longer remembers all the changes.
+        ws_handler.run_async_op('getModuleChanges', {
+            'mid': self.mbrowser.module_id,
+            'epoch': self.mbrowser.epoch,
+            'sinceVersion': self.mbrowser.version
+        })
+        changes = yield
+        if changes['type'] == 'snapshot':
+            self.mbrowser.refresh(changes['snapshot'])
+            return
+
+        if not all(self.mbrowser.apply_change(desc) for desc in changes['descriptors']):
+            # The delta does not fit what we display, asking for it again won't help
+            yield from self._refresh_from_snapshot()
+
+    def _refresh_from_snapshot(self):
         ws_handler.run_async_op('getModuleObject', {
             'mid': self.mbrowser.module_id
         })
-        root_object = yield
-        self.mbrowser.refresh(root_object)
+        snapshot = yield
+        self.mbrowser.refresh(snapshot)
 
 
 class LivejsBrowseModule(BackendInteractingWindowCommand):
@@ -45,18 +68,20 @@ class LivejsBrowseModule(BackendInteractingWindowCommand):
         if view is None:
             view = new_module_browser_view(self.window, module)
             ws_handler.run_async_op('getModuleObject', {'mid': module.id})
-            root_object = yield
-            module_browser_for(view).refresh(root_object)
+            snapshot = yield
+            module_browser_for(view).refresh(snapshot)
         else:
             module_browser_for(view).focus_view()
 
     def input(self, args):
-        if not is_interaction_possible() or not project_for_window(self.window):
+        session = session_for_window(self.window)
+        if not is_sync_interaction_possible(session) or \
+                not project_for_window(self.window):
             return None
 
         modules = ws_handler.run_sync_op('getProjectModules', {
             'projectId': setting.project_id[self.window]
-        })
+        }, session=session)
 
         return ModuleInputHandler(modules)
 
@@ -75,9 +100,37 @@ class LivejsCbEdit(TextCommand, ModuleBrowserCommandMixin):
                                    "(the cursor is at top level)")
             return
 
+        if node.contains_unexpanded:
+            sublime.status_message("Cannot edit a value that is not fully loaded "
+                                   "(expand it first)")
+            return
+
         self.mbrowser.edit_node(node)
 
 
+class LivejsCbExpandNode(BackendInteractingTextCommand, ModuleBrowserCommandMixin):
+    @method.primary
+    def run(self):
+        if len(self.view.sel()) != 1:
+            return
+
+        [reg] = self.view.sel()
+        node = self.mbrowser.find_containing_node(reg, strict=False)
+        if not node.is_unexpanded:
+            sublime.status_message("Nothing to expand here")
+            return
+
+        ws_handler.run_async_op('getValueAt', {
+            'mid': self.mbrowser.module_id,
+            'path': node.path
+        })
+        value = yield
+        if not node.is_attached:
+            return  # replaced or deleted in the meantime
+
+        self.mbrowser.replace_value_node(node.path, value)
+
+
 class LivejsCbCommit(BackendInteractingTextCommand, ModuleBrowserCommandMixin):
     @method.primary
     def run(self):
@@ -2,15 +2,17 @@ import contextlib
 import functools
 import sublime
 
-from .nodes import JsArray
-from .nodes import JsLeaf
-from .nodes import JsObject
+from .nodes import render_nodes
+from .patch import plan_patch
 from live.common.misc import tracking_last
 from live.settings import setting
 from live.shared.cursor import Cursor
 from live.shared.js_cursor import StructuredCursor
+from live.shared.js_cursor import view_text
+from live.shared.js_render import TextCursor
 from live.sublime.edit import edit_for
 from live.sublime.edit import edits_self_view
+from live.sublime.misc import add_hidden_regions
 from live.sublime.misc import is_subregion
 from live.sublime.misc import read_only_set_to
 from live.sublime.region_edit import RegionEditHelper
@@ -25,6 +27,8 @@ class ModuleBrowser:
 
     MSG_NEEDS_REFRESH = "<<< Module browser is out of sync. Please refresh! >>>"
 
+    ROOT_PREFIX = '$ = '
+
     def __init__(self, view):
         self.view = view
         self.module_id = setting.module_id[view]
@@ -35,6 +39,10 @@ class ModuleBrowser:
         self.new_node_position = None
         self.reh = None
         self.is_pristine = True
+        # Module version (and BE epoch it's meaningful in) the browser contents correspond
+        # to.  version is None when unknown, which means a refresh needs a full snapshot.
+        self.epoch = None
+        self.version = None
 
     @property
     def is_online(self):
@@ -319,80 +327,217 @@ class ModuleBrowser:
                 node, region = self._insert_js_value(cur, value)
                 parent.insert_at(new_index, node, region)
 
+    @edits_self_view
+    def move_node(self, path, new_path):
+        """Move the node at path within its parent so that it ends up at new_path
+
+        The entry's text is cut and pasted along with the regions of its subtree, nothing
+        is rendered anew.
+
+        :return: False if that cannot be done because editing is in progress nearby
+        """
+        node = self.root.value_node_at(path)
+        parent, pos, new_pos = node.parent, path[-1], new_path[-1]
+        if pos == new_pos:
+            return True
+
+        if self.is_editing and parent.region.intersects(self.edit_region):
+            return False
+
+        entry_reg = parent.entries[pos].region
+        text = self.view.substr(entry_reg)
+        key_reg = parent.key_nodes[pos].region if parent.is_object else None
+        value_reg = node.region
+        subtree_regions = node.subtree_regions()
+
+        others = [parent.entries[i] for i in range(parent.num_children) if i != pos]
+
+        with read_only_set_to(self.view, False):
+            # Paste first.  Entries around keep track of the text inserted next to them,
+            # and the pasted text doesn't touch what's going to be cut.
+            if new_pos < len(others):
+                cur = self._make_cursor(others[new_pos].begin, parent)
+                begin = cur.pos
+                cur.insert(text)
+                cur.insert_inter_sep()
+            else:
+                cur = self._make_cursor(others[-1].end, parent)
+                cur.insert_inter_sep()
+                begin = cur.pos
+                cur.insert(text)
+
+            # Then cut, along with a separator (the same way delete_node() does)
+            reg = parent.entries[pos].region
+            if pos == 0:
+                diereg = sublime.Region(reg.a, parent.entries[1].begin)
+            else:
+                diereg = sublime.Region(parent.entries[pos - 1].end, reg.b)
+            self.view.erase(edit_for[self.view], diereg)
+
+        if diereg.a < begin:
+            begin -= diereg.size()
+
+        def shifted(reg):
+            return sublime.Region(reg.a + begin - entry_reg.a, reg.b + begin - entry_reg.a)
+
+        if parent.is_object:
+            parent.move_at(pos, new_pos, shifted(key_reg), shifted(value_reg))
+        else:
+            parent.move_at(pos, new_pos, shifted(value_reg))
+
+        for regkey, regions in subtree_regions.items():
+            add_hidden_regions(self.view, regkey, [shifted(reg) for reg in regions])
+
+        return True
+
+    def apply_change(self, desc):
+        """Apply a change descriptor (as sent with persist messages) to the browser
+
+        Descriptors of versions the browser already has are ignored.  If some versions
+        are missing, the browser is out of sync and only a full refresh can fix it.  A
+        coalesced descriptor (see persist_coalesce.py) stands for versions firstVersion
+        through version.
+
+        :return: False if the browser is out of sync, True otherwise
+        """
+        if self.version is not None and desc['version'] <= self.version:
+            return True
+
+        first_version = desc.get('firstVersion', desc['version'])
+        if self.version is None or first_version != self.version + 1:
+            self._go_out_of_sync()
+            return False
+
+        try:
+            is_hidden = self._is_hidden_in_unexpanded(desc['path'])
+        except LookupError:
+            self._go_out_of_sync()
+            return False
+
+        if is_hidden:
+            # We don't display that part of the module anyway
+            self.version = desc['version']
+            return True
+
+        operation = desc['operation']
+        if operation == 'replace':
+            self.replace_value_node(desc['path'], desc['newValue'])
+        elif operation == 'rename_key':
+            self.replace_key_node(desc['path'], desc['newName'])
+        elif operation == 'delete':
+            self.delete_node(desc['path'])
+        elif operation == 'insert':
+            self.insert_node(desc['path'], desc['key'], desc['value'])
+        elif operation == 'move':
+            if not self.move_node(desc['path'], desc['newPath']):
+                self._go_out_of_sync()
+                return False
+        else:
+            raise RuntimeError("Unknown change descriptor: {}".format(desc))
+
+        self.version = desc['version']
+        return True
+
+    def _go_out_of_sync(self):
+        self.version = None
+        sublime.status_message(self.MSG_NEEDS_REFRESH)
+
+    def skip_changes(self, first_version, version):
+        """Account for module versions whose changes cancelled each other out"""
+        if self.version is not None and first_version == self.version + 1:
+            self.version = version
+
+    def _is_hidden_in_unexpanded(self, path):
+        """Whether the node at path (or its parent) lies within an unexpanded node
+
+        :raise LookupError: if path leads through a leaf or past the last child, i.e. it
+                            does not fit the tree displayed
+        """
+        node = self.root
+        for n in path[:-1]:
+            if node.is_leaf or not 0 <= n < node.num_children:
+                raise LookupError("No node at {}".format(path))
+            node = node.value_nodes[n]
+            if node.is_unexpanded:
+                return True
+
+        return False
+
     def focus_view(self):
         self.view.window().focus_view(self.view)
 
     @edits_self_view
-    def refresh(self, root_object):
-        if self.is_online:
-            self.root.put_offline()
-            self.root = None
+    def refresh(self, snapshot):
+        """Bring the view in line with snapshot
 
-        with read_only_set_to(self.view, False),\
-                viewport_and_selection_globally_preserved(self.view):
-            self.view.erase(edit_for[self.view], sublime.Region(0, self.view.size()))
-
-            cur = StructuredCursor(0, self.view)
-            cur.insert('$ = ')
+        If the browser is online, only what differs is changed (see patch.py).  Otherwise,
+        or if that is not possible, the view is rebuilt from scratch.
 
-            self.root, _ = self._insert_js_value(cur, root_object)
-            self.root.put_online(self.view)
+        :param snapshot: as returned by getModuleObject: {object, epoch, version}
+        """
+        if self.is_offline or self.is_editing or not self._patch(snapshot['object']):
+            self._rebuild(snapshot['object'])
 
-            self.view.window().focus_view(self.view)
+        self.epoch = snapshot['epoch']
+        self.version = snapshot['version']
+        self.focus_view()
 
-    def _insert_js_value(self, cur, jsval):
-        """Insert JS serialized value using the structured cursor cur.
+    def _patch(self, jsval):
+        """Patch the displayed tree to jsval
 
-        :return: (node, region)
+        :return: False if that could not be done and nothing has been changed, True
+                 otherwise
         """
+        old_text = view_text(self.view)
+        tcur = TextCursor(pos=len(self.ROOT_PREFIX))
+        new_root, _ = render_nodes(tcur, jsval)
+        new_text = self.ROOT_PREFIX + tcur.text
 
-        def insert_object(obj):
-            node = JsObject()
-            
-            with cur.laying_out('object') as separate:
-                for key, value in obj.items():
-                    separate()
-                    cur.push()
-                    cur.insert(key)
-                    key_region = cur.pop_region()
+        if old_text == new_text:
+            return True
 
-                    cur.insert_keyval_sep()
+        groups = plan_patch(self, old_text, new_text, new_root, jsval)
+        if groups is None:
+            return False
 
-                    value_node, value_region = insert_any(value)
-                    node.append(key_region, value_node, value_region)
+        with read_only_set_to(self.view, False),\
+                viewport_position_preserved(self.view):
+            for group in reversed(groups):
+                for thunk in group:
+                    thunk()
 
-            return node
+        if view_text(self.view) != new_text:
+            # The view was laid out differently from how it's rendered now
+            self._rebuild(jsval)
 
-        def insert_array(array):
-            node = JsArray()
+        return True
+
+    def _rebuild(self, jsval):
+        if self.is_online:
+            self.root.put_offline()
+            self.root = None
 
-            with cur.laying_out('array') as separate:
-                for value in array:
-                    separate()
-                    subnode, region = insert_any(value)
-                    node.append(subnode, region)
+        with read_only_set_to(self.view, False),\
+                viewport_and_selection_globally_preserved(self.view):
+            self.view.erase(edit_for[self.view], sublime.Region(0, self.view.size()))
 
-            return node
+            cur = StructuredCursor(0, self.view)
+            cur.insert(self.ROOT_PREFIX)
 
-        def insert_any(jsval):
-            cur.push()
+            self.root, _ = self._insert_js_value(cur, jsval)
+            self.root.put_online(self.view)
 
-            if jsval['type'] == 'leaf':
-                cur.insert(jsval['value'])
-                node = JsLeaf()
-            elif jsval['type'] == 'function':
-                cur.insert_function(jsval['value'])
-                node = JsLeaf()
-            elif jsval['type'] == 'object':
-                node = insert_object(jsval['value'])
-            elif jsval['type'] == 'array':
-                node = insert_array(jsval['value'])
-            else:
-                raise RuntimeError("Unexpected jsval: {}".format(jsval))
+    def _insert_js_value(self, cur, jsval):
+        """Insert JS serialized value at the structured cursor cur.
 
-            return node, cur.pop_region()
+        The value is rendered first and then inserted into the view in one go.
 
-        return insert_any(jsval)
+        :return: (node, region)
+        """
+        tcur = TextCursor.at(cur)
+        node, region = render_nodes(tcur, jsval)
+        cur.insert(tcur.text)
+        return node, region
 
     def set_status_be_pending(self):
         self.view.set_status('livejs_pending', "LiveJS: back-end is processing..")
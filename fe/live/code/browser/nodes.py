@@ -3,6 +3,11 @@ import sublime
 from live.sublime.misc import add_hidden_regions
 from live.sublime.misc import hidden_region_list
 from live.common.misc import serially
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+from live.shared.jsvalue import jsval_text
+from live.shared.jsvalue import jsval_type
+from live.shared.jsvalue import jsval_unexpanded
 
 
 class JsNode:
@@ -10,10 +15,15 @@ class JsNode:
     is_key = False
     is_object = False
     is_array = False
+    is_unexpanded = False
 
     def __init__(self):
         super().__init__()
         self.parent = None
+        # Index in the parent's list of siblings, maintained by the parent
+        self.position = None
+        # (depth, root), computed when first needed.  If a node has it, so does its parent.
+        self._location = None
 
     @property
     def is_attached(self):
@@ -22,10 +32,32 @@ class JsNode:
     def attach_to(self, parent):
         assert not self.is_attached
         self.parent = parent
+        self._forget_location()
 
     def detach(self):
         assert self.is_attached
         self.parent = None
+        self.position = None
+        self._forget_location()
+
+    def _locate(self):
+        if self._location is None:
+            if self.is_root:
+                self._location = (0, self)
+            else:
+                depth, root = self.parent._locate()
+                self._location = (depth + 1, root)
+
+        return self._location
+
+    def _forget_location(self):
+        if self._location is not None:
+            self._location = None
+            for child in self._child_nodes():
+                child._forget_location()
+
+    def _child_nodes(self):
+        return []
 
     @property
     def is_online(self):
@@ -43,29 +75,16 @@ class JsNode:
 
     @property
     def root(self):
-        node = self
-        while not node.is_root:
-            node = node.parent
-        return node
+        return self._locate()[1]
 
     @property
     def is_root(self):
         return self.parent is None
 
-    @property
-    def position(self):
-        return self._my_siblings.index(self)
-
     @property
     def depth(self):
         """Root has depth of 0, its children - 1, grandchildren - 2, etc."""
-        node = self
-        depth = 0
-        while not node.is_root:
-            depth += 1
-            node = node.parent
-
-        return depth
+        return self._locate()[0]
 
     @property
     def nesting(self):
@@ -161,12 +180,21 @@ class JsNode:
     def textually_preceding_sibling_circ(self):
         return self.parent._child_textually_preceding_circ(self)
 
+    @property
+    def contains_unexpanded(self):
+        """Whether self is, or has a descendant which is, an unexpanded placeholder"""
+        return self.is_unexpanded
+
     def _add_retained_regions_full_depth(self):
         """Does nothing for all nodes except composite ones, which see"""
 
     def _erase_regions_full_depth(self):
         """Does nothing for all nodes except composite ones, which see"""
 
+    def subtree_regions(self):
+        """{regkey: [region]} retained for the descendants of self"""
+        return {}
+
 
 class JsLeaf(JsNode):
     is_leaf = True
@@ -178,6 +206,23 @@ class JsLeaf(JsNode):
         return '#<jsleaf>'
 
 
+class JsUnexpanded(JsLeaf):
+    """Placeholder for an object or array the BE did not serialize (too big or deep)
+
+    It can be expanded by fetching its value separately.
+    """
+
+    is_unexpanded = True
+
+    def __init__(self, kind, size):
+        super().__init__()
+        self.kind = kind
+        self.size = size
+
+    def __repr__(self):
+        return '#<jsunexpanded {} of {}>'.format(self.kind, self.size)
+
+
 class JsKey(JsNode):
     is_leaf = True
     is_key = True
@@ -222,8 +267,7 @@ class JsComposite(JsNode):
         self.child_id = None
 
     def attach_to(self, parent):
-        assert not self.is_attached
-        self.parent = parent
+        super().attach_to(parent)
         self.child_id = '{:X}'.format(parent.child_id_seq)
         parent.child_id_seq += 1
         if parent.is_online:
@@ -233,7 +277,7 @@ class JsComposite(JsNode):
         assert self.is_attached
         if self.parent.is_online:
             self._erase_regions_full_depth()
-        self.parent = None
+        super().detach()
 
     @property
     def dotpath(self):
@@ -251,6 +295,10 @@ class JsComposite(JsNode):
     def num_children(self):
         return len(self.value_nodes)
 
+    @property
+    def contains_unexpanded(self):
+        return any(child.contains_unexpanded for child in self.value_nodes)
+
     def _add_retained_regions(self):
         raise NotImplementedError
 
@@ -274,12 +322,19 @@ class JsComposite(JsNode):
             child._erase_regions_full_depth()
         self._erase_regions()
 
+    def subtree_regions(self):
+        res = {regkey: self.view.get_regions(regkey) for regkey in self.regkeys}
+        for child in self.value_nodes:
+            res.update(child.subtree_regions())
+        return res
+
     def replace_value_node_at(self, pos, new_node, new_reg):
         assert self.is_online
 
         old_node = self.value_nodes[pos]
         old_node.detach()
         new_node.attach_to(self)
+        new_node.position = pos
         self.value_nodes[pos] = new_node
 
         with hidden_region_list(self.view, self.regkey_values) as regions:
@@ -363,6 +418,14 @@ class JsObject(JsComposite):
     def entries(self):
         return ObjectEntries(self)
 
+    def _child_nodes(self):
+        return self.key_nodes + self.value_nodes
+
+    def _renumber(self, start, stop=None):
+        """Update positions of the children at start:stop"""
+        for pos in range(start, len(self.value_nodes) if stop is None else stop):
+            self.key_nodes[pos].position = self.value_nodes[pos].position = pos
+
     @property
     def regkey_keys(self):
         return dotpath_join(self.dotpath, 'keys')
@@ -371,6 +434,10 @@ class JsObject(JsComposite):
     def regkey_values(self):
         return dotpath_join(self.dotpath, 'values')
 
+    @property
+    def regkeys(self):
+        return [self.regkey_keys, self.regkey_values]
+
     def _add_retained_regions(self):
         add_hidden_regions(self.view, self.regkey_keys, self.key_regions)
         del self.key_regions
@@ -392,12 +459,15 @@ class JsObject(JsComposite):
         value_node.attach_to(self)
         self.value_regions.append(value_region)
 
+        self._renumber(len(self.value_nodes) - 1)
+
     def insert_at(self, pos, key_region, value_node, value_region):
         assert self.is_online, "Why do we need to insert into an unattached node?"
 
         self.key_nodes.insert(pos, JsKey(self))
         self.value_nodes.insert(pos, value_node)
         value_node.attach_to(self)
+        self._renumber(pos)
 
         with hidden_region_list(self.view, self.regkey_keys) as regions:
             regions.insert(pos, key_region)
@@ -416,6 +486,23 @@ class JsObject(JsComposite):
 
         self.key_nodes.pop(pos).detach()
         self.value_nodes.pop(pos).detach()
+        self._renumber(pos)
+
+    def move_at(self, pos, new_pos, key_region, value_region):
+        """Move the child at pos so that it's at new_pos, with the given new regions"""
+        assert self.is_online
+
+        self.key_nodes.insert(new_pos, self.key_nodes.pop(pos))
+        self.value_nodes.insert(new_pos, self.value_nodes.pop(pos))
+        self._renumber(min(pos, new_pos), max(pos, new_pos) + 1)
+
+        with hidden_region_list(self.view, self.regkey_keys) as regions:
+            del regions[pos]
+            regions.insert(new_pos, key_region)
+
+        with hidden_region_list(self.view, self.regkey_values) as regions:
+            del regions[pos]
+            regions.insert(new_pos, value_region)
 
     def replace_key_node_region_at(self, pos, region):
         with hidden_region_list(self.view, self.regkey_keys) as regions:
@@ -460,10 +547,22 @@ class JsArray(JsComposite):
     def entries(self):
         return self.value_nodes
 
+    def _child_nodes(self):
+        return self.value_nodes
+
+    def _renumber(self, start, stop=None):
+        """Update positions of the children at start:stop"""
+        for pos in range(start, len(self.value_nodes) if stop is None else stop):
+            self.value_nodes[pos].position = pos
+
     @property
     def regkey_values(self):
         return dotpath_join(self.dotpath, 'values')
 
+    @property
+    def regkeys(self):
+        return [self.regkey_values]
+
     def _add_retained_regions(self):
         add_hidden_regions(self.view, self.regkey_values, self.value_regions)
         del self.value_regions
@@ -477,6 +576,7 @@ class JsArray(JsComposite):
 
         self.value_nodes.append(node)
         node.attach_to(self)
+        node.position = len(self.value_nodes) - 1
         self.value_regions.append(region)
 
     def insert_at(self, pos, node, region):
@@ -484,6 +584,7 @@ class JsArray(JsComposite):
 
         self.value_nodes.insert(pos, node)
         node.attach_to(self)
+        self._renumber(pos)
 
         with hidden_region_list(self.view, self.regkey_values) as regions:
             regions.insert(pos, region)
@@ -495,6 +596,18 @@ class JsArray(JsComposite):
             del regions[pos]
 
         self.value_nodes.pop(pos).detach()
+        self._renumber(pos)
+
+    def move_at(self, pos, new_pos, region):
+        """Move the child at pos so that it's at new_pos, with the given new region"""
+        assert self.is_online
+
+        self.value_nodes.insert(new_pos, self.value_nodes.pop(pos))
+        self._renumber(min(pos, new_pos), max(pos, new_pos) + 1)
+
+        with hidden_region_list(self.view, self.regkey_values) as regions:
+            del regions[pos]
+            regions.insert(new_pos, region)
 
     def _child_textually_following_circ(self, child):
         return child.following_sibling_circ
@@ -543,6 +656,75 @@ class ObjectEntry:
         return self.node.value_nodes[self.i].end
 
 
+def render_nodes(tcur, jsval):
+    """Render JS serialized value with TextCursor tcur into a tree of offline nodes
+
+    :return: (node, region)
+    """
+    def pop_region():
+        return sublime.Region(*tcur.pop_region())
+
+    def render_object(jsval):
+        node = JsObject()
+
+        with tcur.laying_out('object') as separate:
+            for key, value in jsval_object_items(jsval):
+                separate()
+                tcur.push()
+                tcur.insert(key)
+                key_region = pop_region()
+
+                tcur.insert_keyval_sep()
+
+                value_node, value_region = render_any(value)
+                node.append(key_region, value_node, value_region)
+
+        return node
+
+    def render_array(jsval):
+        node = JsArray()
+
+        with tcur.laying_out('array') as separate:
+            for value in jsval_array_items(jsval):
+                separate()
+                subnode, region = render_any(value)
+                node.append(subnode, region)
+
+        return node
+
+    def render_any(jsval):
+        tcur.push()
+
+        jstype = jsval_type(jsval)
+        if jstype == 'leaf':
+            tcur.insert(jsval_text(jsval))
+            node = JsLeaf()
+        elif jstype == 'function':
+            tcur.insert_function(jsval_text(jsval))
+            node = JsLeaf()
+        elif jstype == 'object':
+            node = render_object(jsval)
+        elif jstype == 'array':
+            node = render_array(jsval)
+        elif jstype == 'unexpanded':
+            kind, size = jsval_unexpanded(jsval)
+            tcur.insert(unexpanded_placeholder(kind, size))
+            node = JsUnexpanded(kind, size)
+        else:
+            raise RuntimeError("Unexpected jsval: {}".format(jsval))
+
+        return node, pop_region()
+
+    return render_any(jsval)
+
+
+def unexpanded_placeholder(kind, size):
+    if kind == 'object':
+        return '{{/* {} entries */}}'.format(size)
+    else:
+        return '[/* {} items */]'.format(size)
+
+
 def dotpath_join(dotpath, item):
     if dotpath:
         return '{}.{}'.format(dotpath, item)
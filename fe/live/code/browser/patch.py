@@ -0,0 +1,141 @@
+"""Patching the module browser to a new module snapshot
+
+The node tree displayed in the browser is compared with a tree rendered (offline) from
+the snapshot.  Subtrees whose text is the same are left alone, with their nodes and
+regions.  What differs is changed with the ordinary node operations of ModuleBrowser:
+replace_value_node(), replace_key_node(), insert_node() and delete_node().  So the work
+done in the view is proportional to the size of the change, not of the module.
+"""
+
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+
+
+def plan_patch(mbrowser, old_text, new_text, new_root, new_jsval):
+    """Compute what to do to bring the browser from old_text to new_text
+
+    :param new_root: offline node tree rendered from new_jsval, its regions are within
+                     new_text
+    :return: list of groups, in document order.  A group is a list of thunks to be called
+             in order.  Groups must be applied from last to first, so that paths (which
+             are in the old numbering) stay valid.  None if the tree cannot be patched.
+    """
+    old_root = mbrowser.root
+    view = mbrowser.view
+    groups = []
+
+    def diff_object(path, old, new, jsval):
+        old_keys = view.get_regions(old.regkey_keys)
+        old_values = view.get_regions(old.regkey_values)
+        items = list(jsval_object_items(jsval))
+
+        def old_key(i):
+            return old_text[old_keys[i].a:old_keys[i].b]
+
+        def new_key(i):
+            return new_text[new.key_regions[i].a:new.key_regions[i].b]
+
+        def diff_entry(i, j):
+            diff_any(path + [i], old.value_nodes[i], old_values[i],
+                     new.value_nodes[j], new.value_regions[j], items[j][1])
+
+        n_old, n_new = old.num_children, new.num_children
+        prefix = common_length(n_old, n_new, lambda i: old_key(i) == new_key(i))
+        suffix = common_length(
+            n_old - prefix, n_new - prefix,
+            lambda i: old_key(n_old - 1 - i) == new_key(n_new - 1 - i)
+        )
+
+        for i in range(prefix):
+            diff_entry(i, i)
+
+        if n_old == n_new:
+            for i in range(prefix, n_old - suffix):
+                if old_key(i) != new_key(i):
+                    add_group(mbrowser.replace_key_node, path + [i], new_key(i))
+                diff_entry(i, i)
+        else:
+            replace_entries(path, prefix, n_old - prefix - suffix,
+                            items[prefix:n_new - suffix])
+
+        for k in range(suffix, 0, -1):
+            diff_entry(n_old - k, n_new - k)
+
+    def diff_array(path, old, new, jsval):
+        old_values = view.get_regions(old.regkey_values)
+        items = list(jsval_array_items(jsval))
+
+        def old_entry(i):
+            return old_text[old_values[i].a:old_values[i].b]
+
+        def new_entry(i):
+            return new_text[new.value_regions[i].a:new.value_regions[i].b]
+
+        def diff_entry(i, j):
+            diff_any(path + [i], old.value_nodes[i], old_values[i],
+                     new.value_nodes[j], new.value_regions[j], items[j])
+
+        n_old, n_new = old.num_children, new.num_children
+        if n_old == n_new:
+            for i in range(n_old):
+                diff_entry(i, i)
+            return
+
+        prefix = common_length(n_old, n_new, lambda i: old_entry(i) == new_entry(i))
+        suffix = common_length(
+            n_old - prefix, n_new - prefix,
+            lambda i: old_entry(n_old - 1 - i) == new_entry(n_new - 1 - i)
+        )
+        replace_entries(path, prefix, n_old - prefix - suffix,
+                        [(None, value) for value in items[prefix:n_new - suffix]])
+
+    def replace_entries(path, pos, n_deleted, new_entries):
+        """Replace n_deleted entries starting at pos with new_entries [(key, value)]
+
+        New entries are inserted before the old ones are deleted, so the container
+        doesn't become empty in between (unless it ends up empty).
+        """
+        group = []
+        for i, (key, value) in enumerate(new_entries):
+            group.append(bind(mbrowser.insert_node, path + [pos + i], key, value))
+
+        start = pos + len(new_entries)
+        for i in range(start + n_deleted - 1, start - 1, -1):
+            group.append(bind(mbrowser.delete_node, path + [i]))
+
+        groups.append(group)
+
+    def diff_any(path, old, old_reg, new, new_reg, jsval):
+        if old_text[old_reg.a:old_reg.b] == new_text[new_reg.a:new_reg.b]:
+            return
+
+        if old.is_object and new.is_object:
+            diff_object(path, old, new, jsval)
+        elif old.is_array and new.is_array:
+            diff_array(path, old, new, jsval)
+        else:
+            add_group(mbrowser.replace_value_node, path, jsval)
+
+    def add_group(fn, *args):
+        groups.append([bind(fn, *args)])
+
+    if not (old_root.is_object and new_root.is_object):
+        return None
+    if old_root.num_children == 0 or new_root.num_children == 0:
+        # Insertion into (or deletion of everything from) the root is not supported
+        return None
+
+    diff_object([], old_root, new_root, new_jsval)
+    return groups
+
+
+def common_length(n_old, n_new, same):
+    """Number of leading i for which same(i) holds, at most min(n_old, n_new)"""
+    n = 0
+    while n < n_old and n < n_new and same(n):
+        n += 1
+    return n
+
+
+def bind(fn, *args):
+    return lambda: fn(*args)
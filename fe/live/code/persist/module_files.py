@@ -0,0 +1,256 @@
+"""Persisting to module files that are not open in any view
+
+Descriptors are applied to the file text held in a StringBuffer, by the same persist
+operations (and cursors) that work with views.  No view is opened for that.
+
+Each descriptor is first appended to the journal of its project (see persist_journal.py),
+and the buffer is marked dirty.  The compactor thread periodically fsyncs the journals,
+and every once in a while writes dirty buffers to their module files atomically and drops
+the journal records that the files now reflect.  So a high rate of edits costs small
+appends, not rewrites of whole files.
+
+Buffers are kept for as long as nobody else changes the file.  While a buffer has changes
+not written yet, the file is assumed to be ours.
+"""
+
+import os
+import threading
+import time
+import traceback
+
+from live.common.misc import file_contents
+from live.common.misc import write_file_atomically
+from live.common.persist_journal import Journal
+from live.common.persist_journal import recover
+from live.common.persist_journal import take_stamp
+from live.gstate import config
+from live.shared.string_buffer import StringBuffer
+from live.sublime.edit import edit_for
+from live.sublime.view_info import discard_view_info
+from live.ws_handler import ws_handler
+
+
+def stat_signature(filepath):
+    st = os.stat(filepath)
+    return st.st_mtime_ns, st.st_size
+
+
+class ModuleFile:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.buffer = StringBuffer(file_contents(filepath), file_name=filepath)
+        self.signature = stat_signature(filepath)
+        self.is_dirty = False
+        # Moment the buffer became dirty (for metrics)
+        self.dirty_since = None
+        # Texts taken by the compactor and not yet written
+        self.n_writes_pending = 0
+        # Name of the module and path of its project, known once it's changed
+        self.module_name = None
+        self.project_path = None
+
+    @property
+    def is_ours(self):
+        return self.is_dirty or self.n_writes_pending > 0
+
+
+class ModuleFiles:
+    def __init__(self):
+        # Guards everything below.  Buffers are changed on the main thread and written
+        # from the compactor thread.
+        self.lock = threading.Lock()
+        self.files = {}  # {filepath: ModuleFile}
+        self.journals = {}  # {project path: Journal}
+
+    def _file_for(self, filepath):
+        mfile = self.files.get(filepath)
+        if mfile is not None and not mfile.is_ours and \
+                mfile.signature != stat_signature(filepath):
+            self._forget(mfile)
+            mfile = None
+
+        if mfile is None:
+            mfile = self.files[filepath] = ModuleFile(filepath)
+
+        return mfile
+
+    def _forget(self, mfile):
+        del self.files[mfile.filepath]
+        discard_view_info(mfile.buffer)
+
+    def _journal_for(self, project_path):
+        if project_path not in self.journals:
+            self.journals[project_path] = Journal(project_path)
+        return self.journals[project_path]
+
+    def has_unwritten_changes(self, filepath):
+        with self.lock:
+            mfile = self.files.get(filepath)
+            return mfile is not None and mfile.is_ours
+
+    def apply(self, project, descs, apply_desc):
+        """Journal descs of a single module and apply them to the text of its file
+
+        :param apply_desc: function (desc, view) that applies a persist descriptor
+        """
+        module_name = descs[0]['moduleName']
+        filepath = project.module_filepath(module_name)
+
+        with self.lock:
+            mfile = self._file_for(filepath)
+            journal = self._journal_for(project.path)
+            for desc in descs:
+                journal.append(module_name, desc)
+            mfile.module_name, mfile.project_path = module_name, project.path
+            if not mfile.is_dirty:
+                mfile.is_dirty = True
+                mfile.dirty_since = time.perf_counter()
+
+            # Persist operations expect to be given an edit for the view they change
+            edit_for[mfile.buffer] = None
+            try:
+                for desc in descs:
+                    apply_desc(desc, mfile.buffer)
+            finally:
+                del edit_for[mfile.buffer]
+
+    def recover(self, project, apply_desc):
+        """Replay what's left in the project's journal, e.g. after a crash
+
+        Must be done before the project's module files are read.
+
+        :param apply_desc: function (desc, view) that applies a persist descriptor
+        :return: number of descriptors replayed
+        """
+        def apply_to_buffer(desc, buf):
+            edit_for[buf] = None
+            try:
+                apply_desc(desc, buf)
+            finally:
+                del edit_for[buf]
+
+        with self.lock:
+            if project.path in self.journals:
+                return 0  # the journal is in use, nothing to recover
+            return recover(project.path, project.module_filepath, apply_to_buffer)
+
+    def sync_journals(self):
+        with self.lock:
+            journals = list(self.journals.values())
+
+        for journal in journals:
+            journal.sync()
+
+    def journal_size(self):
+        with self.lock:
+            return sum(journal.size() for journal in self.journals.values())
+
+    def close_journals(self):
+        with self.lock:
+            for journal in self.journals.values():
+                journal.close()
+            self.journals.clear()
+
+    def compact(self):
+        """Write dirty buffers to their files and truncate the journals accordingly"""
+        with self.lock:
+            snapshots = []
+            for mfile in self.files.values():
+                if mfile.is_dirty:
+                    snapshots.append((mfile, mfile.buffer.text, mfile.dirty_since,
+                                      self._journal_for(mfile.project_path)))
+                    mfile.is_dirty = False
+                    mfile.n_writes_pending += 1
+
+            offsets = [(journal, journal.size()) for journal in self.journals.values()]
+            stamp = take_stamp()
+
+        if not snapshots:
+            return
+
+        # Tell which records the files are going to reflect.  That must be durable before
+        # the files are replaced, see persist_journal.py.
+        for mfile, text, dirty_since, journal in snapshots:
+            journal.append_compaction(mfile.module_name, stamp, text)
+        for journal in {journal for mfile, text, dirty_since, journal in snapshots}:
+            journal.sync()
+
+        all_written = True
+        for mfile, text, dirty_since, journal in snapshots:
+            try:
+                write_file_atomically(mfile.filepath, text)
+                signature = stat_signature(mfile.filepath)
+            except OSError:
+                traceback.print_exc()
+                all_written = False
+                signature = None
+
+            with self.lock:
+                mfile.n_writes_pending -= 1
+                if signature is None:
+                    if not mfile.is_dirty:
+                        mfile.is_dirty = True
+                        mfile.dirty_since = dirty_since
+                else:
+                    mfile.signature = signature
+
+            if signature is not None:
+                ws_handler.metrics.module_saved(
+                    'file', time.perf_counter() - dirty_since, signature[1]
+                )
+
+        # write_file_atomically() has made the files durable, so the records they reflect
+        # may go
+        if all_written:
+            for journal, offset in offsets:
+                journal.sync()
+                journal.truncate_upto(offset)
+
+
+class Compactor:
+    """Thread that fsyncs persist journals and folds them into module files"""
+
+    def __init__(self, module_files):
+        self.module_files = module_files
+        self.evt_stop = threading.Event()
+        self.thread = None
+
+    @property
+    def is_running(self):
+        return self.thread is not None
+
+    def start(self):
+        assert not self.is_running
+        self.evt_stop.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread after a final compaction"""
+        assert self.is_running
+        self.evt_stop.set()
+        self.thread.join()
+        self.thread = None
+        self.module_files.close_journals()
+
+    def _run(self):
+        compacted_at = time.perf_counter()
+
+        while not self.evt_stop.wait(config.persist_journal_sync_interval):
+            try:
+                self.module_files.sync_journals()
+                if time.perf_counter() - compacted_at >= config.persist_compact_interval \
+                        or self.module_files.journal_size() >= config.persist_compact_size:
+                    self.module_files.compact()
+                    compacted_at = time.perf_counter()
+            except Exception:
+                traceback.print_exc()
+
+        try:
+            self.module_files.compact()
+        except Exception:
+            traceback.print_exc()
+
+
+module_files = ModuleFiles()
+compactor = Compactor(module_files)
@@ -1,8 +1,11 @@
-from copy import copy
+import sublime
 
+from live.shared.source_index import SourceIndex
 from live.shared.js_cursor import StructuredCursor
+from live.shared.js_cursor import view_text
+from live.shared.js_render import js_value_text
 from live.sublime.edit import edits_view_arg
-from live.sublime.view_saver import saver
+from live.sublime.view_info import view_info_getter
 
 
 class PersistCursor(StructuredCursor):
@@ -28,74 +31,140 @@ class PersistCursor(StructuredCursor):
 
         return cur
 
+    @classmethod
+    def at_indexed_path(cls, view, index, path):
+        """Same as at_module_path() but located with the index"""
+        if not path:
+            return cls(index.root_pos, view, inside_what='array')
+
+        return cls(
+            index.entry_pos(path), view,
+            depth=len(path) - 1,
+            inside_what=index.container_kind(path[:-1])
+        )
+
+    @classmethod
+    def at_indexed_insertion(cls, view, index, parent_path, n):
+        """Same as at_module_path(parent_path) followed by prepare_for_insertion_at(n)"""
+        cur = cls(
+            index.insertion_pos(parent_path, n), view,
+            depth=len(parent_path),
+            inside_what=index.container_kind(parent_path)
+        )
+        cur.prepare_for_insertion()
+        return cur
+
+
+class IndexedSource:
+    """Module source view along with its SourceIndex
+
+    The index is rebuilt whenever the view was changed by something other than persist
+    operations (e.g. the user typing), which we detect by the view's change count.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None or self._index.change_count != self.view.change_count():
+            self._index = SourceIndex(view_text(self.view))
+            self._index.change_count = self.view.change_count()
+
+        return self._index
 
-def insert_js_value(cur, jsval):
-    def insert_object(obj):
-        with cur.laying_out('object') as separate:
-            for key, value in obj.items():
-                separate()
-                cur.insert(key)
-                cur.insert_keyval_sep()
-                insert_any(value)
-
-    def insert_array(arr):
-        with cur.laying_out('array') as separate:
-            for value in arr:
-                separate()
-                insert_any(value)
-
-    def insert_any(jsval):
-        if jsval['type'] == 'leaf':
-            cur.insert(jsval['value'])
-        elif jsval['type'] == 'function':
-            cur.insert_function(jsval['value'])
-        elif jsval['type'] == 'object':
-            insert_object(jsval['value'])
-        elif jsval['type'] == 'array':
-            insert_array(jsval['value'])
-        else:
-            raise RuntimeError("Unexpected jsval: {}".format(jsval))
-
-    insert_any(jsval)
+    def updated(self):
+        """Call after the index has been updated to reflect the latest edit"""
+        self._index.change_count = self.view.change_count()
+
+
+indexed_source_for = view_info_getter(IndexedSource, lambda view: True)
 
 
 @edits_view_arg
 def replace_value(view, path, new_value):
-    cur = PersistCursor.at_module_path(view, path)
+    source = indexed_source_for(view)
+    index = source.index
+    cur = PersistCursor.at_indexed_path(view, index, path)
     cur.erase_value()
-    insert_js_value(cur, new_value)
+    value_text = js_value_text(cur, new_value)
+    cur.insert(value_text)
 
-    saver.request_save(view)
+    index.value_replaced(path, value_text)
+    source.updated()
 
 
 @edits_view_arg
 def rename_key(view, path, new_name):
-    cur = PersistCursor.at_module_path(view, path)
+    source = indexed_source_for(view)
+    index = source.index
+    size = view.size()
+    cur = PersistCursor.at_indexed_path(view, index, path)
     cur.erase_object_key()
     cur.insert(new_name)
 
-    saver.request_save(view)
+    index.key_renamed(path, view.size() - size)
+    source.updated()
 
 
 @edits_view_arg
 def delete(view, path):
-    cur = PersistCursor.at_module_path(view, path)
+    source = indexed_source_for(view)
+    index = source.index
+    size = view.size()
+    cur = PersistCursor.at_indexed_path(view, index, path)
     cur.delete_entry()
 
-    saver.request_save(view)
+    index.entry_deleted(path, view.size() - size)
+    source.updated()
 
 
 @edits_view_arg
 def insert(view, path, key, value):
     parent_path, n = path[:-1], path[-1]
 
-    cur = PersistCursor.at_module_path(view, parent_path)
-    cur.prepare_for_insertion_at(n)
+    source = indexed_source_for(view)
+    index = source.index
+    size = view.size()
+    cur = PersistCursor.at_indexed_insertion(view, index, parent_path, n)
+    start = cur.pos
 
     if key is not None:
         cur.insert(key)
         cur.insert_keyval_sep()
 
-    insert_js_value(cur, value)
+    value_pos = cur.pos
+    value_text = js_value_text(cur, value)
+    cur.insert(value_text)
+
+    index.entry_inserted(path, start, value_pos, value_text, view.size() - size)
+    source.updated()
+
+
+@edits_view_arg
+def move(view, path, new_path):
+    """Move the entry at path within its container so that it ends up at new_path
+
+    The entry's text is cut and pasted as is.
+    """
+    if path == new_path:
+        return
+
+    source = indexed_source_for(view)
+    index = source.index
+    start, end = index.entry_span(path)
+    text = view.substr(sublime.Region(start, end))
+
+    size = view.size()
+    cur = PersistCursor.at_indexed_path(view, index, path)
+    cur.delete_entry()
+    entry = index.entry_deleted(path, view.size() - size)
+
+    size = view.size()
+    cur = PersistCursor.at_indexed_insertion(view, index, new_path[:-1], new_path[-1])
+    start = cur.pos
+    cur.insert(text)
 
-    saver.request_save(view)
+    index.entry_reinserted(new_path, start, entry, view.size() - size)
+    source.updated()
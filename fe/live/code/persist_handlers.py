@@ -1,49 +1,134 @@
-import os
 import sublime
 
-from functools import wraps
-
 from .browser.operations import module_browser_for
 from .browser.operations import module_browser_view_for_module_id
 from .persist import operations as persist
+from .persist.module_files import module_files
+from live.common.misc import file_contents
+from live.common.persist_coalesce import coalesce
 from live.projects.operations import project_by_id
 from live.projects.operations import window_for_project_id
+from live.shared.string_buffer import StringBuffer
+from live.sublime.edit import call_ensuring_edit_for
+from live.sublime.edit import edit_for
 from live.sublime.on_view_loaded import on_load
-from live.sublime.misc import open_filepath
+from live.sublime.view_saver import saver
 
-persist_handlers = {}
+persist_appliers = {}  # {operation: function (desc, view)}
 
 
 def persist_handler(fn):
     operation = fn.__name__
-    assert operation not in persist_handlers
-
-    @wraps(fn)
-    def wrapper(desc):
-        wnd = window_for_project_id(desc['projectId'])
-        project = project_by_id(desc['projectId'])
-
-        if wnd is None or project is None:
-            sublime.error_message(
-                "LiveJS back-end attempted to use project that the FE does not know about"
-            )
-            raise RuntimeError
-
-        mb_view = module_browser_view_for_module_id(wnd, desc['moduleId'])
-        mbrowser = module_browser_for(mb_view) if mb_view else None
-        view_source = open_filepath(wnd, project.module_filepath(desc['moduleName']))
-
-        @on_load(view_source)
-        def _():
-            fn(desc, mbrowser, view_source)
-
-    persist_handlers[operation] = wrapper
-    return wrapper
+    assert operation not in persist_appliers
+    persist_appliers[operation] = fn
+    return fn
+
+
+def apply_descriptor(desc, view):
+    persist_appliers[desc['operation']](desc, view)
+
+
+def apply_module_persists(descs):
+    """Apply a run of persist descriptors of a single module
+
+    The run is coalesced first (see persist_coalesce.py).  Descriptors that remain are
+    applied to the module source view under a single edit, or to the module file.
+    """
+    first, last = descs[0], descs[-1]
+    wnd = window_for_project_id(first['projectId'])
+    project = project_by_id(first['projectId'])
+
+    if wnd is None or project is None:
+        sublime.error_message(
+            "LiveJS back-end attempted to use project that the FE does not know about"
+        )
+        raise RuntimeError
+
+    descs = coalesce(descs)
+
+    mb_view = module_browser_view_for_module_id(wnd, first['moduleId'])
+    if mb_view is not None:
+        mbrowser = module_browser_for(mb_view)
+
+        def apply_to_browser():
+            for desc in descs:
+                mbrowser.apply_change(desc)
+
+        if mbrowser.is_online and descs:
+            call_ensuring_edit_for(mb_view, apply_to_browser)
+        elif mbrowser.is_online:
+            mbrowser.skip_changes(first['version'], last['version'])
+
+    if not descs:
+        return
+
+    filepath = project.module_filepath(first['moduleName'])
+    view_source = wnd.find_open_file(filepath)
+    # A view opened while there are unwritten changes doesn't have them yet
+    if view_source is None or module_files.has_unwritten_changes(filepath):
+        module_files.apply(project, descs, apply_descriptor)
+        return
+
+    @on_load(view_source)
+    def _():
+        def apply_all():
+            for desc in descs:
+                apply_descriptor(desc, view_source)
+
+        call_ensuring_edit_for(view_source, apply_all)
+        saver.request_save(view_source)
+
+
+class ScratchModules:
+    """Copies of module sources that persists of a replayed session are applied to
+
+    A module file is read the first time the module is changed, and is never written.
+    Views, module browsers and the persist journal are not touched either, so replaying
+    a recording leaves the project as it was.
+    """
+
+    def __init__(self):
+        self.buffers = {}  # {filepath: StringBuffer}
+        self.unknown_project_ids = set()
+
+    def __call__(self, descs):
+        """Persist handler (see ws_handler.persist_handler)"""
+        first = descs[0]
+        project = project_by_id(first['projectId'])
+        if project is None:
+            if first['projectId'] not in self.unknown_project_ids:
+                self.unknown_project_ids.add(first['projectId'])
+                print("LiveJS: replayed persists of unknown project {} are skipped"
+                      .format(first['projectId']))
+            return
+
+        descs = coalesce(descs)
+        if not descs:
+            return
+
+        filepath = project.module_filepath(first['moduleName'])
+        buf = self.buffers.get(filepath)
+        if buf is None:
+            buf = self.buffers[filepath] = StringBuffer(file_contents(filepath))
+
+        edit_for[buf] = None
+        try:
+            for desc in descs:
+                apply_descriptor(desc, buf)
+        finally:
+            del edit_for[buf]
+
+
+def recover_module_files(project):
+    """Replay the persist journal of project left after a crash, if any"""
+    n = module_files.recover(project, apply_descriptor)
+    if n > 0:
+        print("LiveJS: replayed {} persist journal records into the modules of {}"
+              .format(n, project.name))
 
 
 @persist_handler
-def replace(desc, mbrowser, view_source):
-    mbrowser.replace_value_node(desc['path'], desc['newValue'])
+def replace(desc, view_source):
     persist.replace_value(
         view_source,
         path=desc['path'], new_value=desc['newValue']
@@ -51,9 +136,7 @@ def replace(desc, mbrowser, view_source):
 
 
 @persist_handler
-def rename_key(desc, mbrowser, view_source):
-    mbrowser.replace_key_node(desc['path'], desc['newName'])
-
+def rename_key(desc, view_source):
     persist.rename_key(
         view_source,
         path=desc['path'], new_name=desc['newName']
@@ -61,17 +144,18 @@ def rename_key(desc, mbrowser, view_source):
 
 
 @persist_handler
-def delete(desc, mbrowser, view_source):
-    mbrowser.delete_node(desc['path'])
-
+def delete(desc, view_source):
     persist.delete(view_source, path=desc['path'])
 
 
 @persist_handler
-def insert(desc, mbrowser, view_source):
-    mbrowser.insert_node(desc['path'], desc['key'], desc['value'])
-
+def insert(desc, view_source):
     persist.insert(
         view_source,
         path=desc['path'], key=desc['key'], value=desc['value']
     )
+
+
+@persist_handler
+def move(desc, view_source):
+    persist.move(view_source, path=desc['path'], new_path=desc['newPath'])
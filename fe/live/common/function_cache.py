@@ -0,0 +1,92 @@
+"""Cache of JS function sources, content-addressed by the hashes the BE computes
+
+The BE sends a function's source only the first time over a connection, later on it's
+referred to by hash only: {"type": "function", "hash": "..."} or ["f", "<hash>"] in the
+compact encoding.
+"""
+
+import collections
+
+
+# Used in place of a source that the BE could not provide
+FUNCTION_SOURCE_UNAVAILABLE = \
+    'function () { throw new Error("LiveJS: function source got lost"); }'
+
+
+class FunctionSourceCache:
+    """Bounded LRU mapping of hash -> function source"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.sources = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, hash):
+        return hash in self.sources
+
+    def get(self, hash):
+        source = self.sources.get(hash)
+        if source is not None:
+            self.sources.move_to_end(hash)
+        return source
+
+    def put(self, hash, source):
+        self.sources[hash] = source
+        self.sources.move_to_end(hash)
+        while len(self.sources) > self.capacity:
+            self.sources.popitem(last=False)
+
+
+def resolve_function_sources(message, cache, missing_source=None):
+    """Fill in sources of functions referred to by hash in message, in place
+
+    Function sources that are present in message are put into the cache.
+
+    :param missing_source: if given, put in place of sources not found in the cache
+    :return: set of hashes not found in the cache (message is partially resolved then,
+             unless missing_source is given)
+    """
+    refs = []
+    stack = [message]
+
+    while stack:
+        x = stack.pop()
+        if isinstance(x, list):
+            if x and x[0] == 'f':
+                # Compact encoding: ['f', hash] or ['f', hash, source]
+                if len(x) > 2:
+                    cache.put(x[1], x[2])
+                else:
+                    refs.append(x)
+                continue
+            stack.extend(x)
+            continue
+        if not isinstance(x, dict):
+            continue
+
+        if x.get('type') == 'function' and 'hash' in x:
+            if 'value' in x:
+                cache.put(x['hash'], x['value'])
+            else:
+                refs.append(x)
+
+        stack.extend(x.values())
+
+    # Resolve after the walk: the source may be given later in the message than a reference
+    missing = set()
+    for ref in refs:
+        hash = ref[1] if isinstance(ref, list) else ref['hash']
+        source = cache.get(hash)
+        if source is None:
+            missing.add(hash)
+            source = missing_source
+            if source is None:
+                continue
+        if isinstance(ref, list):
+            ref.append(source)
+        else:
+            ref['value'] = source
+
+    return missing
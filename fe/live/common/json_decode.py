@@ -0,0 +1,240 @@
+"""Decoding of JSON messages coming from the BE, off the eventloop thread
+
+Decoding in another thread only helps if that thread lets the others run.  json.loads()
+is a single C call that holds the GIL until the whole text is decoded, so big messages
+are decoded by ChunkedDecoder instead, which never gives the C code more than a window of
+the text at a time.
+"""
+
+import codecs
+import collections
+import json
+import json.decoder
+import json.scanner
+import queue
+import re
+import sys
+import threading
+import traceback
+
+
+# Plain dicts preserve insertion order since Python 3.7, and they're much cheaper to build
+if sys.version_info >= (3, 7):
+    object_pairs_hook = None
+else:
+    object_pairs_hook = collections.OrderedDict
+
+
+# Messages at least that big are decoded by ChunkedDecoder
+CHUNKED_THRESHOLD = 1 << 18
+# That much text is handed to C code at once.  Decoding it takes well under a millisecond.
+WINDOW_SIZE = 1 << 16
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_TAIL = re.compile(r'[-+.0-9eE]*\Z')
+
+
+def decode_json(data):
+    """Decode a JSON message from UTF-8 encoded bytes (or bytearray)"""
+    if len(data) >= CHUNKED_THRESHOLD:
+        return ChunkedDecoder(decode_utf8(data)).decode()
+
+    if sys.version_info < (3, 6):
+        # json.loads() accepts bytes only since Python 3.6
+        data = data.decode('utf-8')
+
+    return json.loads(data, object_pairs_hook=object_pairs_hook)
+
+
+def decode_utf8(data, piece_size=WINDOW_SIZE * 16):
+    """Decode data piece by piece, for the same reason ChunkedDecoder exists"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    view = memoryview(data)
+    pieces = [decoder.decode(view[i:i + piece_size])
+              for i in range(0, len(data), piece_size)]
+    pieces.append(decoder.decode(b'', True))
+    return ''.join(pieces)
+
+
+def skip_ws(text, pos):
+    return WHITESPACE.match(text, pos).end()
+
+
+class ChunkedDecoder:
+    """JSON decoder that holds the GIL for short periods only
+
+    The C scanner of the json module is given a window of WINDOW_SIZE characters.  Values
+    that fit in it are decoded by the scanner, objects and arrays that don't are walked
+    here entry by entry.  Between the calls, other threads get to run.
+    """
+
+    def __init__(self, text, window_size=WINDOW_SIZE):
+        self.text = text
+        self.window_size = window_size
+        self.scan_once = json.scanner.make_scanner(
+            json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+        )
+        self.window = ''
+        self.window_pos = 0
+
+    def decode(self):
+        value, end = self.value_at(skip_ws(self.text, 0))
+
+        end = skip_ws(self.text, end)
+        if end != len(self.text):
+            raise ValueError("Extra data at {}".format(end))
+        return value
+
+    def value_at(self, pos):
+        """:return: (value, end)"""
+        res = self._scan_in_window(pos)
+        if res is None and self.window_pos != pos:
+            # The value may fit in a window that starts right at it
+            self._move_window(pos)
+            res = self._scan_in_window(pos)
+        if res is not None:
+            return res
+
+        char = self.text[pos:pos + 1]
+        if char == '{':
+            return self.object_at(pos)
+        if char == '[':
+            return self.array_at(pos)
+
+        # Other values can't be decoded piecewise, and the scanner stops right after them
+        try:
+            return self.scan_once(self.text, pos)
+        except StopIteration:
+            raise ValueError("Expecting value at {}".format(pos))
+
+    def object_at(self, pos):
+        text = self.text
+        pairs = []
+        pos = skip_ws(text, pos + 1)
+        if text[pos:pos + 1] == '}':
+            return self._make_object(pairs), pos + 1
+
+        while True:
+            if text[pos:pos + 1] != '"':
+                raise ValueError("Expecting property name at {}".format(pos))
+            key, pos = json.decoder.scanstring(text, pos + 1, True)
+            pos = skip_ws(text, pos)
+            if text[pos:pos + 1] != ':':
+                raise ValueError("Expecting ':' delimiter at {}".format(pos))
+            value, pos = self.value_at(skip_ws(text, pos + 1))
+            pairs.append((key, value))
+
+            pos = skip_ws(text, pos)
+            char = text[pos:pos + 1]
+            if char == '}':
+                return self._make_object(pairs), pos + 1
+            if char != ',':
+                raise ValueError("Expecting ',' delimiter at {}".format(pos))
+            pos = skip_ws(text, pos + 1)
+
+    def array_at(self, pos):
+        text = self.text
+        values = []
+        pos = skip_ws(text, pos + 1)
+        if text[pos:pos + 1] == ']':
+            return values, pos + 1
+
+        while True:
+            value, pos = self.value_at(pos)
+            values.append(value)
+
+            pos = skip_ws(text, pos)
+            char = text[pos:pos + 1]
+            if char == ']':
+                return values, pos + 1
+            if char != ',':
+                raise ValueError("Expecting ',' delimiter at {}".format(pos))
+            pos = skip_ws(text, pos + 1)
+
+    def _make_object(self, pairs):
+        return dict(pairs) if object_pairs_hook is None else object_pairs_hook(pairs)
+
+    def _move_window(self, pos):
+        self.window = self.text[pos:pos + self.window_size]
+        self.window_pos = pos
+
+    def _scan_in_window(self, pos):
+        """Decode the value at pos with the C scanner if it fits in the window
+
+        :return: (value, end) or None
+        """
+        if not self.window_pos <= pos < self.window_pos + len(self.window):
+            self._move_window(pos)
+
+        try:
+            value, end = self.scan_once(self.window, pos - self.window_pos)
+        except (ValueError, StopIteration):
+            return None
+
+        # A number may have been cut short by the end of the window ("1.5e3" as "1.5e")
+        if self.window_pos + len(self.window) < len(self.text) and \
+                NUMBER_TAIL.match(self.window, end):
+            return None
+
+        return value, self.window_pos + end
+
+
+class DecodeWorker:
+    """Thread that decodes JSON messages and hands them to a consumer in arrival order
+
+    Producers call decode(key, data) and return immediately.  The worker calls
+    consumer(key, message) for each successfully decoded message.  There is a single
+    worker thread, so messages are delivered in the order they were submitted.
+    """
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.queue = queue.Queue()
+        self.thread = None
+
+    @property
+    def is_running(self):
+        return self.thread is not None
+
+    def start(self):
+        assert not self.is_running
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the worker after it has processed what's already been submitted"""
+        assert self.is_running
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def decode(self, key, data):
+        self.queue.put((key, data))
+
+    def barrier(self):
+        """:return: threading.Event set once everything submitted so far is consumed"""
+        event = threading.Event()
+        self.queue.put(event)
+        return event
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            key, data = item
+            try:
+                message = decode_json(data)
+            except Exception:
+                # RecursionError, MemoryError etc. must not kill the worker either
+                traceback.print_exc()
+                continue
+
+            try:
+                self.consumer(key, message)
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,301 @@
+"""Protocol metrics: per-operation request counts, traffic and latencies
+
+Each request to the BE goes through these stages, and a latency histogram is kept for
+every one of them:
+
+  queued:  enqueued for sending -> fully sent by the eventloop thread
+  be:      sent -> result received (BE execution, network and JSON decoding)
+  apply:   result received -> applied (coroutine resumed, or run_sync_op() returns)
+  total:   enqueued -> applied
+
+The stage timestamps are recorded by different threads, hence the lock.
+
+Saves of module sources are accounted too: how many bytes were written, and the lag from
+the first request to save a change to the moment it's written.
+"""
+
+import bisect
+import threading
+import time
+
+
+# Upper bounds of histogram buckets, in milliseconds.  The last bucket is unbounded.
+bucket_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+stages = ('queued', 'be', 'apply', 'total')
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(bucket_bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(bucket_bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    @property
+    def avg(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Upper bound of the bucket where the p-th percentile falls (ms)
+
+        For the last (unbounded) bucket, the maximum is returned.
+        """
+        if not self.count:
+            return 0.0
+
+        threshold = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= threshold and n > 0:
+                return bucket_bounds[i] if i < len(bucket_bounds) else self.max
+
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avgMs': round(self.avg, 3),
+            'maxMs': round(self.max, 3),
+            'p50Ms': self.percentile(50),
+            'p95Ms': self.percentile(95),
+            'buckets': {
+                ('le{}'.format(bound) if i < len(bucket_bounds) else 'inf'): n
+                for i, (bound, n) in enumerate(zip(bucket_bounds + (None, ), self.counts))
+                if n > 0
+            }
+        }
+
+
+class OperationMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = {stage: LatencyHistogram() for stage in stages}
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytesOut': self.bytes_out,
+            'bytesIn': self.bytes_in,
+            'latency': {
+                stage: hist.as_dict()
+                for stage, hist in self.latency.items()
+                if hist.count > 0
+            }
+        }
+
+
+class SaveMetrics:
+    def __init__(self):
+        self.saves = 0
+        self.bytes_written = 0
+        self.lag = LatencyHistogram()
+
+    def as_dict(self):
+        return {
+            'saves': self.saves,
+            'bytesWritten': self.bytes_written,
+            'lag': self.lag.as_dict()
+        }
+
+
+class Request:
+    __slots__ = ('operation', 'enqueued_at', 'sent_at', 'result_at')
+
+    def __init__(self, operation, enqueued_at):
+        self.operation = operation
+        self.enqueued_at = enqueued_at
+        self.sent_at = None
+        self.result_at = None
+
+
+class ProtocolMetrics:
+    """Metrics of communication with the BEs, accumulated since start (or last reset)
+
+    All the methods are thread-safe.  Requests are identified by request IDs.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.by_operation = {}
+            # {request_id: Request} for requests not yet applied
+            self.requests = {}
+            # {module id: (module name, number of persist descriptors applied)}.  Names
+            # are not unique across projects.
+            self.persists_by_module = {}
+            self.persist_messages = 0
+            self.persist_bytes_in = 0
+            # Time the GUI thread was blocked by run_sync_op(), by operation
+            self.blocked = {}
+            # {'view' or 'file': SaveMetrics}, by how modules were saved
+            self.saves = {}
+
+    def _op_metrics(self, operation):
+        metrics = self.by_operation.get(operation)
+        if metrics is None:
+            metrics = self.by_operation[operation] = OperationMetrics()
+        return metrics
+
+    def request_enqueued(self, request_id, operation):
+        with self.lock:
+            self._op_metrics(operation).requests += 1
+            self.requests[request_id] = Request(operation, self.clock())
+
+    def request_sent(self, request_id, nbytes):
+        with self.lock:
+            req = self.requests.get(request_id)
+            if req is None:
+                return
+            req.sent_at = self.clock()
+            metrics = self._op_metrics(req.operation)
+            metrics.bytes_out += nbytes
+            metrics.latency['queued'].record(req.sent_at - req.enqueued_at)
+
+    def result_received(self, request_id, nbytes, success):
+        with self.lock:
+            req = self.requests.get(request_id)
+            if req is None:
+                return
+            req.result_at = self.clock()
+            metrics = self._op_metrics(req.operation)
+            metrics.bytes_in += nbytes
+            if not success:
+                metrics.errors += 1
+            if req.sent_at is not None:
+                metrics.latency['be'].record(req.result_at - req.sent_at)
+
+    def result_applied(self, request_id):
+        with self.lock:
+            req = self.requests.pop(request_id, None)
+            if req is None or req.result_at is None:
+                return
+            now = self.clock()
+            latency = self._op_metrics(req.operation).latency
+            latency['apply'].record(now - req.result_at)
+            latency['total'].record(now - req.enqueued_at)
+
+    def request_abandoned(self, request_id):
+        """The result of request_id is never going to be applied"""
+        with self.lock:
+            self.requests.pop(request_id, None)
+
+    def persist_received(self, nbytes):
+        with self.lock:
+            self.persist_messages += 1
+            self.persist_bytes_in += nbytes
+
+    def persist_applied(self, module_id, module_name):
+        with self.lock:
+            name, n = self.persists_by_module.get(module_id, (module_name, 0))
+            self.persists_by_module[module_id] = (name, n + 1)
+
+    def gui_blocked(self, operation, seconds):
+        with self.lock:
+            hist = self.blocked.get(operation)
+            if hist is None:
+                hist = self.blocked[operation] = LatencyHistogram()
+            hist.record(seconds)
+
+    def module_saved(self, how, lag, nbytes):
+        """Module source saved, either a view or a file written directly"""
+        with self.lock:
+            metrics = self.saves.get(how)
+            if metrics is None:
+                metrics = self.saves[how] = SaveMetrics()
+            metrics.saves += 1
+            metrics.bytes_written += nbytes
+            metrics.lag.record(lag)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'since': self.started_at,
+                'operations': {
+                    op: metrics.as_dict() for op, metrics in self.by_operation.items()
+                },
+                'inFlight': len(self.requests),
+                'persist': {
+                    'messages': self.persist_messages,
+                    'bytesIn': self.persist_bytes_in,
+                    'descriptorsByModule': {
+                        module_id: {'name': name, 'count': n}
+                        for module_id, (name, n) in self.persists_by_module.items()
+                    },
+                },
+                'guiBlocked': {op: hist.as_dict() for op, hist in self.blocked.items()},
+                'saves': {how: metrics.as_dict() for how, metrics in self.saves.items()}
+            }
+
+    def report(self):
+        """:return: human-readable multiline str, slowest operations first"""
+        with self.lock:
+            lines = []
+            by_total = sorted(
+                self.by_operation.items(),
+                key=lambda item: item[1].latency['total'].total,
+                reverse=True
+            )
+            for op, metrics in by_total:
+                lines.append(
+                    '{}: {} requests, {} errors, {} bytes out, {} bytes in'.format(
+                        op, metrics.requests, metrics.errors, metrics.bytes_out,
+                        metrics.bytes_in
+                    )
+                )
+                for stage in stages:
+                    hist = metrics.latency[stage]
+                    if hist.count > 0:
+                        lines.append('  ' + format_histogram(stage, hist))
+
+            if self.blocked:
+                lines.append('')
+                lines.append('GUI thread blocked by synchronous operations:')
+                for op, hist in sorted(self.blocked.items()):
+                    lines.append('  ' + format_histogram(op, hist))
+
+            if self.persists_by_module:
+                lines.append('')
+                lines.append(
+                    'Persist descriptors applied ({} messages, {} bytes):'.format(
+                        self.persist_messages, self.persist_bytes_in
+                    )
+                )
+                for module_id, (name, n) in sorted(self.persists_by_module.items(),
+                                                   key=lambda item: item[1][1],
+                                                   reverse=True):
+                    lines.append('  {} ({}): {}'.format(name, module_id, n))
+
+            if self.saves:
+                lines.append('')
+                lines.append('Module saves (lag is from the first save request):')
+                for how, metrics in sorted(self.saves.items()):
+                    lines.append('  {}: {} saves, {} bytes written'.format(
+                        how, metrics.saves, metrics.bytes_written
+                    ))
+                    lines.append('    ' + format_histogram('lag', metrics.lag))
+
+            return '\n'.join(lines)
+
+
+def format_histogram(name, hist):
+    return '{}: n={} avg={:.1f} p50<={} p95<={} max={:.1f} (ms)'.format(
+        name, hist.count, hist.avg, hist.percentile(50), hist.percentile(95), hist.max
+    )
@@ -1,13 +1,55 @@
 import contextlib
+import os
+import shutil
+import tempfile
 import time
 import uuid
 
 
 def file_contents(filepath):
-    with open(filepath, 'r') as fl:
+    with open(filepath, 'r', encoding='utf-8') as fl:
         return fl.read()
 
 
+def write_file_atomically(filepath, contents):
+    """Write contents to filepath so that it's never seen half-written
+
+    The contents go to a temporary file in the same directory which then replaces
+    filepath.  The permissions of the existing file are retained.  Both the file and the
+    directory entry are durable by the time this returns.
+    """
+    dirpath = os.path.dirname(filepath) or '.'
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirpath,
+        prefix='.' + os.path.basename(filepath) + '.',
+        suffix='.tmp'
+    )
+    try:
+        with open(fd, 'w', encoding='utf-8') as fl:
+            fl.write(contents)
+            fl.flush()
+            os.fsync(fl.fileno())
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    fsync_dir(dirpath)
+
+
+def fsync_dir(dirpath):
+    """Make renames within dirpath durable (no-op where directories can't be opened)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(dirpath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def gen_uid():
     return uuid.uuid4().hex
 
@@ -25,14 +67,17 @@ def first_or_none(gen):
 
 def tracking_last(iterable):
     i = iter(iterable)
-    e0 = next(i)
+    try:
+        e0 = next(i)
+    except StopIteration:
+        return
 
     while True:
         try:
             e1 = next(i)
         except StopIteration:
             yield e0, True
-            raise
+            return
 
         yield e0, False
         e0 = e1
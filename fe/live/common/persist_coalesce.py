@@ -0,0 +1,133 @@
+"""Grouping of persist descriptors by module, and dropping of the redundant ones
+
+Within a run of descriptors of the same module, a descriptor is redundant if a later one
+makes its effect unobservable:
+
+  * a replace or a delete at a path discards earlier changes made inside the value at
+    that path, and earlier replaces at that very path;
+  * a delete also discards earlier renames of the deleted key;
+  * a rename of a key discards an earlier rename of the same key;
+  * a replace or a rename of an entry just inserted is folded into the insert;
+  * a delete of an entry just inserted cancels the insert (and the delete itself).
+
+An earlier descriptor is looked for only as long as nothing in between could have moved
+the entry at the path (an insert, a delete or a move in a container up the path), or
+replaced a container up the path.  Moves themselves are never folded, but get dropped
+along with other changes inside a replaced or deleted value.
+
+Module versions are preserved so that consumers that track them (the module browser) keep
+working: each remaining descriptor gets 'firstVersion', which is 1 + the version of the
+descriptor it now follows, and the last one gets the version of the last original
+descriptor.  Applying a descriptor thus takes the module from firstVersion - 1 to version.
+"""
+
+
+def group_by_module(descriptors):
+    """:return: [[desc, ...], ...] for each module, in order of first appearance"""
+    groups = {}
+    for desc in descriptors:
+        groups.setdefault(desc['moduleId'], []).append(desc)
+    return list(groups.values())
+
+
+def is_prefix(prefix, path):
+    return len(prefix) <= len(path) and path[:len(prefix)] == prefix
+
+
+def is_shifted_by(op_path, path):
+    """Whether path is shifted by an insert or a delete at op_path"""
+    return len(op_path) <= len(path) and is_prefix(op_path[:-1], path) and \
+        path[len(op_path) - 1] >= op_path[-1]
+
+
+def may_move(desc, path):
+    """Whether desc may have moved or re-created the entry at path (or one up the path)"""
+    if desc['operation'] in ('insert', 'delete'):
+        return is_shifted_by(desc['path'], path)
+    if desc['operation'] == 'move':
+        return is_shifted_by(desc['path'], path) or is_shifted_by(desc['newPath'], path)
+    if desc['operation'] == 'replace':
+        return is_prefix(desc['path'], path[:-1])
+    return False
+
+
+def coalesce(descriptors):
+    """Drop redundant descriptors of a single module, see the module docstring
+
+    Descriptors are not modified, new ones are made where needed.
+    """
+    res = []
+    for desc in descriptors:
+        desc = dict(desc)
+        if desc['operation'] not in ('insert', 'move'):
+            desc = fold_into_preceding(res, desc)
+        if desc is not None:
+            res.append(desc)
+
+    res = [desc for desc in res if desc is not None]
+    if not res:
+        return res
+
+    first_version = descriptors[0]['version']
+    for desc in res:
+        desc['firstVersion'] = first_version
+        first_version = desc['version'] + 1
+    res[-1]['version'] = descriptors[-1]['version']
+
+    return res
+
+
+def fold_into_preceding(res, desc):
+    """Drop what desc makes redundant in res (replace with None), fold desc if possible
+
+    :return: desc, or None if it got folded
+    """
+    operation, path = desc['operation'], desc['path']
+    # Whether there's something in between whose path would change if the insert of the
+    # entry at path were dropped
+    is_insert_pinned = False
+
+    for i in range(len(res) - 1, -1, -1):
+        prev = res[i]
+        if prev is None:
+            continue
+
+        prev_op, prev_path = prev['operation'], prev['path']
+        if prev_path == path:
+            if prev_op == 'move':
+                # The entry at path is now a different one
+                break
+
+            if prev_op == 'insert':
+                if operation == 'replace':
+                    res[i] = dict(prev, value=desc['newValue'])
+                elif operation == 'rename_key':
+                    res[i] = dict(prev, key=desc['newName'])
+                elif is_insert_pinned:
+                    break
+                else:
+                    res[i] = None
+                return None
+
+            if prev_op == operation != 'delete' or \
+                    operation == 'delete' and prev_op in ('replace', 'rename_key'):
+                res[i] = None
+                continue
+
+            if prev_op == 'delete':
+                # The entry at path is now a different one
+                break
+        elif is_prefix(path, prev_path):
+            if operation != 'rename_key':
+                # A change inside the value at path
+                res[i] = None
+                continue
+        elif may_move(prev, path):
+            break
+
+        if res[i] is not None and (
+                is_shifted_by(path, prev_path) or
+                prev_op == 'move' and is_shifted_by(path, prev['newPath'])):
+            is_insert_pinned = True
+
+    return desc
@@ -0,0 +1,187 @@
+"""Append-only journal of persist descriptors, one per project
+
+Descriptors applied to module files (see code/persist/module_files.py) are first appended to the
+journal of their project; the module files themselves are rewritten only now and then by
+the compactor.  Each record is a line of JSON:
+
+    {"stamp": <ns>, "module": <module name>, "desc": <persist descriptor>}
+
+Stamps are nanoseconds since the epoch, strictly increasing.  Before the compactor writes
+a module file, it appends (and syncs) a compaction record:
+
+    {"stamp": <ns>, "module": <module name>, "compactedUpto": <stamp>, "textHash": <hash>}
+
+meaning that the file with text of that hash reflects all the records of the module with
+stamps up to compactedUpto.  If the write doesn't happen, the hash doesn't match what's in
+the file, and the compaction record is disregarded.  That's how recovery after a crash
+knows which records to replay.  File timestamps are not relied upon, as their precision
+varies between file systems.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from live.common.misc import file_contents
+from live.common.misc import write_file_atomically
+from live.shared.string_buffer import StringBuffer
+
+
+JOURNAL_FILE_NAME = '.live-journal'
+
+stamp_lock = threading.Lock()
+last_stamp = 0
+
+
+def take_stamp():
+    global last_stamp
+
+    with stamp_lock:
+        last_stamp = max(int(time.time() * 1e9), last_stamp + 1)
+        return last_stamp
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def journal_path(project_path):
+    return os.path.join(project_path, JOURNAL_FILE_NAME)
+
+
+class Journal:
+    """Journal file of a project, opened for appending
+
+    Appends are buffered; sync() makes them durable.  Appending is thread-safe.
+    """
+
+    def __init__(self, project_path):
+        self.path = journal_path(project_path)
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'a', encoding='utf8')
+        self.is_synced = True
+
+    def append(self, module_name, desc):
+        """:return: stamp of the record"""
+        return self._append({'module': module_name, 'desc': desc})
+
+    def append_compaction(self, module_name, upto, text):
+        """Record that the module file is about to get text, reflecting records upto"""
+        return self._append({
+            'module': module_name, 'compactedUpto': upto, 'textHash': text_hash(text)
+        })
+
+    def _append(self, record):
+        with self.lock:
+            stamp = record['stamp'] = take_stamp()
+            self.file.write(json.dumps(record))
+            self.file.write('\n')
+            self.is_synced = False
+            return stamp
+
+    def sync(self):
+        """Make appended records durable
+
+        Not to be called concurrently with truncate_upto() or close().  Appends are not
+        blocked for the duration of fsync.
+        """
+        with self.lock:
+            if self.is_synced:
+                return
+            self.file.flush()
+            self.is_synced = True
+            fd = self.file.fileno()
+
+        os.fsync(fd)
+
+    def size(self):
+        with self.lock:
+            return self.file.tell()
+
+    def truncate_upto(self, offset):
+        """Drop the records that precede offset (as previously returned by size())"""
+        with self.lock:
+            self.file.flush()
+            with open(self.path, 'r', encoding='utf8') as fl:
+                fl.seek(offset)
+                tail = fl.read()
+
+            self.file.close()
+            write_file_atomically(self.path, tail)
+            self.file = open(self.path, 'a', encoding='utf8')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_journal(project_path):
+    """:return: list of records, [] if there's no journal
+
+    A trailing incomplete line (left by a crash in the middle of an append) is ignored.
+    """
+    try:
+        with open(journal_path(project_path), 'r', encoding='utf8') as fl:
+            lines = fl.read().split('\n')
+    except FileNotFoundError:
+        return []
+
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+
+    return records
+
+
+def recover(project_path, module_filepath, apply_desc):
+    """Replay the journal records that didn't make it into the module files
+
+    :param module_filepath: function (module name) -> path of the module file
+    :param apply_desc: function (desc, StringBuffer) that applies a descriptor
+    :return: number of records replayed
+    """
+    records = read_journal(project_path)
+    texts = {}  # {module name: file text or None if there's no file}
+    hashes = {}
+    compacted_upto = {}  # {module name: stamp}
+
+    for record in records:
+        name = record['module']
+        if name not in texts:
+            try:
+                texts[name] = file_contents(module_filepath(name))
+            except FileNotFoundError:
+                texts[name] = None
+            else:
+                hashes[name] = text_hash(texts[name])
+
+        if 'compactedUpto' in record and record['textHash'] == hashes.get(name):
+            compacted_upto[name] = record['compactedUpto']
+
+    buffers = {}  # {module name: StringBuffer}
+    n_replayed = 0
+
+    for record in records:
+        name = record['module']
+        if 'desc' not in record or texts[name] is None or \
+                record['stamp'] <= compacted_upto.get(name, 0):
+            continue
+
+        if name not in buffers:
+            buffers[name] = StringBuffer(texts[name], file_name=module_filepath(name))
+
+        apply_desc(record['desc'], buffers[name])
+        n_replayed += 1
+
+    for name, buf in buffers.items():
+        write_file_atomically(module_filepath(name), buf.text)
+
+    if os.path.exists(journal_path(project_path)):
+        os.unlink(journal_path(project_path))
+
+    return n_replayed
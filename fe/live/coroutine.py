@@ -19,6 +19,9 @@ class CoDriver:
     def is_occupied(self, name):
         return name in self.name_to_co
 
+    def is_live(self, co):
+        return co in self.coroutines
+
     def forget_all(self):
         assert self.co_running is None
         self.coroutines.clear()
@@ -3,6 +3,33 @@ class Config:
     indent = 3
     s_indent = ' ' * indent
     max_gui_freeze = 50e-3
+    # Outgoing websocket messages are split into frames of at most this many bytes
+    ws_fragment_size = 64 * 1024
+    # Heartbeat: PING the BE every that many seconds, and drop the connection when that
+    # many PINGs in a row were not answered.
+    ws_ping_interval = 5.0
+    ws_max_missed_pongs = 3
+    # Incoming websocket messages bigger than this (in bytes) make us drop the connection
+    ws_max_message_size = 128 * 1024 * 1024
+    # If set, all websocket sessions are recorded into this directory (see session_log.py)
+    ws_record_dir = None
+    # Encoding of JS values the BE is asked to use: 'compact' or 'dicts'
+    # (see jsvalue-protocol.txt)
+    be_value_encoding = 'compact'
+    # How many JS function sources to remember by their hashes
+    function_cache_size = 5000
+    # If set, protocol metrics are dumped as JSON to this file every that many seconds
+    metrics_dump_path = None
+    metrics_dump_interval = 60.0
+    # Module source views changed by persist operations are saved once not changed for
+    # save_delay seconds, but not later than save_max_delay seconds after the first change
+    save_delay = 3.0
+    save_max_delay = 15.0
+    # Persist journals of module files not open in views are fsynced that often (seconds),
+    # and folded into the module files every that many seconds or once they grow that big
+    persist_journal_sync_interval = 0.2
+    persist_compact_interval = 10.0
+    persist_compact_size = 4 * 1024 * 1024
 
     livejs_project_id = 'a559f0f3ff8744bb944f1dda48650b4f'
     project_file_name = 'project.live.json'
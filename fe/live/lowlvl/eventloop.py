@@ -1,6 +1,7 @@
 """Home-made eventloop (Python 3.3 does not yet have asyncio)"""
 import select
 import threading
+import time
 import weakref
 
 from live.lowlvl.eventfd import EventFd
@@ -30,6 +31,18 @@ class Fd:
         return cls(fd, True)
 
 
+class Timeout:
+    """Yield this (alone or along with Fd's) to be resumed after a number of seconds.
+
+    If any of the Fd's becomes ready earlier, the coroutine is resumed with that Fd as
+    usual.  Otherwise it's resumed with the Timeout object itself.
+    """
+    __slots__ = ('seconds', )
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
 class ThreadLocal(threading.local):
     def __getattr__(self, name):
         setattr(self, name, None)
@@ -54,19 +67,21 @@ def check_not_running_event_loop():
 
 
 class Coroutine:
-    __slots__ = ('__weakref__', 'itr', 'result', 'r_fds', 'w_fds', 'send_fd')
+    __slots__ = ('__weakref__', 'itr', 'result', 'r_fds', 'w_fds', 'timeout', 'send_fd')
 
     def __init__(self, itr):
         self.itr = itr
         self.result = None
         self.r_fds = []
         self.w_fds = []
+        self.timeout = None
         self.send_fd = None
 
     def finished(self, value_or_exc):
         self.itr = None
         self.result = value_or_exc
         self.send_fd = None
+        self.timeout = None
         del self.r_fds[:]
         del self.w_fds[:]
 
@@ -80,7 +95,7 @@ class Coroutine:
     
     @property
     def is_ready(self):
-        return not self.r_fds and not self.w_fds
+        return not self.r_fds and not self.w_fds and self.timeout is None
 
     @property
     def is_running(self):
@@ -105,6 +120,7 @@ class EventLoop:
         self.ready = set()  # {co}
         self.r_fds = {}  # {fd: co}
         self.w_fds = {}  # {fd: co}
+        self.deadlines = {}  # {co: moment}, for coroutines that yielded a Timeout
         self.to_quit = []  # [co] to force quit
         self.run_by_thread = None
         # {name: co}, for human convenience, to hold onto coroutine by names.
@@ -173,10 +189,18 @@ class EventLoop:
                 self.stop_cmd = 'stop-coroutines-&-quit'
                 break
 
+            if self.deadlines:
+                select_timeout = max(
+                    0, min(self.deadlines.values()) - time.perf_counter()
+                )
+            else:
+                select_timeout = None
+
             ready_read, ready_write, ready_exc = select.select(
                 list(self.r_fds) + [self.evt_interrupt],
                 list(self.w_fds),
-                list(self.r_fds) + list(self.w_fds)
+                list(self.r_fds) + list(self.w_fds),
+                select_timeout
             )
 
             if ready_exc != []:
@@ -198,6 +222,12 @@ class EventLoop:
                         co.send_fd = fd
                         self.ready.add(co)
 
+            now = time.perf_counter()
+            for co, deadline in self.deadlines.items():
+                if deadline <= now and co not in self.ready:
+                    co.send_fd = co.timeout
+                    self.ready.add(co)
+
             for co in self.ready:
                 self._forget_selectables_of(co)
 
@@ -234,6 +264,14 @@ class EventLoop:
         if not isinstance(fds, tuple):
             fds = (fds, )
 
+        timeouts = [fd for fd in fds if isinstance(fd, Timeout)]
+        fds = [fd for fd in fds if not isinstance(fd, Timeout)]
+
+        if len(timeouts) > 1:
+            self._report_error("Coroutine {} yielded more than 1 Timeout".format(co.itr))
+            self._force_quit_coroutine(co)
+            return
+
         for fd in fds:
             if not isinstance(fd, Fd):
                 self._report_error(
@@ -241,11 +279,15 @@ class EventLoop:
                 )
                 self._force_quit_coroutine(co)
                 return
-            if fd.fd in self.r_fds if fd.is_read else self.w_fds:
+            if fd.fd in (self.r_fds if fd.is_read else self.w_fds):
                 self._report_error("Coroutine {} returned a duplicate fd object to "
                                    "select from: {}".format(co.itr, fd.fd))
                 self._force_quit_coroutine(co)
                 return
+
+        if timeouts:
+            [co.timeout] = timeouts
+            self.deadlines[co] = time.perf_counter() + co.timeout.seconds
         
         for fd in fds:
             if fd.is_read:
@@ -285,6 +327,10 @@ class EventLoop:
             del self.w_fds[fd]
         del co.w_fds[:]
 
+        if co.timeout is not None:
+            del self.deadlines[co]
+            co.timeout = None
+
     def _report_error(self, msg, exc=None):
         if self.error_handler is not None:
             self.error_handler(msg, exc)
@@ -0,0 +1,94 @@
+"""Recording of websocket sessions into compact binary logs, and their replay
+
+Log file format: the MAGIC header followed by records.  Each record is
+
+    direction (1 byte), timestamp (8-byte double), payload length (4 bytes), payload
+
+with integers little-endian.  The timestamp is in seconds since recording started, and
+payload is the UTF-8 encoded message.
+"""
+
+import struct
+import time
+
+
+MAGIC = b'LJSREC\x00\x01'
+
+INBOUND = 0
+OUTBOUND = 1
+
+record_header = struct.Struct('<BdI')
+
+
+class SessionRecorder:
+    """Writes websocket messages to a log file as they are sent and received
+
+    Used by the eventloop thread only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.started_at = time.perf_counter()
+
+    def record(self, direction, payload):
+        """:param payload: bytes, bytearray or str"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf8')
+
+        self.file.write(record_header.pack(
+            direction, time.perf_counter() - self.started_at, len(payload)
+        ))
+        self.file.write(payload)
+
+    def close(self):
+        self.file.close()
+
+
+def read_session_log(path):
+    """:return: generator of (direction, timestamp, payload bytes)"""
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a LiveJS session log: {}".format(path))
+
+        while True:
+            header = file.read(record_header.size)
+            if not header:
+                break
+            if len(header) < record_header.size:
+                raise ValueError("Truncated session log: {}".format(path))
+
+            direction, timestamp, length = record_header.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                raise ValueError("Truncated session log: {}".format(path))
+
+            yield direction, timestamp, payload
+
+
+def replay_session_log(path, deliver, speed=1.0, sleep=time.sleep):
+    """Call deliver(payload) for each inbound message in the log, in the recorded order
+
+    This blocks the calling thread until all the messages are delivered.
+
+    :param speed: how much faster than recorded to replay.  None means as fast as possible.
+    :return: (number of messages, total bytes, seconds elapsed)
+    """
+    count = nbytes = 0
+    started_at = time.perf_counter()
+
+    for direction, timestamp, payload in read_session_log(path):
+        if direction != INBOUND:
+            continue
+
+        if speed is not None:
+            delay = timestamp / speed - (time.perf_counter() - started_at)
+            if delay > 0:
+                sleep(delay)
+
+        deliver(payload)
+        count += 1
+        nbytes += len(payload)
+
+    return count, nbytes, time.perf_counter() - started_at
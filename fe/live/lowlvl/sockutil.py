@@ -1,4 +1,5 @@
 import re
+import select
 
 from .eventloop import Fd
 
@@ -23,6 +24,12 @@ def send_buffer(socket, buf):
         mv.release()
 
 
+def is_readable(sock):
+    """Whether there's data available for reading from sock right now (don't block)"""
+    ready_read, _, _ = select.select([sock], [], [], 0)
+    return bool(ready_read)
+
+
 def recv_up_to_delimiter(sock, buf, delimiter):
     """Precondition: buf must not already have a message
 
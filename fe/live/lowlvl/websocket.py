@@ -1,16 +1,21 @@
 """Websocket server/client implementation (not intended for reuse)"""
 
+import codecs
 import struct
 import http.client as httpcli
 import hashlib
 import base64
+import time
 import traceback
 
 from live.common.misc import take_over_list_items
-from .sockutil import recv_next, recv_next_as_buf, send_buffer
+from .sockutil import is_readable, recv_next, recv_next_as_buf, send_buffer
 from .http import Response
 from .eventloop import Fd
+from .eventloop import Timeout
 from .eventfd import EventFd
+from .session_log import INBOUND
+from .session_log import OUTBOUND
 
 
 class OpCode:
@@ -22,37 +27,199 @@ class OpCode:
     PONG = 0xA
 
 
+class CloseCode:
+    INVALID_PAYLOAD = 1007
+    MESSAGE_TOO_BIG = 1009
+
+
 MAGIC_STRING = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 
+DEFAULT_FRAGMENT_SIZE = 64 * 1024
+
+# Weight of a new sample in the smoothed round-trip time (same as TCP's SRTT)
+RTT_ALPHA = 1 / 8
+
+
+class MessageSink:
+    """Consumer of an incoming message, fed with frame payloads as they arrive
+
+    A sink is created when the first frame of a message arrives, and what finish()
+    returns is passed to ws_handler.  Custom sinks let the processing of a message start
+    before its final fragment has been received.
+    """
+
+    def feed(self, data):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+
+class BufferSink(MessageSink):
+    """Collect the message into a single growing buffer
+
+    TEXT messages are decoded once, when complete, so UTF-8 sequences split across
+    frames are not a problem.
+    """
+
+    def __init__(self, opcode):
+        self.opcode = opcode
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf.extend(data)
+
+    def finish(self):
+        if self.opcode == OpCode.TEXT:
+            return self.buf.decode('utf-8')
+        else:
+            return self.buf
+
+
+class RawBufferSink(BufferSink):
+    """Like BufferSink, but TEXT messages are not decoded either (the bytearray is returned)
+
+    Use this when the consumer can deal with UTF-8 directly, e.g. json.loads().
+    """
+
+    def finish(self):
+        return self.buf
+
+
+class TextStreamSink(MessageSink):
+    """Base for sinks that consume TEXT messages as a sequence of str chunks
+
+    Bytes are decoded incrementally: an UTF-8 sequence split across frames is held back
+    until its remainder arrives.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, data):
+        text = self.decoder.decode(data)
+        if text:
+            self.feed_text(text)
+
+    def finish(self):
+        text = self.decoder.decode(b'', final=True)
+        if text:
+            self.feed_text(text)
+        return self.finish_text()
+
+    def feed_text(self, text):
+        raise NotImplementedError
+
+    def finish_text(self):
+        raise NotImplementedError
+
 
 class WebSocket:
-    def __init__(self, req, ws_handler):
+    def __init__(self, req, ws_handler, fragment_size=DEFAULT_FRAGMENT_SIZE,
+                 ping_interval=None, max_missed_pongs=3, max_message_size=None,
+                 sink_factory=BufferSink, recorder=None):
         self.req = req
         self.sock = req.sock
         self.rbuf = bytearray()
         self.ws_handler = ws_handler
         self.message_queue = []
         self.evt_write_messages = EventFd()
+        # Outgoing messages longer than this (in bytes) are sent as several frames
+        self.fragment_size = fragment_size
+        # Incoming messages longer than this (in bytes) make us close the connection.
+        # None means no limit.
+        self.max_message_size = max_message_size
+        # sink_factory(opcode) -> MessageSink, called for each incoming message
+        self.sink_factory = sink_factory
+        # SessionRecorder to log all the messages to (or None)
+        self.recorder = recorder
+        # Incoming message being received: its sink and size so far
+        self.in_sink = None
+        self.in_size = 0
+        self.is_closed = False
+        # Heartbeat: PING every ping_interval seconds (None to disable), consider the peer
+        # dead when max_missed_pongs PINGs in a row have not been answered.
+        self.ping_interval = ping_interval
+        self.max_missed_pongs = max_missed_pongs
+        self.next_ping_at = None
+        self.ping_seq = 0
+        self.pings_unanswered = {}  # {payload: moment sent}
+        # Smoothed round-trip time in seconds, None until the first PONG arrives
+        self.rtt = None
 
     def __iter__(self):
         ok = yield from self.handshake()
         if not ok:
             return
 
-        should_continue = True
+        yield from self.communicate()
+
+    def communicate(self):
+        if self.ping_interval is not None:
+            self.next_ping_at = time.perf_counter() + self.ping_interval
+
+        while not self.is_closed:
+            if self.is_ping_due():
+                yield from self.ping()
+                continue
 
-        while should_continue:
             if self.rbuf:
-                should_continue = yield from self.process_message()
+                yield from self.process_frame()
+                continue
+
+            resumed_by = yield (Fd.read(self.sock), Fd.read(self.evt_write_messages)) + \
+                self.heartbeat_timeout()
+            if isinstance(resumed_by, Timeout):
                 continue
 
-            yield Fd.read(self.sock), Fd.read(self.evt_write_messages)
             if self.evt_write_messages.is_set():
                 self.evt_write_messages.clear()
-                for message in take_over_list_items(self.message_queue):
-                    yield from self.send_message(message)
+                for message, on_sent in take_over_list_items(self.message_queue):
+                    nbytes = yield from self.send_message(message)
+                    if self.is_closed:
+                        break
+                    if on_sent is not None:
+                        on_sent(nbytes)
             else:
-                should_continue = yield from self.process_message()
+                yield from self.process_frame()
+
+    def heartbeat_timeout(self):
+        if self.next_ping_at is None:
+            return ()
+
+        return (Timeout(max(0, self.next_ping_at - time.perf_counter())), )
+
+    def is_ping_due(self):
+        return self.next_ping_at is not None and self.next_ping_at <= time.perf_counter()
+
+    def ping(self):
+        if len(self.pings_unanswered) >= self.max_missed_pongs:
+            print("Websocket peer did not answer {} PINGs, dropping the connection"
+                  .format(len(self.pings_unanswered)))
+            self.is_closed = True
+            return
+
+        self.ping_seq += 1
+        payload = str(self.ping_seq).encode('ascii')
+        now = time.perf_counter()
+        self.pings_unanswered[payload] = now
+        self.next_ping_at = now + self.ping_interval
+        yield from self.send_frame(OpCode.PING, payload)
+
+    def pong_received(self, payload):
+        sent_at = self.pings_unanswered.get(bytes(payload))
+        if sent_at is None:
+            return  # unsolicited PONG, which is allowed
+
+        # Earlier PINGs are answered implicitly
+        self.pings_unanswered = {
+            p: moment for p, moment in self.pings_unanswered.items() if moment > sent_at
+        }
+        sample = time.perf_counter() - sent_at
+        if self.rtt is None:
+            self.rtt = sample
+        else:
+            self.rtt += RTT_ALPHA * (sample - self.rtt)
 
     def handshake(self):
         headers = self.req.headers
@@ -80,52 +247,76 @@ class WebSocket:
         yield from resp
         return True
 
-    def process_message(self):
-        message = yield from self.read_message()
-        if message is None:
-            return False
+    def process_frame(self):
+        """Read the next frame from socket and act on it
+
+        PING frames are answered right away, so the caller doesn't have to handle them.
+        Data frames are fed to the sink of the current message as they arrive; when the
+        message is complete, it is passed to ws_handler.  A CLOSE frame marks self as
+        closed.
+        """
+        fin, opcode, payload_len, mask_key = yield from self.read_frame_header()
+
+        if opcode == OpCode.PING:
+            payload = yield from self.read_payload(payload_len, mask_key)
+            yield from self.send_frame(OpCode.PONG, payload)
+        elif opcode == OpCode.PONG:
+            payload = yield from self.read_payload(payload_len, mask_key)
+            self.pong_received(payload)
+        elif opcode == OpCode.CLOSE:
+            yield from self.read_payload(payload_len, mask_key)
+            self.is_closed = True
+        else:
+            if opcode == OpCode.CONTINUATION:
+                if self.in_sink is None:
+                    raise RuntimeError("Client sent continuation frame out of the blue")
+            else:
+                if self.in_sink is not None:
+                    raise RuntimeError("Client started a new message before finishing "
+                                       "the previous one")
+                self.in_sink = self.sink_factory(opcode)
+                self.in_size = 0
+
+            self.in_size += payload_len
+            if self.max_message_size is not None and self.in_size > self.max_message_size:
+                # Don't even read the payload
+                print("Websocket peer sent a message exceeding {} bytes, closing"
+                      .format(self.max_message_size))
+                yield from self.close(CloseCode.MESSAGE_TOO_BIG)
+                return
+
+            payload = yield from self.read_payload(payload_len, mask_key)
+            if fin:
+                sink, self.in_sink = self.in_sink, None
+            else:
+                sink = self.in_sink
+
+            try:
+                sink.feed(payload)
+                if fin:
+                    message = sink.finish()
+            except UnicodeDecodeError:
+                print("Websocket peer sent invalid UTF-8, closing")
+                yield from self.close(CloseCode.INVALID_PAYLOAD)
+                return
+
+            if fin:
+                self.deliver_message(message)
+
+    def deliver_message(self, message):
+        if self.recorder is not None:
+            self.recorder.record(INBOUND, message)
 
         try:
             self.ws_handler(message)
         except Exception:
             traceback.print_exc()
 
-        return True
-
-    def read_message(self):
-        """Read the next message from socket
+    def read_frame_header(self):
+        """Read frame header
 
-        Process PING messages locally so the caller doesn't have to handle them.
-        :return: bytes, str or None (when CLOSE frame arrives)
+        :return: (fin, opcode, payload_len, mask_key)
         """
-        while True:
-            frame = yield from self.read_frame()
-
-            if frame.opcode == OpCode.PING:
-                yield from self.send_message(
-                    Frame(fin=True, opcode=OpCode.PONG, payload=frame.payload)
-                )
-            elif frame.opcode == OpCode.PONG:
-                pass
-            elif frame.opcode == OpCode.CLOSE:
-                return None
-            else:
-                if frame.fin:
-                    return maybe_str(frame.payload, frame.opcode)
-
-                opcode = frame.opcode
-                pieces = [frame.payload]
-
-                while not frame.fin:
-                    frame = yield from self.read_frame()
-                    pieces.append(maybe_str(frame.payload, opcode))
-
-                if opcode == OpCode.BINARY:
-                    return b''.join(pieces)
-                else:
-                    return ''.join(pieces)
-
-    def read_frame(self):
         b0, b1 = yield from self.recv_next(2)
         fin = bool(b0 & 0x80)
         opcode = b0 & 0x0F
@@ -141,12 +332,12 @@ class WebSocket:
             (payload_len,) = struct.unpack('>Q', (yield from self.recv_next(8)))
 
         mask_key = yield from self.recv_next(4)
-        payload = yield from self.recv_next_as_buf(payload_len)
 
-        for i in range(len(payload)):
-            payload[i] = payload[i] ^ mask_key[i % 4]
+        return fin, opcode, payload_len, mask_key
 
-        return Frame(fin=fin, opcode=opcode, payload=payload)
+    def read_payload(self, payload_len, mask_key):
+        payload = yield from self.recv_next_as_buf(payload_len)
+        return unmask(payload, mask_key)
 
     def recv_next(self, n):
         return (yield from recv_next(self.sock, self.rbuf, n))
@@ -155,26 +346,68 @@ class WebSocket:
         return (yield from recv_next_as_buf(self.sock, self.rbuf, n))
 
     def send_message(self, msg):
-        msg = msg.encode('utf8')
-        pieces = [(OpCode.TEXT | 0x80).to_bytes(1, 'big')]
-        
-        if len(msg) < 126:
-            pieces.append(len(msg).to_bytes(1, 'big'))
-        elif len(msg) < (1 << 16):
+        """Send a text message, splitting it into frames of self.fragment_size bytes
+
+        Between fragments, incoming frames are processed (if any) so that control frames
+        like PING get serviced while a long message is being sent.
+
+        :param msg: str or iterable of str pieces
+        :return: size of the message payload in bytes
+        """
+        if isinstance(msg, str):
+            msg = (msg, )
+
+        sent = [] if self.recorder is not None else None
+        nbytes = 0
+        opcode = OpCode.TEXT
+        for fragment, is_last in iter_fragments(msg, self.fragment_size):
+            yield from self.send_frame(opcode, fragment, fin=is_last)
+            opcode = OpCode.CONTINUATION
+            nbytes += len(fragment)
+            if sent is not None:
+                sent.append(fragment)
+
+            if not is_last and (self.rbuf or is_readable(self.sock)):
+                yield from self.process_frame()
+                if self.is_closed:
+                    return nbytes
+
+        if sent is not None:
+            self.recorder.record(OUTBOUND, b''.join(sent))
+
+        return nbytes
+
+    def close(self, code):
+        self.in_sink = None
+        self.is_closed = True
+        yield from self.send_frame(OpCode.CLOSE, code.to_bytes(2, 'big'))
+
+    def send_frame(self, opcode, payload, fin=True):
+        pieces = [(opcode | (0x80 if fin else 0)).to_bytes(1, 'big')]
+
+        if len(payload) < 126:
+            pieces.append(len(payload).to_bytes(1, 'big'))
+        elif len(payload) < (1 << 16):
             pieces.append((126).to_bytes(1, 'big'))
-            pieces.append(len(msg).to_bytes(2, 'big'))
+            pieces.append(len(payload).to_bytes(2, 'big'))
         else:
             pieces.append((127).to_bytes(1, 'big'))
-            pieces.append(len(msg).to_bytes(8, 'big'))
+            pieces.append(len(payload).to_bytes(8, 'big'))
 
-        pieces.append(msg)
+        pieces.append(payload)
         total = b''.join(pieces)
 
         yield from send_buffer(self.sock, total)
 
-    def enqueue_message(self, msg):
-        assert isinstance(msg, str)
-        self.message_queue.append(msg)
+    def enqueue_message(self, msg, on_sent=None):
+        """Schedule msg for sending.
+
+        :param msg: str or iterable of str pieces (e.g. a generator).  In the latter case
+            the pieces are consumed by the eventloop thread as the message is being sent.
+        :param on_sent: if given, on_sent(nbytes) is called by the eventloop thread once
+            the message has been sent completely
+        """
+        self.message_queue.append((msg, on_sent))
         self.evt_write_messages.set()
 
 
@@ -199,18 +432,38 @@ def sec_websocket_accept(wskey):
 '''
 
 
-class Frame:
-    __slots__ = ('fin', 'opcode', 'payload')
+def iter_fragments(pieces, fragment_size):
+    """Encode str pieces and re-split them into chunks of fragment_size bytes
 
-    def __init__(self, fin, opcode, payload):
-        self.fin = fin
-        self.opcode = opcode
-        self.payload = payload
+    :return: generator of (bytes, is_last).  There's always at least 1 (possibly empty)
+        chunk with is_last == True.
+    """
+    buf = bytearray()
+
+    for piece in pieces:
+        buf.extend(piece.encode('utf8'))
+        if len(buf) <= fragment_size:
+            continue
+
+        start = 0
+        with memoryview(buf) as mv:
+            # Keep at least 1 byte: we don't know yet whether more pieces will follow
+            while len(buf) - start > fragment_size:
+                yield bytes(mv[start:start + fragment_size]), False
+                start += fragment_size
+        del buf[:start]
+
+    yield bytes(buf), True
+
+
+def unmask(payload, mask_key):
+    """XOR payload with the 4-byte mask_key repeated
 
+    Done as a single big-integer XOR, which is much faster than a per-byte Python loop.
 
-def maybe_str(payload, opcode):
-    assert opcode in (OpCode.BINARY, OpCode.TEXT)
-    if opcode == OpCode.BINARY:
-        return payload
-    else:
-        return payload.decode('utf-8')
+    :return: bytes object
+    """
+    n = len(payload)
+    key = (mask_key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little'))\
+        .to_bytes(n, 'little')
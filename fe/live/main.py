@@ -1,12 +1,16 @@
 import sublime
 import sublime_plugin
 
+import json
 import operator as pyop
 import os
 import traceback
 
 from live.code import *  # noqa
-from live.code.persist_handlers import persist_handlers
+from live.code.persist.module_files import compactor
+from live.code.persist_handlers import apply_module_persists
+from live.code.persist_handlers import recover_module_files
+from live.common.misc import write_file_atomically
 from live.gstate import config
 from live.gstate import fe_projects
 from live.lowlvl.eventloop import EventLoop
@@ -14,6 +18,7 @@ from live.lowlvl.http_server import serve
 from live.projects import *  # noqa
 from live.projects.datastructures import Project
 from live.repl import *  # noqa
+from live.replay import *  # noqa
 from live.request_handler import request_handler
 from live.sublime import *  # noqa
 from live.ws_handler import ws_handler
@@ -54,8 +59,12 @@ def plugin_loaded():
         path=config.be_root
     )
     fe_projects[:] = [config.livejs_project]
-    ws_handler.persist_handlers = persist_handlers
+    recover_module_files(config.livejs_project)
+    compactor.start()
+    ws_handler.persist_handler = apply_module_persists
     ws_handler.cb_on_connected = on_backend_connected
+    ws_handler.decode_worker.start()
+    schedule_metrics_dump()
     
     g_el.run_in_new_thread()
     start_server()
@@ -63,11 +72,60 @@ def plugin_loaded():
 
 
 def plugin_unloaded():
+    global metrics_dump_generation
+
+    metrics_dump_generation += 1
     stop_server()
     g_el.stop()
+    ws_handler.decode_worker.stop()
+    compactor.stop()
     print("Unloaded LiveJS")
 
 
+# Incremented to cancel the scheduled metrics dump (on plugin reload)
+metrics_dump_generation = 0
+
+
+def schedule_metrics_dump():
+    if config.metrics_dump_path is None:
+        return
+
+    generation = metrics_dump_generation
+
+    def dump():
+        if generation != metrics_dump_generation:
+            return
+        try:
+            dump_metrics(config.metrics_dump_path)
+        except OSError as e:
+            print("LiveJS: could not dump metrics:", e)
+        sublime.set_timeout_async(dump, int(config.metrics_dump_interval * 1000))
+
+    sublime.set_timeout_async(dump, int(config.metrics_dump_interval * 1000))
+
+
+def dump_metrics(path):
+    write_file_atomically(
+        path, json.dumps(ws_handler.metrics.as_dict(), indent=2, sort_keys=True)
+    )
+
+
+class LivejsShowMetricsCommand(sublime_plugin.WindowCommand):
+    def run(self, reset=False):
+        if reset:
+            ws_handler.metrics.reset()
+            sublime.status_message("LiveJS: protocol metrics reset")
+            return
+
+        view = self.window.new_file()
+        view.set_name('LiveJS: protocol metrics')
+        view.set_scratch(True)
+        view.run_command('append', {
+            'characters': ws_handler.metrics.report() or "No requests yet"
+        })
+        view.set_read_only(True)
+
+
 class LivejsToggleServerCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         if g_el.is_coroutine_live('server'):
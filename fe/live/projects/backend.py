@@ -1,19 +1,26 @@
 import sublime
 
+from live.code.persist_handlers import recover_module_files
 from live.gstate import config
 from live.gstate import fe_projects
 from live.projects.datastructures import Project
 from live.projects.operations import assign_window_for_livejs_project
 from live.shared.backend import interacts_with_backend
+from live.ws_handler import Batch
+from live.ws_handler import BackendError
 from live.ws_handler import ws_handler
 
 
-@interacts_with_backend()
-def on_backend_connected():
+@interacts_with_backend(session=lambda session: session)
+def on_backend_connected(session):
     assign_window_for_livejs_project()
 
+    ws_handler.run_async_op('setEncoding', {'encoding': config.be_value_encoding})
+    yield
+
     ws_handler.run_async_op('getProjects', {})
     be_projects = yield
+    session.project_ids.update(proj_data['id'] for proj_data in be_projects)
 
     if len(be_projects) == 1:
         # BE has no loaded projects besides livejs itself
@@ -22,20 +29,24 @@ def on_backend_connected():
             pass
         else:
             # FE --> BE
-            yield from fe_to_be()
+            yield from fe_to_be(session)
     else:
-        # BE has loaded projects. In this case no matter what we have here on the FE side,
-        # we should substitute it with the BE data.
+        # BE has loaded projects.  Make sure we know about all of them on the FE side
+        # (other BEs may be serving other projects, so we don't drop anything).
         be_to_fe(be_projects)
 
 
-def fe_to_be():
+def fe_to_be(session):
+    """Load all the FE projects into the BE, in a single round trip"""
+    batch = Batch()
+    projects = []
+
     for proj in fe_projects:
         if proj.id == config.livejs_project_id:
             continue
 
         proj_data = proj.read_project_data()
-        ws_handler.run_async_op('loadProject', {
+        batch.add('loadProject', {
             'projectPath': proj.path,
             'project': proj_data,
             'sources': {
@@ -43,15 +54,33 @@ def fe_to_be():
                 for module in proj_data['modules']
             }
         })
-        yield
+        projects.append(proj)
+
+    if not batch:
+        return
+
+    ws_handler.run_async_op('batch', batch.args, stream=True)
+    results = batch.unpack((yield))
+
+    for proj, result in zip(projects, results):
+        if isinstance(result, BackendError):
+            sublime.error_message("LiveJS: failed to load project \"{}\":\n{}"
+                                  .format(proj.name, result.message))
+        else:
+            session.project_ids.add(proj.id)
 
 
 def be_to_fe(be_projects):
-    fe_projects[:] = [
+    known_ids = {proj.id for proj in fe_projects}
+    new_projects = [
         Project(
             id=proj_data['id'],
             name=proj_data['name'],
             path=proj_data['path']
         )
         for proj_data in be_projects
+        if proj_data['id'] not in known_ids
     ]
+    for proj in new_projects:
+        recover_module_files(proj)
+    fe_projects.extend(new_projects)
@@ -7,6 +7,7 @@ from collections import OrderedDict
 
 from .datastructures import Project
 from .operations import project_for_window
+from live.code.persist_handlers import recover_module_files
 from live.common.method import method
 from live.common.misc import file_contents
 from live.common.misc import gen_uid
@@ -15,7 +16,8 @@ from live.gstate import fe_projects
 from live.projects.operations import read_project_file_at
 from live.settings import setting
 from live.shared.backend import BackendInteractingWindowCommand
-from live.shared.backend import is_interaction_possible
+from live.shared.backend import is_sync_interaction_possible
+from live.shared.backend import session_for_window
 from live.shared.json_edit import json_root_in
 from live.sublime.edit import edits_view
 from live.sublime.misc import open_filepath
@@ -58,6 +60,7 @@ class LivejsLoadProject(BackendInteractingWindowCommand):
             name=proj_data['projectName'],
             path=root
         )
+        recover_module_files(proj)
 
         ws_handler.run_async_op('loadProject', {
             'projectPath': root,
@@ -66,9 +69,10 @@ class LivejsLoadProject(BackendInteractingWindowCommand):
                 module['id']: proj.module_contents(module['name'])
                 for module in proj_data['modules']
             }
-        })
+        }, stream=True)
         yield
 
+        ws_handler.session_of_running_coroutine().project_ids.add(proj.id)
         fe_projects.append(proj)
         setting.project_id[self.window] = proj.id
 
@@ -116,7 +120,8 @@ class LivejsAddModule(BackendInteractingWindowCommand):
             file.write(module_contents)
 
     def input(self, args):
-        if not is_interaction_possible():
+        session = session_for_window(self.window)
+        if not is_sync_interaction_possible(session):
             return None
 
         proj = project_for_window(self.window)
@@ -125,7 +130,7 @@ class LivejsAddModule(BackendInteractingWindowCommand):
         
         modules_data = ws_handler.run_sync_op('getProjectModules', {
             'projectId': proj.id
-        })
+        }, session=session)
         return ModuleNameInputHandler([md['name'] for md in modules_data])
 
 
@@ -9,6 +9,8 @@ from live.repl.operations import new_repl_view
 from live.repl.operations import repl_for
 from live.settings import setting
 from live.shared.backend import BackendInteractingTextCommand
+from live.shared.backend import is_sync_interaction_possible
+from live.shared.backend import session_for_window
 from live.shared.command import TextCommand
 from live.shared.input_handlers import ModuleInputHandler
 from live.shared.js_cursor import StructuredCursor
@@ -34,9 +36,14 @@ class LivejsOpenReplCommand(sublime_plugin.WindowCommand):
     def run(self):
         view = find_repl_view(self.window)
         if view is None:
+            session = session_for_window(self.window)
+            if not is_sync_interaction_possible(session):
+                sublime.status_message("Cannot open REPL: BE not connected or link too slow")
+                return
+
             module = ws_handler.run_sync_op('getProjectArbitraryModule', {
                 'projectId': setting.project_id[self.window]
-            })
+            }, session=session)
             view = new_repl_view(self.window,
                                  Module(id=module['id'], name=module['name']))
         
@@ -98,9 +105,13 @@ class LivejsReplSetCurrentModuleCommand(TextCommand, ReplCommandMixin):
         self.repl.reinsert_prompt()
 
     def input(self, args):
+        session = session_for_window(self.view.window())
+        if not is_sync_interaction_possible(session):
+            return None
+
         modules = ws_handler.run_sync_op('getProjectModules', {
             'projectId': setting.project_id[self.view.window()]
-        })
+        }, session=session)
         return ModuleInputHandler(modules)
 
 
@@ -6,8 +6,10 @@ from live.common.misc import first_or_none
 from live.common.misc import gen_uid
 from live.settings import setting
 from live.shared.backend import interacts_with_backend
+from live.shared.backend import session_for_window
 from live.shared.cursor import Cursor
 from live.shared.js_cursor import StructuredCursor
+from live.shared.js_render import TextCursor
 from live.sublime.edit import edit_for
 from live.sublime.edit import edits_self_view
 from live.sublime.view_info import view_info_getter
@@ -108,7 +110,8 @@ class Node:
         self.is_expanded = False
         self._add_phantom(cur.pop_region())
 
-    @interacts_with_backend(edits_view=lambda self: self.view)
+    @interacts_with_backend(edits_view=lambda self: self.view,
+                            session=lambda self: session_for_window(self.view.window()))
     def _expand(self):
         """Abandon this node and insert a new expanded one"""
         assert not self.is_expanded
@@ -152,7 +155,8 @@ class Unrevealed:
     def repl(self):
         return repl_for(self.view)
 
-    @interacts_with_backend(edits_view=lambda self: self.view)
+    @interacts_with_backend(edits_view=lambda self: self.view,
+                            session=lambda self: session_for_window(self.view.window()))
     def on_navigate(self, href):
         """Abandon this node and insert a new expanded one"""
         error = jsval = None
@@ -186,67 +190,79 @@ class Unrevealed:
 def insert_js_value(cur, jsval):
     """Create Node instances which are inaccessible as of now.
 
-    They exist only for the sake of phantoms, and get GCed when we delete phantoms.
+    They exist only for the sake of phantoms, and get GCed when we delete phantoms.  The
+    value is rendered first and inserted in one go, then the phantoms are added.
     """
+    tcur = TextCursor.at(cur)
+    # Functions that add phantoms, to be called once the text is in the view
+    phantom_adders = []
+
+    def pop_region():
+        return sublime.Region(*tcur.pop_region())
+
+    def add_node(jsval, depth, reg):
+        phantom_adders.append(lambda: Node(cur.view, jsval, depth, reg))
+
     def insert_object(obj):
-        with cur.laying_out('object') as separate:
+        with tcur.laying_out('object') as separate:
             for key, value in obj.items():
                 separate()
-                cur.insert(key)
-                cur.insert_keyval_sep()
+                tcur.insert(key)
+                tcur.insert_keyval_sep()
                 insert_any(value)
 
     def insert_array(arr):
-        with cur.laying_out('array') as separate:
+        with tcur.laying_out('array') as separate:
             for value in arr:
                 separate()
                 insert_any(value)
 
     def insert_any(jsval):
         if jsval['type'] == 'object':
-            cur.push()
+            tcur.push()
             if 'value' in jsval:
                 insert_object(jsval['value'])
             else:
-                cur.insert(jsval_placeholder('object'))
-            Node(cur.view, jsval, cur.depth, cur.pop_region())
+                tcur.insert(jsval_placeholder('object'))
+            add_node(jsval, tcur.depth, pop_region())
         elif jsval['type'] == 'array':
-            cur.push()
+            tcur.push()
             if 'value' in jsval:
                 insert_array(jsval['value'])
             else:
-                cur.insert(jsval_placeholder('array'))
-            Node(cur.view, jsval, cur.depth, cur.pop_region())
+                tcur.insert(jsval_placeholder('array'))
+            add_node(jsval, tcur.depth, pop_region())
         elif jsval['type'] == 'function':
-            need_node = False
-
-            cur.push()
+            tcur.push()
             if 'value' in jsval:
-                cur.insert_function(jsval['value'])
+                tcur.insert_function(jsval['value'])
+                # 1-line functions don't need to be collapsed
+                need_node = len(jsval['value'].splitlines()) > 1
             else:
-                cur.insert(jsval_placeholder('function'))
+                tcur.insert(jsval_placeholder('function'))
                 need_node = True
-            reg = cur.pop_region()
+            reg = pop_region()
 
-            if not need_node:
-                # 1-line functions don't need to be collapsed
-                nline_beg, _ = cur.view.rowcol(reg.a)
-                nline_end, _ = cur.view.rowcol(reg.b)
-                need_node = nline_end > nline_beg
-            
             if need_node:
-                Node(cur.view, jsval, cur.depth, reg)
+                add_node(jsval, tcur.depth, reg)
         elif jsval['type'] == 'unrevealed':
-            cur.push()
-            cur.insert(jsval_placeholder('unrevealed'))
-            reg = cur.pop_region()
-            Unrevealed(cur.view, jsval['parentId'], jsval['prop'], cur.depth, reg)
+            tcur.push()
+            tcur.insert(jsval_placeholder('unrevealed'))
+            reg = pop_region()
+            depth = tcur.depth
+            phantom_adders.append(lambda: Unrevealed(
+                cur.view, jsval['parentId'], jsval['prop'], depth, reg
+            ))
         elif jsval['type'] == 'leaf':
-            cur.insert(jsval['value'])
+            tcur.insert(jsval['value'])
         else:
             raise RuntimeError("Unexpected jsval: {}".format(jsval))
 
     insert_any(jsval)
+    cur.insert(tcur.text)
+
+    for adder in phantom_adders:
+        adder()
 
 
 def jsval_placeholder(jsval_type):
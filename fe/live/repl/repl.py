@@ -3,6 +3,7 @@ import sublime
 
 from live.settings import setting
 from live.shared.backend import interacts_with_backend
+from live.shared.backend import session_for_window
 from live.shared.cursor import Cursor
 from live.sublime.edit import edit_for
 from live.sublime.edit import edits_self_view
@@ -161,7 +162,7 @@ class Repl:
 
         return True
 
-    @interacts_with_backend()
+    @interacts_with_backend(session=lambda self: session_for_window(self.view.window()))
     def delete_inspection_space(self):
         ws_handler.run_async_op('deleteInspectionSpace', {
             'spaceId': self.inspection_space_id
@@ -0,0 +1,89 @@
+"""Replay of recorded BE sessions (see config.ws_record_dir), to measure FE throughput
+
+The recorded inbound messages are fed through ws_handler as if they came from a real BE.
+Persist descriptors get applied to scratch copies of the module sources (see
+ScratchModules), never to the project files, views or browsers.  Results of operations
+are dropped since the requests were not made by us.  The recording should start with the
+connection, otherwise function sources sent before it are unknown.
+"""
+
+import os
+import sublime
+import sublime_plugin
+import threading
+import time
+
+from live.code.persist_handlers import ScratchModules
+from live.common.misc import gen_uid
+from live.lowlvl.session_log import replay_session_log
+from live.ws_handler import ws_handler
+
+
+__all__ = ['LivejsReplaySessionCommand']
+
+
+class ReplayWebSocket:
+    """Stands in for the WebSocket of a replayed session: what's sent goes nowhere"""
+
+    rtt = None
+
+    def enqueue_message(self, msg, on_sent=None):
+        pass
+
+
+class LivejsReplaySessionCommand(sublime_plugin.WindowCommand):
+    """Replay a recorded session
+
+    :param speed: how much faster than recorded to replay, null for as fast as possible
+    """
+
+    def run(self, path, speed=1.0):
+        if not os.path.isfile(path):
+            sublime.error_message("No such file: {}".format(path))
+            return
+
+        threading.Thread(target=replay, args=(path, speed), daemon=True).start()
+
+    def input(self, args):
+        if 'path' not in args:
+            return PathInputHandler()
+
+
+class PathInputHandler(sublime_plugin.TextInputHandler):
+    def name(self):
+        return 'path'
+
+    def placeholder(self):
+        return "Session log file (*.ljsrec)"
+
+
+def replay(path, speed):
+    session_id = 'replay-' + gen_uid()
+    scratch = ScratchModules()
+    ws_handler.connect(session_id, ReplayWebSocket(), is_replay=True,
+                       persist_handler=scratch)
+    print("LiveJS: replaying {} as session {}".format(path, session_id))
+
+    started_at = time.perf_counter()
+    try:
+        count, nbytes, elapsed = replay_session_log(
+            path, lambda data: ws_handler(session_id, data), speed
+        )
+    except Exception:
+        ws_handler.disconnect(session_id)
+        raise
+
+    ws_handler.decode_worker.barrier().wait()
+
+    def finish():
+        # Runs on the main thread after the messages scheduled before it were processed
+        total = time.perf_counter() - started_at
+        ws_handler.disconnect(session_id)
+        print("LiveJS: replayed {} messages ({} bytes) in {:.3f} s, {:.0f} messages/s"
+              .format(count, nbytes, total, count / total if total else 0))
+        print("LiveJS: {} module(s) changed in scratch copies"
+              .format(len(scratch.buffers)))
+        sublime.status_message("LiveJS: replay finished")
+
+    print("LiveJS: replay fed in {:.3f} s".format(elapsed))
+    sublime.set_timeout(finish, 0)
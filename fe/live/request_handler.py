@@ -1,26 +1,58 @@
+import functools
 import http.client as httpcli
 import json
 import os
 import re
+import time
+import urllib.parse
 
+from live.common.misc import gen_uid
 from live.gstate import config
 from live.ws_handler import ws_handler
 from live.lowlvl.http import Response
+from live.lowlvl.session_log import SessionRecorder
+from live.lowlvl.websocket import RawBufferSink
 from live.lowlvl.websocket import WebSocket
 from live.common.misc import file_contents
 
 
 def request_handler(req):
-    if req.path == '/ws':
-        if ws_handler.is_connected:
+    url = urllib.parse.urlsplit(req.path)
+
+    if url.path == '/ws':
+        # The BE identifies itself with a session ID that survives reconnects
+        [session_id] = urllib.parse.parse_qs(url.query).get('session', [gen_uid()])
+
+        # Same format as gen_uid().  The ID goes into file names of session recordings.
+        if re.match(r'[0-9a-f]{32}$', session_id) is None or \
+                ws_handler.is_session_connected(session_id):
             yield from Response(req, httpcli.BAD_REQUEST)
         else:
-            websocket = WebSocket(req, ws_handler)
-            ws_handler.connect(websocket)
+            recorder = None
+            if config.ws_record_dir is not None:
+                recorder = SessionRecorder(os.path.join(
+                    config.ws_record_dir,
+                    '{}-{}.ljsrec'.format(session_id, time.strftime('%Y%m%d-%H%M%S'))
+                ))
+                print("LiveJS: recording BE session into", recorder.path)
+
+            websocket = WebSocket(
+                req, functools.partial(ws_handler, session_id),
+                fragment_size=config.ws_fragment_size,
+                ping_interval=config.ws_ping_interval,
+                max_missed_pongs=config.ws_max_missed_pongs,
+                max_message_size=config.ws_max_message_size,
+                # JSON is decoded right from bytes by ws_handler's decode worker
+                sink_factory=RawBufferSink,
+                recorder=recorder
+            )
+            ws_handler.connect(session_id, websocket)
             try:
                 yield from websocket
             finally:
-                ws_handler.disconnect()
+                ws_handler.disconnect(session_id)
+                if recorder is not None:
+                    recorder.close()
 
         return
     
@@ -5,30 +5,59 @@ import sublime_plugin
 
 from live.coroutine import co_driver
 from live.projects.operations import validate_window_project_loaded
+from live.settings import setting
 from live.shared.command import TextCommand
 from live.sublime.edit import call_ensuring_edit_for
 from live.common.method import method
 from live.common.misc import wrap_gtor
-from live.ws_handler import MAIN_CHANNEL
 from live.ws_handler import ws_handler
 
 
-def validate_be_interaction(attempting_entity):
-    if not ws_handler.is_connected:
-        sublime.status_message("BE not connected")
-        return False
+def session_for_window(window):
+    """BE session that serves the project of window.
+
+    If there's no such session (or no project is associated with the window), this is
+    the most recently connected session.
+    """
+    project_id = setting.project_id[window] if window is not None else None
+    session = ws_handler.session_for_project(project_id) if project_id else None
+    return session or ws_handler.default_session
 
-    if co_driver.is_occupied(MAIN_CHANNEL):
-        print("Ignored invocation of {}: another BE interaction is active".format(
-            attempting_entity
-        ))
+
+def validate_be_interaction(attempting_entity, session):
+    if session is None:
+        sublime.status_message("BE not connected")
         return False
 
     return True
 
 
-def is_interaction_possible():
-    return ws_handler.is_connected and co_driver.is_free(MAIN_CHANNEL)
+def is_interaction_possible(session):
+    return session is not None
+
+
+def is_sync_interaction_possible(session):
+    """Whether we can afford to block the GUI waiting for the BE"""
+    return is_interaction_possible(session) and not session.is_link_slow
+
+
+def start_be_coroutine(gtor, session, name=None):
+    """Run gtor as a coroutine whose BE operations go to session by default
+
+    Any number of such coroutines can be active at once, their requests are pipelined
+    over the websocket.
+    """
+    ws_handler.bind_coroutine(gtor, session)
+    co_driver.add_coroutine(gtor, name)
+
+
+def view_edit_channel(view):
+    """Name of the coroutine that edits view in response to BE results
+
+    There can be at most 1 such coroutine per view, as they rely on the view not changing
+    under their feet.
+    """
+    return 'edit:{}'.format(view.id())
 
 
 def wrap_in_edit_view(gtor, view_getter):
@@ -38,14 +67,20 @@ def wrap_in_edit_view(gtor, view_getter):
 class BackendInteractingTextCommand(TextCommand):
     @method.around
     def run(self, **args):
-        if not validate_be_interaction(self):
+        session = session_for_window(self.view.window())
+        if not validate_be_interaction(self, session):
+            return
+        channel = view_edit_channel(self.view)
+        if co_driver.is_occupied(channel):
+            print("Ignored invocation of {}: another BE interaction with this view is "
+                  "active".format(self))
             return
         if not self.validate():
             return
 
         gtor = yield
         gtor = wrap_in_edit_view(gtor, lambda: self.view)
-        co_driver.add_coroutine(gtor, MAIN_CHANNEL)
+        start_be_coroutine(gtor, session, channel)
 
     def validate(self):
         return validate_window_project_loaded(self.view.window())
@@ -54,46 +89,75 @@ class BackendInteractingTextCommand(TextCommand):
 class BackendInteractingWindowCommand(sublime_plugin.WindowCommand):
     @method.around
     def run(self, **args):
-        if not validate_be_interaction(self):
+        session = session_for_window(self.window)
+        if not validate_be_interaction(self, session):
             return
         if not self.validate():
             return
 
         gtor = yield
-        co_driver.add_coroutine(gtor, MAIN_CHANNEL)
+        start_be_coroutine(gtor, session)
 
     def validate(self):
         return validate_window_project_loaded(self.window)
 
 
-def interacts_with_backend(edits_view=None):
-    if edits_view:
-        sig = inspect.signature(edits_view)
-        assert all(p.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD
-                   for p in sig.parameters.values())
-        view_getter_params = list(sig.parameters)
+def interacts_with_backend(edits_view=None, session=None):
+    """Run the decorated generator function as a coroutine interacting with the BE
 
+    :param edits_view: function returning the view that the coroutine edits.  The
+        coroutine runs on that view's edit channel, so it's not started if another one
+        is already editing the view.
+    :param session: function returning the BE session to interact with.  By default,
+        it's the most recently connected session.
+
+    Both functions take a subset of the decorated function's parameters, by name.
+    """
     def wrapper(fn):
-        if edits_view:
-            fn_sig = inspect.signature(fn)
+        view_getter = edits_view and bind_getter_to(edits_view, fn)
+        session_getter = session and bind_getter_to(session, fn)
 
         @functools.wraps(fn)
         def wrapped(*args, **kwargs):
-            if not validate_be_interaction(fn):
+            if session_getter:
+                be_session = session_getter(args, kwargs)
+            else:
+                be_session = ws_handler.default_session
+
+            if not validate_be_interaction(fn, be_session):
                 return
 
-            gtor = fn(*args, **kwargs)
-            if edits_view:
-                ba = fn_sig.bind(*args, **kwargs)
-                view_getter_args = {
-                    param: ba.arguments[param] for param in view_getter_params
-                }
-                view_getter = lambda: edits_view(**view_getter_args)
-                gtor = wrap_in_edit_view(gtor, view_getter)
+            if view_getter:
+                view = view_getter(args, kwargs)
+                channel = view_edit_channel(view)
+                if co_driver.is_occupied(channel):
+                    print("Ignored invocation of {}: another BE interaction with this "
+                          "view is active".format(fn.__qualname__))
+                    return
+            else:
+                channel = None
 
-            co_driver.add_coroutine(gtor, MAIN_CHANNEL)
+            gtor = fn(*args, **kwargs)
+            if view_getter:
+                gtor = wrap_in_edit_view(gtor, lambda: view)
 
+            start_be_coroutine(gtor, be_session, channel)
 
         return wrapped
 
     return wrapper
+
+
+def bind_getter_to(getter, fn):
+    """Make a function of (args, kwargs) that calls getter with fn's params it names"""
+    sig = inspect.signature(getter)
+    assert all(p.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD
+               for p in sig.parameters.values())
+    getter_params = list(sig.parameters)
+    fn_sig = inspect.signature(fn)
+
+    def call(args, kwargs):
+        ba = fn_sig.bind(*args, **kwargs)
+        return getter(**{param: ba.arguments[param] for param in getter_params})
+
+    return call
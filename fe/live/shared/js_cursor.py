@@ -1,12 +1,12 @@
-import contextlib
-import re
 import sublime
 
 from copy import copy
 
-from live.common.misc import tracking_last
 from live.gstate import config
 from live.shared.cursor import Cursor
+from live.shared import js_text
+from live.shared.js_render import JsLayout
+from live.shared.js_text import UnexpectedText
 from live.sublime.edit import edit_for
 
 
@@ -22,19 +22,29 @@ class UnexpectedContents(Exception):
         super().__init__(msg)
 
 
-re_any_brace = r'''[`'"()[\]{}]'''
-re_line_comment = r'//'
-re_block_comment = r'/\*'
-re_of_interest = (
-    '{re_any_brace}|{re_line_comment}|{re_block_comment}|/'.format(
-        re_any_brace=re_any_brace,
-        re_line_comment=re_line_comment,
-        re_block_comment=re_block_comment
-    )
-)
+# (view id, change count, text) of the last view we scanned
+last_snapshot = (None, None, None)
+
+
+def view_text(view):
+    """Whole text of view, taken anew only if the view changed since the last call"""
+    global last_snapshot
+
+    view_id, change_count, text = last_snapshot
+    if view_id != view.id() or change_count != view.change_count():
+        text = view.substr(sublime.Region(0, view.size()))
+        last_snapshot = (view.id(), view.change_count(), text)
+
+    return text
 
 
 class JsAwareCursor(Cursor):
+    """Cursor that skips JS comments, strings, regexes and nested braces
+
+    The snapshot of the view text (see view_text()) is scanned rather than doing a
+    view.find() and a view.substr() for every brace, quote or comment we pass by.
+    """
+
     def js_go_upto(self, pattern, move_if_not_found=False):
         return self._js_go(pattern, False, move_if_not_found)
 
@@ -42,93 +52,24 @@ class JsAwareCursor(Cursor):
         return self._js_go(pattern, True, move_if_not_found)
 
     def _js_go(self, pattern, including, move_if_not_found):
-        """Find specified pattern outside JS comment, string or brace nesting.
+        try:
+            found, self.pos = js_text.js_go(
+                view_text(self.view), self.pos, pattern, including, move_if_not_found
+            )
+        except UnexpectedText as e:
+            self.pos = e.pos
+            raise UnexpectedContents(self, "{}", e.msg)
 
-        :return: True if met, False if encountered any kind of closing brace.
-        """
-        balance = 0
-        re_target = '({})|({})'.format(re_of_interest, pattern)
-        initial_pos = self.pos
+        return found
 
-        while True:
-            reg = self.find(re_target)
-            if reg.a == -1:
-                if not move_if_not_found:
-                    self.pos = initial_pos
-                return False
-
-            s = self.view.substr(reg)
-            self.pos = reg.b
-
-            if re.match(pattern, s):
-                if balance == 0:
-                    if not including:
-                        self.pos = reg.a
-                    return True
-            elif s == '/*':
-                self._skip_to_end_of_block_comment()
-            elif s == '//':
-                self._skip_to_newline()
-            elif s == '/':
-                # May be a regex. Check what precedes the current position
-                if self._is_start_of_regex():
-                    self._skip_to_end_of_regex()
-            elif s in "\"'`":
-                self._skip_to_end_of_string(s)
-            elif s in '([{':
-                balance += 1
-            elif s in ')]}':
-                if balance == 0:
-                    self.pos = reg.a if move_if_not_found else initial_pos
-                    return False
-                else:
-                    balance -= 1
-            else:
-                raise RuntimeError("Unexpected match: {}".format(s))
-
-    def _skip_to_end_of_block_comment(self):
-        reg = self.find(r'\*/')
-        if reg.a == -1:
-            raise UnexpectedContents(self, "not found the end of block comment")
-        self.pos = reg.b
-
-    def _skip_to_newline(self):
-        reg = self.find('[\n]')
-        if reg.a == -1:
-            raise UnexpectedContents(self, "not found the newline")
-        self.pos = reg.b
-
-    def _skip_to_end_of_string(self, s):
-        reg = self.find(r'(?<!\\)' + s)
-        if reg.a == -1:
-            raise UnexpectedContents(self, "unterminated string literal")
-        self.pos = reg.b
-
-    def _is_start_of_regex(self):
-        with self.pos_preserved():
-            self.pos -= 1
-            self.skip_ws_bwd()
-            return self.prec_char in ",([{!~+-/*&|=:"
+    def skip_ws(self):
+        self.pos = js_text.skip_ws(view_text(self.view), self.pos)
 
-    def _skip_to_end_of_regex(self):
-        while True:
-            reg = self.find(r'\[|(?<!\\)/|\n')
-            if reg.a == -1 or self.view.substr(reg) == '\n':
-                raise UnexpectedContents(self, "unterminated regex literal")
-            self.pos = reg.b
-            s = self.view.substr(reg)
-            if s == '/':
-                return
-            
-            # Skip character class
-            assert s == '['
-            reg = self.find(r'(?<!\\)]|\n')
-            if reg.a == -1 or self.view.substr(reg) == '\n':
-                raise UnexpectedContents(self, "unterminated regex character class")
-            self.pos = reg.b
-
-
-class StructuredCursor(JsAwareCursor):
+    def skip_ws_bwd(self, limit=0):
+        self.pos = js_text.skip_ws_bwd(view_text(self.view), self.pos, limit)
+
+
+class StructuredCursor(JsAwareCursor, JsLayout):
     """Cursor that knows how to travel inside JS object and array literals
     
     container ::= { <init-space> Entry <inter-space> Entry ... Entry <term-space> }
@@ -146,10 +87,6 @@ class StructuredCursor(JsAwareCursor):
         if root_nesting is not None:
             self.root_nesting = root_nesting
 
-    @property
-    def nesting(self):
-        return self.root_nesting + self.depth
-    
     # @property
     # def is_looking_at(self, what):
     #     if what == 'object':
@@ -276,21 +213,6 @@ class StructuredCursor(JsAwareCursor):
         else:
             self.erase(folw_beg.pos)
 
-    def insert_initial_sep(self):
-        self.insert('\n')
-        self.indent(self.nesting + 1)
-
-    def insert_inter_sep(self):
-        self.insert(',\n')
-        self.indent(self.nesting + 1)
-
-    def insert_terminal_sep(self):
-        self.insert('\n')
-        self.indent(self.nesting)
-
-    def insert_keyval_sep(self):
-        self.insert(': ')
-
     def prepare_for_insertion_at(self, n):
         """Go to insertion position for nth child of the current entry (parent).
 
@@ -299,7 +221,13 @@ class StructuredCursor(JsAwareCursor):
         """
         self.enter()
         self.goto_nth_entry_or_end(n)
+        self.prepare_for_insertion()
+
+    def prepare_for_insertion(self):
+        """Insert separators for a new entry at the current position
 
+        The cursor must be where goto_nth_entry_or_end() leaves it.
+        """
         if self.is_at_container_end:
             if self.is_at_container_begin:
                 # The only node
@@ -327,76 +255,3 @@ class StructuredCursor(JsAwareCursor):
         else:
             # At least one is already in
             self.insert_inter_sep()
-
-    def insert_function(self, source):
-        # The last line of a function contains a single closing brace and is indented at
-        # the same level as the whole function.  This of course depends on the formatting
-        # style but it works for now and is very simple.
-        i = source.rfind('\n') + 1
-        n = 0
-        while i + n < len(source) and ord(source[i + n]) == 32:
-            n += 1
-
-        line0, *lines = source.splitlines()
-        
-        self.insert(line0)
-        if lines:
-            self.insert('\n')
-
-        for line, islast in tracking_last(lines):
-            self.indent(self.nesting + 1)
-            if not re.match(r'^\s*$', line):
-                self.insert(line[n:])
-            if not islast:
-                self.insert('\n')
-
-    def _forget_where_we_are(self):
-        if hasattr(self, 'inside_what'):
-            del self.inside_what
-
-    def open(self, typ):
-        if typ == 'object':
-            self.insert('{')
-        elif typ == 'array':
-            self.insert('[')
-        else:
-            raise RuntimeError
-
-        self.depth += 1
-        self.inside_what = typ
-
-    def close(self, typ):
-        if typ == 'object':
-            self.insert('}')
-        elif typ == 'array':
-            self.insert(']')
-        else:
-            raise RuntimeError
-
-        self.depth -= 1
-        self._forget_where_we_are()
-
-    @contextlib.contextmanager
-    def laying_out(self, typ):
-        self.open(typ)
-        sep = SeparatorInserter(self)
-        yield sep.insert
-        sep.done()
-        self.close(typ)
-
-
-class SeparatorInserter:
-    def __init__(self, cur):
-        self.cur = cur
-        self.inserted_initial = False
-
-    def insert(self):
-        if self.inserted_initial:
-            self.cur.insert_inter_sep()
-        else:
-            self.cur.insert_initial_sep()
-            self.inserted_initial = True
-
-    def done(self):
-        if self.inserted_initial:
-            self.cur.insert_terminal_sep()
@@ -0,0 +1,195 @@
+"""Laying out JS values as text, and rendering them into a str before it goes to a view
+
+Every Cursor.insert() is a Sublime API call.  So rather than inserting a big value piece
+by piece with a StructuredCursor, it is rendered with a TextCursor, which has the same
+layout methods but accumulates text in a list.  The text is then inserted with a single
+call.  A TextCursor starts at the position where its text is going to be inserted, so
+the regions it gives are right for the view once the text is in.
+"""
+
+import contextlib
+import re
+
+from live.common.misc import tracking_last
+from live.gstate import config
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+from live.shared.jsvalue import jsval_text
+from live.shared.jsvalue import jsval_type
+
+
+class JsLayout:
+    """How object and array literals and functions are laid out
+
+    Mixed into cursors that have pos, depth, insert() and indent().
+    """
+
+    root_nesting = 0
+
+    @property
+    def nesting(self):
+        return self.root_nesting + self.depth
+
+    def insert_initial_sep(self):
+        self.insert('\n')
+        self.indent(self.nesting + 1)
+
+    def insert_inter_sep(self):
+        self.insert(',\n')
+        self.indent(self.nesting + 1)
+
+    def insert_terminal_sep(self):
+        self.insert('\n')
+        self.indent(self.nesting)
+
+    def insert_keyval_sep(self):
+        self.insert(': ')
+
+    def insert_function(self, source):
+        # The last line of a function contains a single closing brace and is indented at
+        # the same level as the whole function.  This of course depends on the formatting
+        # style but it works for now and is very simple.
+        i = source.rfind('\n') + 1
+        n = 0
+        while i + n < len(source) and ord(source[i + n]) == 32:
+            n += 1
+
+        line0, *lines = source.splitlines()
+
+        self.insert(line0)
+        if lines:
+            self.insert('\n')
+
+        for line, islast in tracking_last(lines):
+            self.indent(self.nesting + 1)
+            if not re.match(r'^\s*$', line):
+                self.insert(line[n:])
+            if not islast:
+                self.insert('\n')
+
+    def _forget_where_we_are(self):
+        if hasattr(self, 'inside_what'):
+            del self.inside_what
+
+    def open(self, typ):
+        if typ == 'object':
+            self.insert('{')
+        elif typ == 'array':
+            self.insert('[')
+        else:
+            raise RuntimeError
+
+        self.depth += 1
+        self.inside_what = typ
+
+    def close(self, typ):
+        if typ == 'object':
+            self.insert('}')
+        elif typ == 'array':
+            self.insert(']')
+        else:
+            raise RuntimeError
+
+        self.depth -= 1
+        self._forget_where_we_are()
+
+    @contextlib.contextmanager
+    def laying_out(self, typ):
+        self.open(typ)
+        sep = SeparatorInserter(self)
+        yield sep.insert
+        sep.done()
+        self.close(typ)
+
+
+class SeparatorInserter:
+    def __init__(self, cur):
+        self.cur = cur
+        self.inserted_initial = False
+
+    def insert(self):
+        if self.inserted_initial:
+            self.cur.insert_inter_sep()
+        else:
+            self.cur.insert_initial_sep()
+            self.inserted_initial = True
+
+    def done(self):
+        if self.inserted_initial:
+            self.cur.insert_terminal_sep()
+
+
+class TextCursor(JsLayout):
+    """String builder with the insertion API of StructuredCursor
+
+    Regions are (begin, end) tuples.
+    """
+
+    def __init__(self, pos=0, depth=-1, root_nesting=None):
+        self.pos = pos
+        self.depth = depth
+        if root_nesting is not None:
+            self.root_nesting = root_nesting
+        self.pieces = []
+        self.retain_stack = []
+
+    @classmethod
+    def at(cls, cur):
+        """Rendering text to be inserted at the position of StructuredCursor cur"""
+        return cls(cur.pos, cur.depth, cur.root_nesting)
+
+    @property
+    def text(self):
+        return ''.join(self.pieces)
+
+    def insert(self, s):
+        self.pieces.append(s)
+        self.pos += len(s)
+
+    def indent(self, n):
+        self.insert(n * config.s_indent)
+
+    def push(self):
+        self.retain_stack.append(self.pos)
+
+    def pop_region(self):
+        return self.retain_stack.pop(), self.pos
+
+
+def render_js_value(cur, jsval):
+    """Render serialized jsval (leaves, functions, objects and arrays) with cur"""
+    def render_object(jsval):
+        with cur.laying_out('object') as separate:
+            for key, value in jsval_object_items(jsval):
+                separate()
+                cur.insert(key)
+                cur.insert_keyval_sep()
+                render_any(value)
+
+    def render_array(jsval):
+        with cur.laying_out('array') as separate:
+            for value in jsval_array_items(jsval):
+                separate()
+                render_any(value)
+
+    def render_any(jsval):
+        jstype = jsval_type(jsval)
+        if jstype == 'leaf':
+            cur.insert(jsval_text(jsval))
+        elif jstype == 'function':
+            cur.insert_function(jsval_text(jsval))
+        elif jstype == 'object':
+            render_object(jsval)
+        elif jstype == 'array':
+            render_array(jsval)
+        else:
+            raise RuntimeError("Unexpected jsval: {}".format(jsval))
+
+    render_any(jsval)
+
+
+def js_value_text(cur, jsval):
+    """Text of serialized jsval laid out to be inserted at StructuredCursor cur"""
+    tcur = TextCursor.at(cur)
+    render_js_value(tcur, jsval)
+    return tcur.text
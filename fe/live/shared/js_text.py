@@ -0,0 +1,125 @@
+"""JS-aware scanning of source text held in a str
+
+This follows exactly what JsAwareCursor does with a view: same patterns, same treatment of
+comments, strings and regexes.  Positions are str indices.
+"""
+
+import re
+
+
+class UnexpectedText(Exception):
+    def __init__(self, pos, msg):
+        super().__init__("Unexpected contents at {}: {}".format(pos, msg))
+        self.pos = pos
+        self.msg = msg
+
+
+re_any_brace = r'''[`'"()[\]{}]'''
+re_line_comment = r'//'
+re_block_comment = r'/\*'
+re_of_interest = (
+    '{re_any_brace}|{re_line_comment}|{re_block_comment}|/'.format(
+        re_any_brace=re_any_brace,
+        re_line_comment=re_line_comment,
+        re_block_comment=re_block_comment
+    )
+)
+
+re_block_comment_end = re.compile(r'\*/')
+re_newline = re.compile(r'\n')
+re_regex_part = re.compile(r'\[|(?<!\\)/|\n')
+re_regex_class_end = re.compile(r'(?<!\\)]|\n')
+re_string_end = {q: re.compile(r'(?<!\\)' + q) for q in ('"', "'", '`')}
+
+# {pattern: (compiled '(<of interest>)|(<pattern>)', compiled pattern)}
+compiled_targets = {}
+
+
+def js_go(text, pos, pattern, including=False, move_if_not_found=False):
+    """Find pattern outside JS comment, string or brace nesting, starting at pos
+
+    :return: (found, new position).  found is False if a closing brace was encountered
+        (or the text ended) before the pattern.  The position is then either pos or where
+        scanning stopped, depending on move_if_not_found.
+    """
+    compiled = compiled_targets.get(pattern)
+    if compiled is None:
+        compiled = compiled_targets[pattern] = (
+            re.compile('({})|({})'.format(re_of_interest, pattern)),
+            re.compile(pattern)
+        )
+    target, re_pattern = compiled
+
+    balance = 0
+    initial_pos = pos
+
+    while True:
+        mo = target.search(text, pos)
+        if mo is None:
+            return False, (pos if move_if_not_found else initial_pos)
+
+        s = mo.group()
+        pos = mo.end()
+
+        if re_pattern.match(s):
+            if balance == 0:
+                return True, (pos if including else mo.start())
+        elif s == '/*':
+            pos = skip_past(text, pos, re_block_comment_end, "end of block comment")
+        elif s == '//':
+            pos = skip_past(text, pos, re_newline, "the newline")
+        elif s == '/':
+            # May be a regex. Check what precedes the current position
+            if is_start_of_regex(text, mo.start()):
+                pos = skip_regex(text, pos)
+        elif s in "\"'`":
+            pos = skip_past(text, pos, re_string_end[s], "end of string literal")
+        elif s in '([{':
+            balance += 1
+        elif s in ')]}':
+            if balance == 0:
+                return False, (mo.start() if move_if_not_found else initial_pos)
+            else:
+                balance -= 1
+        else:
+            raise RuntimeError("Unexpected match: {}".format(s))
+
+
+def skip_past(text, pos, regex, what):
+    mo = regex.search(text, pos)
+    if mo is None:
+        raise UnexpectedText(pos, "not found the {}".format(what))
+    return mo.end()
+
+
+def is_start_of_regex(text, slash_pos):
+    pos = skip_ws_bwd(text, slash_pos)
+    return pos == 0 or text[pos - 1] in ",([{!~+-/*&|=:"
+
+
+def skip_regex(text, pos):
+    while True:
+        mo = re_regex_part.search(text, pos)
+        if mo is None or mo.group() == '\n':
+            raise UnexpectedText(pos, "unterminated regex literal")
+        pos = mo.end()
+        if mo.group() == '/':
+            return pos
+
+        # Skip character class
+        mo = re_regex_class_end.search(text, pos)
+        if mo is None or mo.group() == '\n':
+            raise UnexpectedText(pos, "unterminated regex character class")
+        pos = mo.end()
+
+
+def skip_ws(text, pos):
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def skip_ws_bwd(text, pos, limit=0):
+    while pos > limit and text[pos - 1].isspace():
+        pos -= 1
+    return pos
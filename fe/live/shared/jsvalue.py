@@ -0,0 +1,64 @@
+"""Accessors for serialized JS values (see jsvalue-protocol.txt)
+
+A value comes in one of 2 encodings, depending on what was negotiated with the BE:
+
+  * dicts:   {"type": "leaf", "value": "12"}, {"type": "object", "value": {k: v, ...}}
+  * compact: ["l", "12"], ["o", k0, v0, k1, v1, ...]
+
+The encodings are told apart by the Python type (list vs dict), so code that uses these
+accessors works with either of them.
+"""
+
+import itertools
+
+
+compact_tags = {
+    'l': 'leaf',
+    'f': 'function',
+    'o': 'object',
+    'a': 'array',
+    'u': 'unexpanded',
+}
+
+
+def is_compact(jsval):
+    return isinstance(jsval, list)
+
+
+def jsval_type(jsval):
+    if is_compact(jsval):
+        return compact_tags[jsval[0]]
+    else:
+        return jsval['type']
+
+
+def jsval_text(jsval):
+    """Text of a leaf, or source of a function"""
+    if is_compact(jsval):
+        return jsval[1] if jsval[0] == 'l' else jsval[2]
+    else:
+        return jsval['value']
+
+
+def jsval_object_items(jsval):
+    """:return: iterable of (key, jsval)"""
+    if is_compact(jsval):
+        it = itertools.islice(jsval, 1, None)
+        return zip(it, it)
+    else:
+        return jsval['value'].items()
+
+
+def jsval_array_items(jsval):
+    if is_compact(jsval):
+        return itertools.islice(jsval, 1, None)
+    else:
+        return jsval['value']
+
+
+def jsval_unexpanded(jsval):
+    """:return: (kind, size) of an unexpanded placeholder"""
+    if is_compact(jsval):
+        return jsval[1], jsval[2]
+    else:
+        return jsval['kind'], jsval['size']
@@ -0,0 +1,258 @@
+"""Structural index of a module source: where each entry's key and value are
+
+Finding an entry by path with PersistCursor means lexing all the text that precedes it.
+The index is built by a single scan of the source and is then kept up to date as persist
+operations edit the text, so that locating an entry costs O(depth).
+
+Offsets of entries are stored relative to the opening bracket of their container.  That
+way an edit only shifts the entries that follow it in the same container and in the
+containers up the path, not the whole file.
+"""
+
+import re
+
+from live.shared.js_text import UnexpectedText
+from live.shared.js_text import js_go
+from live.shared.js_text import skip_ws
+from live.shared.js_text import skip_ws_bwd
+
+
+re_module_root = re.compile(r'let \$ = (?=\{)')
+
+
+class IndexEntry:
+    """Entry of an object or array literal
+
+    start is where the key is (for arrays, same as value).  end is where the value ends:
+    at the separating comma, or before the whitespace that precedes the closing bracket
+    (that's what StructuredCursor.goto_entry_end() gives).
+    """
+    __slots__ = ('start', 'value', 'end', 'container')
+
+    def __init__(self, start, value, end, container):
+        self.start = start
+        self.value = value
+        self.end = end
+        # IndexContainer if the value is an object/array literal, None otherwise
+        self.container = container
+
+    def shift(self, delta):
+        self.start += delta
+        self.value += delta
+        self.end += delta
+
+
+class IndexContainer:
+    __slots__ = ('kind', 'entries', 'close')
+
+    def __init__(self, kind, entries, close):
+        self.kind = kind  # 'object' or 'array'
+        self.entries = entries
+        self.close = close  # offset of the closing bracket
+
+
+class SourceIndex:
+    """Index of a module source text, see the module docstring
+
+    Positions taken and returned by the methods are absolute.  Methods that record edits
+    must be called right after the edit is made, with the same path that was used to make
+    it.
+    """
+
+    def __init__(self, text):
+        mo = re_module_root.search(text)
+        if mo is None:
+            raise UnexpectedText(0, "module root object not found")
+
+        self.root_pos = mo.end()
+        self.root = scan_container(text, self.root_pos)
+        # Set by the owner to tell whether the index corresponds to the text
+        self.change_count = None
+
+    def _descend(self, path):
+        """:return: [(container, its absolute position)] for the root and then each path
+            element but the last one"""
+        chain = [(self.root, self.root_pos)]
+        for n in path[:-1]:
+            container, pos = chain[-1]
+            entry = container.entries[n]
+            if entry.container is None:
+                raise UnexpectedText(pos + entry.value, "non-container follows")
+            chain.append((entry.container, pos + entry.value))
+
+        return chain
+
+    def _descend_into(self, path):
+        """Like _descend(path + [None]) i.e. ending with the container at path"""
+        return self._descend(list(path) + [None])
+
+    def entry_pos(self, path):
+        """Position of the entry at path (of its key for object entries)
+
+        For the empty path, the position of the root's opening brace.
+        """
+        if not path:
+            return self.root_pos
+
+        container, pos = self._descend(path)[-1]
+        return pos + container.entries[path[-1]].start
+
+    def container_kind(self, path):
+        """Whether the value at path is an 'object' or an 'array'"""
+        container, pos = self._descend_into(path)[-1]
+        return container.kind
+
+    def insertion_pos(self, parent_path, n):
+        """Where StructuredCursor.goto_nth_entry_or_end(n) would get inside parent_path"""
+        container, pos = self._descend_into(parent_path)[-1]
+        if n < len(container.entries):
+            return pos + container.entries[n].start
+        return pos + container.close
+
+    def value_replaced(self, path, value_text):
+        """The value at path was replaced with value_text"""
+        chain = self._descend(path)
+        container, pos = chain[-1]
+        entry = container.entries[path[-1]]
+
+        new_end = entry.value + len(value_text)
+        delta = new_end - entry.end
+        entry.end = new_end
+        entry.container = scan_value(value_text)
+
+        self._shift_following(chain, path, delta, after=path[-1] + 1)
+
+    def key_renamed(self, path, delta):
+        """The key of the entry at path was changed, growing it by delta characters"""
+        chain = self._descend(path)
+        container, pos = chain[-1]
+        entry = container.entries[path[-1]]
+        entry.value += delta
+        entry.end += delta
+
+        self._shift_following(chain, path, delta, after=path[-1] + 1)
+
+    def entry_span(self, path):
+        """:return: (start, end) of the entry at path"""
+        container, pos = self._descend(path)[-1]
+        entry = container.entries[path[-1]]
+        return pos + entry.start, pos + entry.end
+
+    def entry_deleted(self, path, delta):
+        """The entry at path was deleted, along with a separator (delta is negative)
+
+        :return: the IndexEntry removed
+        """
+        chain = self._descend(path)
+        container, pos = chain[-1]
+        entry = container.entries.pop(path[-1])
+
+        self._shift_following(chain, path, delta, after=path[-1])
+        return entry
+
+    def entry_inserted(self, path, start, value, value_text, delta):
+        """A new entry was inserted so that it's now at path
+
+        :param start: absolute position of the new entry
+        :param value: absolute position of its value
+        :param value_text: the value's source
+        :param delta: how many characters were inserted in total, including separators
+        """
+        chain = self._descend(path)
+        container, pos = chain[-1]
+        n = path[-1]
+
+        container.entries.insert(n, IndexEntry(
+            start=start - pos,
+            value=value - pos,
+            end=value - pos + len(value_text),
+            container=scan_value(value_text)
+        ))
+
+        self._shift_following(chain, path, delta, after=n + 1)
+
+    def entry_reinserted(self, path, start, entry, delta):
+        """The text of a deleted entry was inserted back so that it's now at path
+
+        The entry's value is not scanned again: offsets inside a container are relative
+        to it, so they stay valid wherever the text goes.
+
+        :param start: absolute position of the entry's text
+        :param entry: IndexEntry returned by entry_deleted()
+        :param delta: how many characters were inserted in total, including separators
+        """
+        chain = self._descend(path)
+        container, pos = chain[-1]
+        n = path[-1]
+
+        entry.shift(start - pos - entry.start)
+        container.entries.insert(n, entry)
+
+        self._shift_following(chain, path, delta, after=n + 1)
+
+    def _shift_following(self, chain, path, delta, after):
+        """Shift what follows the edited entry by delta, up to the root
+
+        :param after: index of the first entry in the innermost container to shift
+        """
+        if delta == 0:
+            return
+
+        for level in range(len(chain) - 1, -1, -1):
+            container, pos = chain[level]
+            for entry in container.entries[after:]:
+                entry.shift(delta)
+            container.close += delta
+
+            if level > 0:
+                # The container's own entry in its parent grows by delta
+                parent, parent_pos = chain[level - 1]
+                parent.entries[path[level - 1]].end += delta
+                after = path[level - 1] + 1
+
+
+def scan_value(text):
+    """:return: IndexContainer if text is an object/array literal, None otherwise"""
+    if text[:1] in ('{', '['):
+        return scan_container(text, 0)
+    return None
+
+
+def scan_container(text, open_pos):
+    """Index the object or array literal whose opening bracket is at open_pos"""
+    kind = 'object' if text[open_pos] == '{' else 'array'
+    entries = []
+    pos = skip_ws(text, open_pos + 1)
+
+    while text[pos:pos + 1] not in (']', '}'):
+        start = pos
+        if kind == 'object':
+            found, pos = js_go(text, pos, r':\s*', including=True)
+            if not found:
+                raise UnexpectedText(pos, "malformed \"key: value\" entry")
+        value = pos
+
+        container = None
+        if text[value] in '{[':
+            container = scan_container(text, value)
+            pos = value + container.close + 1
+
+        found, pos = js_go(text, pos, r',', move_if_not_found=True)
+        if found:
+            end = pos
+            found, pos = js_go(text, pos, r',\s*', including=True)
+        else:
+            if pos >= len(text):
+                raise UnexpectedText(pos, "unterminated container")
+            end = skip_ws_bwd(text, pos)
+
+        entries.append(IndexEntry(
+            start - open_pos, value - open_pos, end - open_pos,
+            container
+        ))
+
+        if not found:
+            break
+
+    return IndexContainer(kind, entries, pos - open_pos)
+
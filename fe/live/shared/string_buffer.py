@@ -0,0 +1,121 @@
+"""Text held in memory that cursors can work with as if it were a Sublime view
+
+Only the part of the view API that cursors and persist operations use is provided.
+Regions passed in may be sublime.Region or Region defined here: anything with begin() and
+end() will do.
+"""
+
+import itertools
+import re
+
+
+class Region:
+    __slots__ = ('a', 'b')
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def __eq__(self, other):
+        return (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return 'Region({}, {})'.format(self.a, self.b)
+
+
+# Negative, so as not to clash with ids of real views
+buffer_ids = itertools.count(-1, -1)
+
+
+class StringBuffer:
+    """View-like text buffer
+
+    Cursors insert text piece by piece, each piece right after the previous one.  Such
+    runs of insertions are accumulated and joined into the text only when the text is
+    needed, so that inserting a big value costs O(size of the text) rather than O(size of
+    the text * number of pieces).
+    """
+
+    def __init__(self, text, file_name=None):
+        self._id = next(buffer_ids)
+        self._file_name = file_name
+        self._text = text
+        self._change_count = 0
+        # Run of consecutive insertions not yet joined into _text
+        self._run_pos = None
+        self._run_end = None
+        self._run = []
+
+    @property
+    def text(self):
+        self._join_run()
+        return self._text
+
+    def _join_run(self):
+        if self._run:
+            self._text = ''.join(
+                [self._text[:self._run_pos]] + self._run + [self._text[self._run_pos:]]
+            )
+            self._run_pos = self._run_end = None
+            self._run = []
+
+    def id(self):
+        return self._id
+
+    def file_name(self):
+        return self._file_name
+
+    def is_loading(self):
+        return False
+
+    def change_count(self):
+        return self._change_count
+
+    def size(self):
+        return len(self._text) + (self._run_end - self._run_pos if self._run else 0)
+
+    def substr(self, x):
+        text = self.text
+        if isinstance(x, int):
+            return text[x:x + 1] if x >= 0 else ''
+        return text[x.begin():x.end()]
+
+    def rowcol(self, pos):
+        text = self.text
+        row = text.count('\n', 0, pos)
+        return row, pos - (text.rfind('\n', 0, pos) + 1)
+
+    def find(self, pattern, start_pt):
+        mo = re.compile(pattern).search(self.text, start_pt)
+        if mo is None:
+            return Region(-1, -1)
+        return Region(mo.start(), mo.end())
+
+    def insert(self, edit, pt, text):
+        if self._run and pt == self._run_end:
+            self._run.append(text)
+            self._run_end += len(text)
+        else:
+            self._join_run()
+            self._run_pos = pt
+            self._run_end = pt + len(text)
+            self._run = [text]
+
+        self._change_count += 1
+        return len(text)
+
+    def erase(self, edit, region):
+        text = self.text
+        self._text = text[:region.begin()] + text[region.end():]
+        self._change_count += 1
+
+    def replace(self, edit, region, text):
+        old = self.text
+        self._text = old[:region.begin()] + text + old[region.end():]
+        self._change_count += 1
@@ -1,3 +1,4 @@
 from .on_view_loaded import *  # noqa
 from .edit import *  # noqa
 from .view_info import *  # noqa
+from .view_saver import *  # noqa
@@ -14,8 +14,13 @@ view_planes = []
 
 class ViewInfoDiscarder(sublime_plugin.EventListener):
     def on_close(self, view):
-        for plane in view_planes:
-            plane.pop(view.id(), None)
+        discard_view_info(view)
+
+
+def discard_view_info(view):
+    """Forget all the information associated with view (or a view-like buffer)"""
+    for plane in view_planes:
+        plane.pop(view.id(), None)
 
 
 def view_info_getter(info_cls, is_applicable_to):
@@ -1,37 +1,92 @@
+import os
 import sublime
+import sublime_plugin
 import time
 
+from live.gstate import config
+from live.ws_handler import ws_handler
 
-INTERVAL = 3000
+
+__all__ = ['SaverListener']
+
+
+class PendingSave:
+    def __init__(self, view, now):
+        self.view = view
+        self.first_request_at = now
+        self.last_request_at = now
+
+    @property
+    def due_at(self):
+        return min(self.last_request_at + config.save_delay,
+                   self.first_request_at + config.save_max_delay)
 
 
 class Saver:
-    """Save all the files with JS source code that need to be persisted after changes.
+    """Save the files with JS source code that need to be persisted after changes.
 
-    Current policy is the following:
-       save if no saving requests were issued for a set time interval.
+    Each view is saved once no save requests were issued for it for config.save_delay
+    seconds, but no later than config.save_max_delay seconds after the first request.
+    Requests for a view that is already waiting to be saved are coalesced.
+
+    Saving is done with Sublime's "save" command in its async mode, so that the file is
+    written off the GUI thread where Sublime supports it.
     """
 
     def __init__(self):
-        self.views = []
-        self.most_recent_request_moment = None
+        self.pending = {}  # {view id: PendingSave}
+        # {view id: moment of the first request} for views being saved
+        self.saving = {}
 
     def request_save(self, view):
-        if not any(vw.id() == view.id() for vw in self.views):
-            self.views.append(view)
-        if self.most_recent_request_moment is None:
-            sublime.set_timeout(self._save, INTERVAL)
-        self.most_recent_request_moment = time.perf_counter()
-
-    def _save(self):
-        elapsed = (time.perf_counter() - self.most_recent_request_moment) * 1000.0
-        if elapsed < INTERVAL:
-            sublime.set_timeout(self._save, INTERVAL)
-        else:
-            for view in self.views:
-                view.run_command('save')
-            del self.views[:]
-            self.most_recent_request_moment = None
+        now = time.perf_counter()
+        pending = self.pending.get(view.id())
+        if pending is not None:
+            pending.last_request_at = now
+            return
+
+        self.pending[view.id()] = PendingSave(view, now)
+        self._check_later(view.id(), config.save_delay)
+
+    def _check_later(self, view_id, delay):
+        sublime.set_timeout(lambda: self._check(view_id), int(delay * 1000))
+
+    def _check(self, view_id):
+        pending = self.pending.get(view_id)
+        if pending is None:
+            return
+
+        now = time.perf_counter()
+        if now < pending.due_at:
+            self._check_later(view_id, pending.due_at - now)
+            return
+
+        del self.pending[view_id]
+        if pending.view.is_valid() and pending.view.is_dirty():
+            self.saving[view_id] = pending.first_request_at
+            pending.view.run_command('save', {'async': True})
+
+    def saved(self, view):
+        if view.id() in self.pending and not view.is_dirty():
+            # Saved by the user, along with everything we were going to save
+            self.saving[view.id()] = self.pending.pop(view.id()).first_request_at
+
+        first_request_at = self.saving.pop(view.id(), None)
+        if first_request_at is None:
+            return
+
+        try:
+            nbytes = os.path.getsize(view.file_name())
+        except OSError:
+            nbytes = 0
+        ws_handler.metrics.module_saved(
+            'view', time.perf_counter() - first_request_at, nbytes
+        )
 
 
 saver = Saver()
+
+
+class SaverListener(sublime_plugin.EventListener):
+    def on_post_save(self, view):
+        saver.saved(view)
@@ -1,16 +1,30 @@
 import collections
+import concurrent.futures
+import functools
+import itertools
 import json
 import re
 import sublime
 import threading
-
-from live.common.misc import index_where
-from live.common.misc import stopwatch
+import time
+import weakref
+
+from live.common.function_cache import FUNCTION_SOURCE_UNAVAILABLE
+from live.common.function_cache import FunctionSourceCache
+from live.common.function_cache import resolve_function_sources
+from live.common.json_decode import DecodeWorker
+from live.common.metrics import ProtocolMetrics
+from live.common.misc import take_over_list_items
+from live.common.persist_coalesce import group_by_module
 from live.coroutine import co_driver
 from live.gstate import config
 
 
-MAIN_CHANNEL = 'main'
+json_encoder = json.JSONEncoder()
+
+# Sources of JS functions received from all the BEs, by hash.  Messages are resolved against
+# it as soon as they're decoded, so consumers always see complete function values.
+function_cache = FunctionSourceCache(config.function_cache_size)
 
 
 class BackendError(Exception):
@@ -45,19 +59,151 @@ def make_be_error(name, info):
     return be_errors[name].make(info)
 
 
-class WsHandler:
+class Batch:
+    """Builder of a 'batch' operation: several operations done in a single round trip
+
+    The BE executes the operations in order and responds with all the results at once.
+    A failing operation doesn't prevent subsequent ones from running.
+
+        batch = Batch()
+        batch.add('getKeyAt', {...})
+        batch.add('getValueAt', {...})
+        ws_handler.run_async_op('batch', batch.args)
+        key, value = batch.unpack((yield))
+    """
+
     def __init__(self):
+        self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def add(self, operation, args):
+        """Add operation to the batch
+
+        :return: index of its result in what unpack() returns
+        """
+        self.operations.append({
+            'operation': operation,
+            'args': args
+        })
+        return len(self.operations) - 1
+
+    @property
+    def args(self):
+        return {'operations': self.operations}
+
+    def unpack(self, results):
+        """Convert what the BE responded with into a list of values/BackendError instances
+
+        :param results: the value of the 'batch' operation
+        """
+        assert len(results) == len(self.operations)
+        return [
+            res['value'] if res['success'] else make_be_error(res['error'], res['info'])
+            for res in results
+        ]
+
+
+class Session:
+    """Connection to a single BE (a browser tab running live.js)
+
+    Each session has its own queue of incoming messages, so that several BEs can be
+    interacted with concurrently.
+    """
+
+    def __init__(self, session_id, websocket, is_replay=False, persist_handler=None):
+        self.id = session_id
+        self.websocket = websocket
+        # Replay of a recorded session: there's no BE to respond to what we send
+        self.is_replay = is_replay
+        # Replayed persists go to this handler rather than to the project modules
+        self.persist_handler = persist_handler
         self.messages = []
+        # Operations sent to the BE whose results haven't come yet:
+        # {request_id: coroutine to send the result to (None if nobody waits for it)}
+        self.pending = {}
+        # Results of synchronous operations bypass the message queue:
+        # {request_id: concurrent.futures.Future}
+        self.sync_futures = {}
+        # While function sources are being fetched from the BE, incoming messages are held
+        # here (by the decode worker thread), to keep their order.
+        self.sources_request_id = None
+        self.parked_messages = []
+        # IDs of projects this BE has loaded.  Operations on a project are routed to the
+        # session that serves it.
+        self.project_ids = set()
+
+    def __repr__(self):
+        return '#<BE session {}>'.format(self.id)
+
+    @property
+    def rtt(self):
+        """Smoothed round-trip time to the BE in seconds (None if unknown)"""
+        return self.websocket.rtt
+
+    @property
+    def is_link_slow(self):
+        """Whether a synchronous operation would likely freeze the GUI for too long"""
+        rtt = self.rtt
+        return rtt is not None and rtt > config.max_gui_freeze
+
+
+class WsHandler:
+    def __init__(self):
+        # {session_id: Session}, in the order of connection
+        self.sessions = collections.OrderedDict()
         self.is_requested_processing = False
-        self.is_directly_processing = False
-        self.cond_processing = threading.Condition()
-        self.websocket = None
+        self.lock = threading.Lock()
         self.cb_on_connected = None
-        self.persist_handlers = None
+        # Function (descriptors) applying a run of persist descriptors of a single module
+        self.persist_handler = None
+        self.request_ids = itertools.count(1)
+        # {coroutine: Session it interacts with}
+        self.co_sessions = weakref.WeakKeyDictionary()
+        # Incoming messages are JSON-decoded by this worker, so that big BE responses
+        # don't hold up the eventloop thread
+        self.decode_worker = DecodeWorker(self._message_decoded)
+        self.metrics = ProtocolMetrics()
 
     @property
     def is_connected(self):
-        return self.websocket is not None
+        return bool(self.sessions)
+
+    def is_session_connected(self, session_id):
+        return session_id in self.sessions
+
+    @property
+    def default_session(self):
+        """The most recently connected session, or None"""
+        return next(
+            (session for session in reversed(list(self.sessions.values()))
+             if not session.is_replay),
+            None
+        )
+
+    def session_for_project(self, project_id):
+        """The most recently connected session that serves project_id, or None"""
+        for session in reversed(list(self.sessions.values())):
+            if not session.is_replay and project_id in session.project_ids:
+                return session
+
+        return None
+
+    def bind_coroutine(self, co, session):
+        """Make the coroutine co interact with session by default"""
+        self.co_sessions[co] = session
+
+    def session_of_running_coroutine(self):
+        co = co_driver.co_running
+        if co is None:
+            return None
+
+        session = self.co_sessions.get(co)
+        if session is None or not self.is_session_connected(session.id):
+            return None
+
+        return session
 
     # def on_connected(self):
     #     def wrapper(fn):
@@ -71,40 +217,163 @@ class WsHandler:
     #         return fn
     #     return wrapper
 
-    def _fire_connected(self):
+    def _fire_connected(self, session):
         if not self.cb_on_connected:
             return
-        sublime.set_timeout(self.cb_on_connected, 0)
+        sublime.set_timeout(lambda: self.cb_on_connected(session), 0)
 
-    def connect(self, websocket):
-        assert not self.is_connected
-        
-        self.websocket = websocket
-        self._fire_connected()
-        print("LiveJS: BE websocket connected")
+    def connect(self, session_id, websocket, is_replay=False, persist_handler=None):
+        """Register a new session
+
+        :param persist_handler: for a replayed session, where its persists go to.  They
+                                must never reach the project modules.
+        """
+        assert not self.is_session_connected(session_id)
+        assert is_replay == (persist_handler is not None)
+
+        session = Session(session_id, websocket, is_replay, persist_handler)
+        with self.lock:
+            self.sessions[session_id] = session
+
+        if not is_replay:
+            self._fire_connected(session)
+        print("LiveJS: BE websocket connected (session {})".format(session_id))
+
+    def disconnect(self, session_id):
+        assert self.is_session_connected(session_id)
+
+        with self.lock:
+            session = self.sessions.pop(session_id)
+            sync_futures = list(session.sync_futures.values())
+            session.sync_futures.clear()
+
+        # Wake up run_sync_op() if it's waiting for the result
+        for future in sync_futures:
+            future.set_exception(
+                RuntimeError("BE disconnected during synchronous operation")
+            )
+
+        sublime.set_timeout(lambda: self._abandon_interaction(session), 0)
+        print("LiveJS: BE websocket disconnected (session {})".format(session_id))
 
-    def disconnect(self):
-        assert self.is_connected
-        self.websocket = None
+    def _abandon_interaction(self, session):
+        """Throw into the coroutines that wait for results that are never going to come"""
+        waiting = list(session.pending.values())
+        for request_id in session.pending:
+            self.metrics.request_abandoned(request_id)
+        session.pending.clear()
 
-        print("LiveJS: BE websocket disconnected")
+        for co in waiting:
+            if co is None or not co_driver.is_live(co):
+                continue
 
-    def __call__(self, data):
+            try:
+                co_driver.throw_in(co, GenericError("BE disconnected"))
+            except BackendError as e:
+                sublime.status_message("LiveJS: {}".format(e.message))
+
+    def __call__(self, session_id, data):
         """Called by the WS code as soon as a message arrives.
 
-        This is called by the eventloop worker thread.
+        This is called by the eventloop worker thread.  The message is only queued for
+        decoding here.
 
-        :param data: str/bytes object sent via this connection
+        :param session_id: ID of the session the message arrived through
+        :param data: UTF-8 encoded JSON (bytes or bytearray) sent via this connection
         """
-        message = json.loads(data, object_pairs_hook=collections.OrderedDict)
+        self.decode_worker.decode((session_id, len(data)), data)
+
+    def _message_decoded(self, key, message):
+        """Called by the decode worker thread"""
+        session_id, nbytes = key
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            return  # disconnected
+
+        if session.is_replay and message['type'] == 'result':
+            # Nobody waits for recorded results.  Only remember function sources they carry.
+            resolve_function_sources(message, function_cache)
+            return
 
-        with self.cond_processing:
-            self.messages.append(message)
+        if message['type'] == 'result':
+            self.metrics.result_received(message['requestId'], nbytes, message['success'])
+        elif message['type'] == 'persist':
+            self.metrics.persist_received(nbytes)
+
+        if session.sources_request_id is None:
+            self._resolve_message(session, message)
+        elif message['type'] == 'result' and \
+                message['requestId'] == session.sources_request_id:
+            self._function_sources_arrived(session, message)
+        else:
+            session.parked_messages.append(message)
 
-            if self.is_directly_processing:
-                self.cond_processing.notify_all()
-            else:
+    def _resolve_message(self, session, message):
+        """Fill in function sources referred to by hash, then accept the message
+
+        If some sources are not in the cache, they're requested from the BE and the message
+        waits for them.  A replayed session has no BE to ask, so the sources are taken to be
+        unavailable.  Called by the decode worker thread.
+        """
+        if message.get('hasFunctions') and session.is_replay:
+            resolve_function_sources(message, function_cache, FUNCTION_SOURCE_UNAVAILABLE)
+        elif message.get('hasFunctions'):
+            missing = resolve_function_sources(message, function_cache)
+            if missing:
+                session.sources_request_id = next(self.request_ids)
+                session.parked_messages.append(message)
+                self._send_op(session, 'getFunctionSources', {
+                    'hashes': sorted(missing)
+                }, request_id=session.sources_request_id)
+                return
+
+        self._accept_message(session, message)
+
+    def _function_sources_arrived(self, session, result):
+        if result['success']:
+            for hash, source in result['value'].items():
+                if source is None:
+                    print("LiveJS: BE does not know function source with hash", hash)
+                    source = FUNCTION_SOURCE_UNAVAILABLE
+                function_cache.put(hash, source)
+        else:
+            print("LiveJS: could not get function sources:", result['info'])
+
+        self.metrics.result_applied(session.sources_request_id)
+        session.sources_request_id = None
+        parked = take_over_list_items(session.parked_messages)
+        for i, message in enumerate(parked):
+            if session.sources_request_id is not None:
+                # Got parked again
+                session.parked_messages.extend(parked[i:])
+                break
+            self._resolve_message(session, message)
+
+    def _accept_message(self, session, message):
+        with self.lock:
+            if not self.is_session_connected(session.id):
+                return
+
+            future = None
+            if message['type'] == 'result':
+                future = session.sync_futures.pop(message['requestId'], None)
+
+            if future is None:
+                session.messages.append(message)
                 self._schedule_message_processing()
+                return
+
+            # Persists that came before the result must be applied before run_sync_op()
+            # returns, so they go along with it.  Only those at the head of the queue do:
+            # persists that came after a result of another request stay queued behind it.
+            n = 0
+            while n < len(session.messages) and session.messages[n]['type'] == 'persist':
+                n += 1
+            persists = session.messages[:n]
+            del session.messages[:n]
+
+        future.set_result((message, persists))
 
     def _schedule_message_processing(self):
         if not self.is_requested_processing:
@@ -112,98 +381,183 @@ class WsHandler:
             self.is_requested_processing = True
 
     def _process_messages(self):
-        with self.cond_processing:
-            messages = self.messages[:]
-            del self.messages[:]
+        with self.lock:
+            batches = [
+                (session, take_over_list_items(session.messages))
+                for session in self.sessions.values()
+            ]
             self.is_requested_processing = False
 
-        for msg in messages:
-            self._process_message(msg)
-
-    def _process_message(self, msg):
+        for session, messages in batches:
+            # Consecutive persist messages are applied together
+            persists = []
+            for msg in messages:
+                if msg['type'] == 'persist':
+                    persists.append(msg)
+                    continue
+                if persists:
+                    self._process_persists(session, persists)
+                    persists = []
+                self._process_message(session, msg)
+
+            if persists:
+                self._process_persists(session, persists)
+
+    def _process_message(self, session, msg):
         if msg['type'] == 'result':
-            self._process_op_result(msg)
-        elif msg['type'] == 'persist':
-            self._process_persist(msg)
+            self._process_op_result(session, msg)
         else:
             raise RuntimeError("Got a message of unknown type: {}".format(msg))
 
-    def _process_persist(self, msg):
-        assert msg['type'] == 'persist'
-
-        for desc in msg['descriptors']:
-            self._process_persist_descriptor(desc)
+    def _process_persists(self, session, msgs):
+        """Apply descriptors of persist messages, grouped by module"""
+        descriptors = [desc for msg in msgs for desc in msg['descriptors']]
+        if session.is_replay:
+            persist_handler = session.persist_handler
+        else:
+            persist_handler = self.persist_handler
 
-    def _process_persist_descriptor(self, desc):
-        handler = self.persist_handlers[desc['operation']]
-        handler(desc)
+        for descs in group_by_module(descriptors):
+            session.project_ids.add(descs[0]['projectId'])
+            persist_handler(descs)
+            for desc in descs:
+                self.metrics.persist_applied(desc['moduleId'], desc['moduleName'])
 
-    def _process_op_result(self, msg):
+    def _process_op_result(self, session, msg):
         assert msg['type'] == 'result'
 
-        if co_driver.is_free(MAIN_CHANNEL):
+        request_id = msg['requestId']
+        if request_id not in session.pending:
             sublime.error_message("LiveJS: received unexpected BE response: {}"
                                   .format(msg))
             raise RuntimeError
 
+        co = session.pending.pop(request_id)
+        if co is not None and not co_driver.is_live(co):
+            co = None  # the coroutine is gone (e.g. failed while the request was pending)
+
+        try:
+            self._deliver_op_result(co, msg)
+        finally:
+            self.metrics.result_applied(request_id)
+
+    def _deliver_op_result(self, co, msg):
         if msg['success']:
-            co_driver.send_to(MAIN_CHANNEL, msg['value'])
+            if co is not None:
+                co_driver.send_to(co, msg['value'])
         else:
             be_error = make_be_error(msg['error'], msg['info'])
             try:
-                co_driver.throw_in(MAIN_CHANNEL, be_error)
+                if co is None:
+                    raise be_error
+                co_driver.throw_in(co, be_error)
             except BackendError:
                 sublime.error_message("LiveJS failure:\n{}".format(be_error.message))
 
-    def run_async_op(self, operation, args):
-        self.websocket.enqueue_message(json.dumps({
+    def run_async_op(self, operation, args, stream=False, session=None):
+        """Send the operation to the BE.
+
+        The result is sent to the running coroutine (if any) when it arrives, so the
+        coroutine should yield right after calling this.  Any number of operations can be
+        in flight at the same time: they're told apart by request IDs.
+
+        :param stream: if True, the message is JSON-encoded piecewise by the eventloop
+            thread as it's being sent, never materializing as a whole string.  Use this
+            for operations carrying large payloads (like module sources).
+        :param session: the BE to send the operation to.  By default, this is the session
+            the running coroutine is bound to, or the most recently connected one.
+        :return: request ID
+        """
+        if session is None:
+            session = self.session_of_running_coroutine() or self.default_session
+
+        request_id = self._send_op(session, operation, args, stream)
+        session.pending[request_id] = co_driver.co_running
+        return request_id
+
+    def _send_op(self, session, operation, args, stream=False, request_id=None):
+        if request_id is None:
+            request_id = next(self.request_ids)
+        message = {
+            'requestId': request_id,
             'operation': operation,
             'args': args
-        }))
+        }
+        self.metrics.request_enqueued(request_id, operation)
+        on_sent = functools.partial(self.metrics.request_sent, request_id)
+        if stream:
+            session.websocket.enqueue_message(json_encoder.iterencode(message), on_sent)
+        else:
+            session.websocket.enqueue_message(json.dumps(message), on_sent)
 
-    def run_sync_op(self, operation, args, report_be_error=True):
-        assert co_driver.is_free(MAIN_CHANNEL),\
-            "Cannot run synchronous operation: another BE interaction is in progress"
+        return request_id
 
-        def result_arrived():
-            return index_where(self.messages, lambda msg: msg['type'] == 'result')
+    def run_sync_op(self, operation, args, report_be_error=True, session=None):
+        """Send the operation to the BE and block until the result arrives
 
-        stopwatch.start('sync_request')
-        self.run_async_op(operation, args)
-        self.is_directly_processing = True
+        The GUI thread is blocked for at most config.max_gui_freeze seconds.  The result
+        is handed over by the decode worker thread through a future, so the GUI thread is
+        not woken up by unrelated incoming messages.
+        """
+        if session is None:
+            session = self.default_session
+        if session is None:
+            sublime.status_message("BE not connected")
+            raise RuntimeError("BE not connected")
+
+        if session.is_link_slow:
+            sublime.status_message(
+                "Operation skipped, BE link is too slow (RTT {:.0f} ms)"
+                .format(session.rtt * 1000)
+            )
+            raise RuntimeError("BE link is too slow for synchronous communication")
+
+        future = concurrent.futures.Future()
+        request_id = next(self.request_ids)
+        with self.lock:
+            session.sync_futures[request_id] = future
+
+        started_at = time.perf_counter()
+        self._send_op(session, operation, args, request_id=request_id)
 
         try:
-            with self.cond_processing:
-                idx = self.cond_processing.wait_for(result_arrived,
-                                                    timeout=config.max_gui_freeze)
-                if idx is None:
-                    sublime.status_message(
-                        "Operation aborted, BE took too long to respond"
-                    )
-                    raise RuntimeError("BE synchronous communication timeout")
-
-                head_messages = self.messages[:idx]
-                result = self.messages[idx]
-                del self.messages[:(idx + 1)]
-
-                # If there are more, schedule a callback
-                if self.messages:
-                    self._schedule_message_processing()
-
-            # First process head_messages which consists of persists only
-            for msg in head_messages:
-                self._process_persist(msg)
-            
-            # Done, return the result
-            if result['success']:
-                return result['value']
-            else:
-                be_error = make_be_error(result['error'], result['info'])
-                if report_be_error:
-                    sublime.error_message("LiveJS failure:\n{}".format(be_error.message))
-                raise be_error
+            result, head_persists = self._wait_sync_result(session, request_id, future)
+            if head_persists:
+                self._process_persists(session, head_persists)
         finally:
-            self.is_directly_processing = False
+            self.metrics.gui_blocked(operation, time.perf_counter() - started_at)
+
+        self.metrics.result_applied(request_id)
+
+        if result['success']:
+            return result['value']
+        else:
+            be_error = make_be_error(result['error'], result['info'])
+            if report_be_error:
+                sublime.error_message("LiveJS failure:\n{}".format(be_error.message))
+            raise be_error
+
+    def _wait_sync_result(self, session, request_id, future):
+        try:
+            return future.result(timeout=config.max_gui_freeze)
+        except concurrent.futures.TimeoutError:
+            pass
+        except RuntimeError:
+            self.metrics.request_abandoned(request_id)
+            sublime.status_message("Operation aborted, BE disconnected")
+            raise
+
+        with self.lock:
+            is_still_waiting = session.sync_futures.pop(request_id, None) is not None
+
+        if not is_still_waiting:
+            # The decode worker took the future right before we gave up
+            return future.result()
+
+        # The result may still come, and nobody will be waiting for it
+        session.pending[request_id] = None
+        sublime.status_message("Operation aborted, BE took too long to respond")
+        raise RuntimeError("BE synchronous communication timeout")
 
 
 ws_handler = WsHandler()
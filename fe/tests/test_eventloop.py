@@ -2,8 +2,12 @@ import pytest
 import re
 import threading
 import socket
+import time
 
+from live.lowlvl.eventfd import EventFd
 from live.lowlvl.eventloop import EventLoop
+from live.lowlvl.eventloop import Fd
+from live.lowlvl.eventloop import Timeout
 from tests.async_server_client import (
     serve,
     connect,
@@ -66,3 +70,26 @@ def test_server_client_write_multiple_read_multiple(server_port):
         sock.close()
 
     EventLoop().run_coroutine(client_coroutine())
+
+
+def test_timeout_resumes_coroutine():
+    def sleeper():
+        timeout = Timeout(0.05)
+        start = time.perf_counter()
+        resumed_by = yield timeout
+        return resumed_by is timeout, time.perf_counter() - start
+
+    is_timeout, elapsed = EventLoop().run_coroutine(sleeper())
+    assert is_timeout
+    assert elapsed >= 0.05
+
+
+def test_fd_readiness_preempts_timeout():
+    evt = EventFd()
+    evt.set()
+
+    def waiter():
+        resumed_by = yield Fd.read(evt), Timeout(10)
+        return resumed_by
+
+    assert EventLoop().run_coroutine(waiter()) is evt
@@ -0,0 +1,53 @@
+from live.common.function_cache import FunctionSourceCache
+from live.common.function_cache import resolve_function_sources
+
+
+def test_cache_evicts_least_recently_used():
+    cache = FunctionSourceCache(2)
+    cache.put('a', 'function a() {}')
+    cache.put('b', 'function b() {}')
+    cache.get('a')
+    cache.put('c', 'function c() {}')
+
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert len(cache) == 2
+
+
+def test_resolve_fills_refs_and_reports_missing():
+    cache = FunctionSourceCache(10)
+    cache.put('known', 'function known() {}')
+    message = {
+        'type': 'result',
+        'value': {
+            'type': 'object',
+            'value': {
+                'ref': {'type': 'function', 'hash': 'new'},
+                'arr': {'type': 'array', 'value': [
+                    {'type': 'function', 'hash': 'known'},
+                    {'type': 'function', 'hash': 'unknown'},
+                ]},
+                'src': {'type': 'function', 'hash': 'new', 'value': 'function nu() {}'},
+            }
+        }
+    }
+
+    missing = resolve_function_sources(message, cache)
+
+    assert missing == {'unknown'}
+    entries = message['value']['value']
+    assert entries['ref']['value'] == 'function nu() {}'
+    assert entries['arr']['value'][0]['value'] == 'function known() {}'
+    assert 'value' not in entries['arr']['value'][1]
+    assert cache.get('new') == 'function nu() {}'
+
+
+def test_resolve_compact_encoding():
+    cache = FunctionSourceCache(10)
+    message = ['o', 'a', ['f', 'h1'], 'b', ['f', 'h1', 'function b() {}'], 'c', ['f', 'h2']]
+
+    missing = resolve_function_sources(message, cache)
+
+    assert missing == {'h2'}
+    assert message[2] == ['f', 'h1', 'function b() {}']
+    assert message[6] == ['f', 'h2']
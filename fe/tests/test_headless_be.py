@@ -0,0 +1,249 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+import pytest
+
+from headless_be.backend import Backend
+from headless_be.jsparse import ParseError
+from headless_be.jsparse import parse_expression
+from headless_be.jsparse import parse_module_source
+from headless_be.loadgen import generate_module_value
+from headless_be.loadgen import random_edit
+from headless_be.loadgen import render
+from headless_be.model import JsFunction
+from headless_be.model import JsLeaf
+from headless_be.model import JsObject
+from headless_be.wsclient import WsClient
+from live.lowlvl.eventloop import EventLoop
+from live.lowlvl.http_server import serve
+from live.lowlvl.websocket import WebSocket
+
+
+be_root = os.path.join(os.path.dirname(__file__), '..', '..', 'be')
+
+PROJECT_ID = 'a559f0f3ff8744bb944f1dda48650b4f'
+MODULE_ID = '1da68185780c463d82232874b271c1f7'
+
+
+def read_be_file(name):
+    with open(os.path.join(be_root, name), encoding='utf8') as file:
+        return file.read()
+
+
+@pytest.fixture
+def backend():
+    be = Backend()
+    be.bootload(be_root, json.loads(read_be_file('project.live.json')), {
+        'acc0b54988854dd9b5e74d269ea731e1': read_be_file('live.js'),
+        MODULE_ID: read_be_file('fake.js'),
+    })
+
+    sent = []
+    be.connected(lambda text: sent.append(json.loads(text)))
+    be.sent = sent
+    return be
+
+
+def request(be, operation, **args):
+    be.sent.clear()
+    be.handle_message(json.dumps({
+        'requestId': 7,
+        'operation': operation,
+        'args': args
+    }))
+    *persists, result = be.sent
+    assert result['type'] == 'result' and result['requestId'] == 7
+    return result, [desc for msg in persists for desc in msg['descriptors']]
+
+
+def test_parse_module():
+    value = parse_module_source(read_be_file('fake.js'))
+
+    assert value.keys == ['livejs', 'init', 'inspectThing', 'vasya', 'protractor']
+    assert value['inspectThing'].source == \
+        'function (thing) {\n         console.log(thing, "was just inspected");\n      }'
+    assert value['protractor']['c']['name'] == [JsLeaf('/Jo[e]/')]
+
+
+def test_parse_expression():
+    root = JsObject([('a', [JsLeaf('1'), JsObject([('b c', JsLeaf('null'))])])])
+
+    assert parse_expression("$.a[1]['b c']", root) == JsLeaf('null')
+    assert parse_expression('$.a.length', root) == JsLeaf('2')
+    assert parse_expression("[0x10, -1.50, 'q\\'\\u0444', `t`]") == [
+        JsLeaf('16'), JsLeaf('-1.5'), JsLeaf('"q\'ф"'), JsLeaf('"t"')
+    ]
+    assert parse_expression('(x, y) => ({x: `}`, y: /[}/]/})').source == \
+        '(x, y) => ({x: `}`, y: /[}/]/})'
+    with pytest.raises(ParseError):
+        parse_expression('$.a + 1', root)
+    with pytest.raises(ParseError):
+        parse_expression('$.a')
+
+
+def test_function_hash_matches_live_js():
+    # Computed by $.cyrb53 in node
+    assert JsFunction('function () {}').hash == '38b750bf56abb-14'
+    assert JsFunction('абв 😀 x').hash == 'c370676309de-8'
+
+
+def test_edits_emit_persist_descriptors(backend):
+    result, descs = request(backend, 'replace', mid=MODULE_ID, path=[3],
+                            codeNewValue='$.protractor.b')
+    assert result['success']
+    assert descs == [{
+        'operation': 'replace',
+        'path': [3],
+        'newValue': {
+            'type': 'array',
+            'value': [{'type': 'leaf', 'value': '3'}, {'type': 'leaf', 'value': '2'}]
+        },
+        'projectId': PROJECT_ID,
+        'moduleId': MODULE_ID,
+        'moduleName': 'fake',
+        'version': 1
+    }]
+
+    result, descs = request(backend, 'move', mid=MODULE_ID, path=[4, 0], fwd=False)
+    assert result['value'] == [4, 2]
+    assert [(d['operation'], d['path'], d['newPath'], d['version']) for d in descs] == \
+        [('move', [4, 0], [4, 2], 2)]
+    assert backend.modules[MODULE_ID].value['protractor'].keys == ['b', 'c', 'a']
+
+    result, descs = request(backend, 'renameKey', mid=MODULE_ID, path=[4, 0],
+                            newName='c')
+    assert result['error'] == 'duplicate_key' and descs == []
+
+    result, descs = request(backend, 'getModuleChanges', mid=MODULE_ID,
+                            epoch=backend.epoch, sinceVersion=1)
+    assert result['value']['type'] == 'delta'
+    assert [d['version'] for d in result['value']['descriptors']] == [2]
+
+
+def test_compact_encoding_and_function_sources(backend):
+    request(backend, 'setEncoding', encoding='compact')
+
+    result, descs = request(backend, 'getValueAt', mid=MODULE_ID, path=[2])
+    assert result['hasFunctions']
+    hash = result['value'][1]
+    assert result['value'] == ['f', hash, backend.sent_sources[hash]]
+
+    result, descs = request(backend, 'getValueAt', mid=MODULE_ID, path=[2])
+    assert result['value'] == ['f', hash]
+
+    result, descs = request(backend, 'batch', operations=[
+        {'operation': 'getKeyAt', 'args': {'mid': MODULE_ID, 'path': [3]}},
+        {'operation': 'getKeyAt', 'args': {'mid': MODULE_ID, 'path': [30]}},
+    ])
+    assert [res['success'] for res in result['value']] == [True, False]
+
+
+def test_logged_changes_carry_sources_unsent_over_new_connection(backend):
+    result, descs = request(backend, 'replace', mid=MODULE_ID, path=[3],
+                            codeNewValue='function () { return 1; }')
+    new_value = descs[0]['newValue']
+    # The source is already sent, so it's only referred to by hash from now on
+    result, descs = request(backend, 'replace', mid=MODULE_ID, path=[1],
+                            codeNewValue='function () { return 1; }')
+    assert descs[0]['newValue'] == {'type': 'function', 'hash': new_value['hash']}
+
+    backend.connected(lambda text: backend.sent.append(json.loads(text)))
+
+    def delta_new_values():
+        result, descs = request(backend, 'getModuleChanges', mid=MODULE_ID,
+                                epoch=backend.epoch, sinceVersion=1)
+        assert result['hasFunctions']
+        return [desc['newValue'] for desc in result['value']['descriptors']]
+
+    assert delta_new_values() == [new_value]
+    assert delta_new_values() == [{'type': 'function', 'hash': new_value['hash']}]
+
+
+def test_browse_budget_is_spent_breadth_first(backend):
+    request(backend, 'setEncoding', encoding='compact')
+    backend.browse_max_nodes = 22
+
+    def leaves(n):
+        return [JsLeaf(str(i)) for i in range(n)]
+
+    module = backend.modules[MODULE_ID]
+    module.value = JsObject([
+        ('deep', [leaves(5), leaves(5), leaves(5)]),
+        ('shallow', JsObject([('x', leaves(2))])),
+        ('flat', leaves(3)),
+    ])
+
+    result, descs = request(backend, 'getModuleObject', mid=MODULE_ID)
+    deep, shallow, flat = result['value']['object'][2::2]
+    # 3 top-level entries, then 3 + 1 + 3 at the next level, then 5 + 5 + 2
+    assert deep[0] == 'a' and [item[0] for item in deep[1:]] == ['a', 'a', 'u']
+    assert shallow == ['o', 'x', ['a', ['l', '0'], ['l', '1']]]
+    assert flat[0] == 'a'
+
+
+def test_generated_module_round_trips_and_churns(backend):
+    rng = random.Random(1)
+    value = generate_module_value(rng, 50, 3)
+    source = 'let $ = {};'.format(render(value))
+    assert render(parse_module_source(source)) == render(value)
+
+    backend.run_op('loadProject', {
+        'projectPath': '/tmp/generated',
+        'project': {
+            'projectId': 'generated',
+            'projectName': 'generated',
+            'modules': [{'id': 'gen0', 'name': 'module0', 'untracked': []}]
+        },
+        'sources': {'gen0': source}
+    })
+    backend.sent.clear()
+    for i in range(100):
+        random_edit(backend, rng)
+
+    assert all(msg['type'] == 'persist' for msg in backend.sent)
+    assert {desc['moduleId'] for msg in backend.sent for desc in msg['descriptors']} == \
+        {'gen0'}
+    assert backend.modules['gen0'].version == \
+        sum(len(msg['descriptors']) for msg in backend.sent)
+
+
+def test_client_talks_to_fe_websocket():
+    port = 9013
+    incoming = queue.Queue()
+    sockets = []
+    evt_connected = threading.Event()
+
+    def request_handler(req):
+        websocket = WebSocket(req, incoming.put)
+        sockets.append(websocket)
+        evt_connected.set()
+        yield from websocket
+
+    eventloop = EventLoop()
+    eventloop.add_coroutine(serve(port, request_handler), 'server')
+    eventloop.run_in_new_thread()
+
+    client = WsClient('localhost', port, '/ws')
+    try:
+        for attempt in range(50):
+            try:
+                client.connect()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.02)  # the server is not listening yet
+        assert evt_connected.wait(5)
+
+        client.send_text('привет' * 50000)
+        assert incoming.get(timeout=5) == 'привет' * 50000
+
+        sockets[0].enqueue_message(('piece{};'.format(i) for i in range(30000)))
+        assert client.recv_message(timeout=5) == \
+            ''.join('piece{};'.format(i) for i in range(30000))
+        assert client.recv_message(timeout=0.05) is None
+    finally:
+        client.close()
+        eventloop.stop()
@@ -0,0 +1,42 @@
+import random
+
+from headless_be.backend import Backend
+from headless_be.loadgen import generate_module_value
+from headless_be.loadgen import render
+from live.shared.js_render import TextCursor
+from live.shared.js_render import render_js_value
+
+
+def serialize(value):
+    backend = Backend()
+    backend.encoding = 'compact'
+    return backend.serialize(value)
+
+
+def test_renders_the_way_modules_are_laid_out():
+    value = generate_module_value(random.Random(0), 50, 3)
+
+    # That's how PersistCursor is at the module root
+    cur = TextCursor(depth=-1, root_nesting=1)
+    render_js_value(cur, serialize(value))
+    assert cur.text == render(value, 1)
+
+
+def test_regions_are_at_the_insertion_position():
+    cur = TextCursor(pos=100, depth=0)
+    with cur.laying_out('array') as separate:
+        separate()
+        cur.push()
+        cur.insert('1')
+        first = cur.pop_region()
+        separate()
+        cur.push()
+        cur.insert_function('function () {\n   return 2;\n}')
+        second = cur.pop_region()
+
+    text = '[\n      1,\n      function () {\n         return 2;\n      }\n   ]'
+    assert cur.text == text
+    assert cur.pos == 100 + len(text)
+    assert text[first[0] - 100:first[1] - 100] == '1'
+    assert text[second[0] - 100:second[1] - 100].startswith('function () {\n')
+    assert text[second[1] - 101] == '}'
@@ -0,0 +1,62 @@
+import json
+import threading
+
+import pytest
+
+from live.common.json_decode import ChunkedDecoder
+from live.common.json_decode import DecodeWorker
+from live.common.json_decode import decode_json
+
+
+def test_decode_json_from_bytes_keeps_key_order():
+    message = decode_json(bytearray('{"z": 1, "a": "ы", "m": [true, null]}'.encode('utf8')))
+    assert list(message.items()) == [('z', 1), ('a', 'ы'), ('m', [True, None])]
+
+
+def test_chunked_decoder_matches_json_loads():
+    value = {
+        'numbers': [1.5e10, -2.25e-07, 123456789012345678901234567890, 0, -17],
+        'strings': ['', 'ы' * 40, 'a\\"\n' * 20],
+        'nested': [{'k{}'.format(i): [True, False, None, {'x': [i] * i}]} for i in range(20)],
+    }
+    for indent in (None, 2):
+        text = ' {}\n'.format(json.dumps(value, indent=indent, ensure_ascii=False))
+        # Values of all sizes relative to the window, numbers cut by its end
+        for window_size in (1, 3, 7, 16, 100, 10000):
+            assert ChunkedDecoder(text, window_size).decode() == value
+
+    data = json.dumps([value] * 2000).encode('utf8')
+    assert len(data) > 1 << 18
+    assert decode_json(data) == json.loads(data.decode('utf8'))
+
+
+@pytest.mark.parametrize('text', ['[1,', '{"a" 1}', '[1 2]', '[1]x', '{"a":}', ''])
+def test_chunked_decoder_rejects_garbage(text):
+    for window_size in (1, 3, 100):
+        with pytest.raises(ValueError):
+            ChunkedDecoder(text, window_size).decode()
+
+
+def test_decode_worker_preserves_order_and_skips_garbage():
+    decoded = []
+    all_done = threading.Event()
+
+    def consumer(key, message):
+        decoded.append((key, message))
+        if message == 'last':
+            all_done.set()
+
+    worker = DecodeWorker(consumer)
+    worker.start()
+    try:
+        for i in range(100):
+            worker.decode(i % 3, str(i).encode('ascii'))
+        worker.decode('x', b'{not json')
+        # RecursionError
+        worker.decode('z', b'[' * 100000 + b']' * 100000)
+        worker.decode('y', b'"last"')
+        assert all_done.wait(5)
+    finally:
+        worker.stop()
+
+    assert decoded == [(i % 3, i) for i in range(100)] + [('y', 'last')]
@@ -0,0 +1,44 @@
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+from live.shared.jsvalue import jsval_text
+from live.shared.jsvalue import jsval_type
+from live.shared.jsvalue import jsval_unexpanded
+
+
+def as_python(jsval):
+    """Convert a jsval of either encoding to a plain Python structure"""
+    jstype = jsval_type(jsval)
+    if jstype in ('leaf', 'function'):
+        return jsval_text(jsval)
+    elif jstype == 'object':
+        return [(key, as_python(value)) for key, value in jsval_object_items(jsval)]
+    elif jstype == 'array':
+        return [as_python(value) for value in jsval_array_items(jsval)]
+    else:
+        return jsval_unexpanded(jsval)
+
+
+def test_encodings_are_equivalent():
+    dicts = {
+        'type': 'object',
+        'value': {
+            'f': {'type': 'function', 'hash': 'h', 'value': 'function () {}'},
+            'arr': {'type': 'array', 'value': [
+                {'type': 'leaf', 'value': '1'},
+                {'type': 'unexpanded', 'kind': 'array', 'size': 50},
+            ]},
+            'empty': {'type': 'object', 'value': {}},
+        }
+    }
+    compact = [
+        'o',
+        'f', ['f', 'h', 'function () {}'],
+        'arr', ['a', ['l', '1'], ['u', 'array', 50]],
+        'empty', ['o'],
+    ]
+
+    assert as_python(dicts) == as_python(compact) == [
+        ('f', 'function () {}'),
+        ('arr', ['1', ('array', 50)]),
+        ('empty', []),
+    ]
@@ -0,0 +1,84 @@
+import json
+
+from live.common.metrics import LatencyHistogram
+from live.common.metrics import ProtocolMetrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_histogram_percentiles():
+    hist = LatencyHistogram()
+    for ms in [0.5] * 90 + [30] * 9 + [12000]:
+        hist.record(ms / 1000)
+
+    assert hist.count == 100
+    assert hist.percentile(50) == 1
+    assert hist.percentile(95) == 50
+    assert hist.percentile(100) == hist.max == 12000
+
+
+def test_request_stages():
+    clock = FakeClock()
+    metrics = ProtocolMetrics(clock=clock)
+
+    metrics.request_enqueued(1, 'getValueAt')
+    clock.now = 0.002
+    metrics.request_sent(1, 100)
+    clock.now = 0.032
+    metrics.result_received(1, 5000, True)
+    clock.now = 0.040
+    metrics.result_applied(1)
+
+    metrics.request_enqueued(2, 'getValueAt')
+    metrics.request_sent(2, 100)
+    metrics.result_received(2, 50, False)
+    metrics.request_enqueued(3, 'getValueAt')
+    metrics.request_abandoned(3)
+
+    data = metrics.as_dict()
+    op = data['operations']['getValueAt']
+    assert (op['requests'], op['errors'], op['bytesOut'], op['bytesIn']) == \
+        (3, 1, 200, 5050)
+    assert op['latency']['queued']['maxMs'] == 2
+    assert op['latency']['be']['maxMs'] == 30
+    assert op['latency']['apply']['count'] == 1
+    assert op['latency']['total']['avgMs'] == 40
+    assert data['inFlight'] == 1
+    json.dumps(data)
+
+
+def test_persists_and_report():
+    metrics = ProtocolMetrics()
+    metrics.persist_received(300)
+    # Modules of different projects may have the same name
+    for module_id, module_name in [('m1', 'live'), ('m1', 'live'), ('m2', 'util'),
+                                   ('m3', 'live')]:
+        metrics.persist_applied(module_id, module_name)
+    metrics.gui_blocked('getKeyAt', 0.01)
+    metrics.module_saved('file', 0.2, 1000)
+    metrics.module_saved('file', 3.5, 500)
+
+    assert metrics.as_dict()['persist'] == {
+        'messages': 1,
+        'bytesIn': 300,
+        'descriptorsByModule': {
+            'm1': {'name': 'live', 'count': 2},
+            'm2': {'name': 'util', 'count': 1},
+            'm3': {'name': 'live', 'count': 1},
+        }
+    }
+    assert metrics.as_dict()['saves']['file']['bytesWritten'] == 1500
+    report = metrics.report()
+    assert '  live (m1): 2' in report and '  live (m3): 1' in report
+    assert 'getKeyAt: n=1' in report
+    assert '  file: 2 saves, 1500 bytes written' in report
+    assert 'lag: n=2 avg=1850.0 p50<=200 p95<=5000' in report
+
+    metrics.reset()
+    assert metrics.report() == ''
@@ -0,0 +1,158 @@
+import copy
+import random
+
+from live.common.persist_coalesce import coalesce
+from live.common.persist_coalesce import group_by_module
+from live.shared.jsvalue import jsval_array_items
+from live.shared.jsvalue import jsval_object_items
+from live.shared.jsvalue import jsval_text
+from live.shared.jsvalue import jsval_type
+
+
+def from_jsval(jsval):
+    """Object -> {'keys': [...], 'values': [...]}, array -> [...], leaf -> text"""
+    jstype = jsval_type(jsval)
+    if jstype == 'object':
+        items = list(jsval_object_items(jsval))
+        return {'keys': [k for k, v in items], 'values': [from_jsval(v) for k, v in items]}
+    if jstype == 'array':
+        return [from_jsval(v) for v in jsval_array_items(jsval)]
+    return jsval_text(jsval)
+
+
+def children(value):
+    return value['values'] if isinstance(value, dict) else value
+
+
+def apply(root, desc):
+    parent = root
+    for n in desc['path'][:-1]:
+        parent = children(parent)[n]
+    n = desc['path'][-1]
+
+    if desc['operation'] == 'replace':
+        children(parent)[n] = from_jsval(desc['newValue'])
+    elif desc['operation'] == 'rename_key':
+        parent['keys'][n] = desc['newName']
+    elif desc['operation'] == 'delete':
+        del children(parent)[n]
+        if isinstance(parent, dict):
+            del parent['keys'][n]
+    elif desc['operation'] == 'move':
+        new_n = desc['newPath'][-1]
+        children(parent).insert(new_n, children(parent).pop(n))
+        if isinstance(parent, dict):
+            parent['keys'].insert(new_n, parent['keys'].pop(n))
+    else:
+        children(parent).insert(n, from_jsval(desc['value']))
+        if isinstance(parent, dict):
+            parent['keys'].insert(n, desc['key'])
+
+
+def random_jsval(rng, depth):
+    kind = rng.random()
+    if depth > 0 and kind < 0.3:
+        return ['a'] + [random_jsval(rng, depth - 1) for i in range(rng.randint(0, 3))]
+    if depth > 0 and kind < 0.6:
+        res = ['o']
+        for i in range(rng.randint(0, 3)):
+            res += ['k{}'.format(i), random_jsval(rng, depth - 1)]
+        return res
+    return ['l', str(rng.randint(0, 99))]
+
+
+def random_descriptor(rng, root, version):
+    path = []
+    value = root
+    while children(value) and rng.random() < 0.6:
+        n = rng.randrange(len(children(value)))
+        if not isinstance(children(value)[n], (list, dict)):
+            break
+        path.append(n)
+        value = children(value)[n]
+
+    kind = rng.random()
+    if not children(value) or kind < 0.25:
+        desc = {'operation': 'insert', 'path': path + [rng.randint(0, len(children(value)))],
+                'key': None, 'value': random_jsval(rng, 2)}
+        if isinstance(value, dict):
+            desc['key'] = 'n{}'.format(version)
+    elif kind < 0.4:
+        desc = {'operation': 'delete', 'path': path + [rng.randrange(len(children(value)))]}
+    elif kind < 0.5:
+        desc = {'operation': 'move', 'path': path + [rng.randrange(len(children(value)))],
+                'newPath': path + [rng.randrange(len(children(value)))]}
+    elif kind < 0.6 and isinstance(value, dict):
+        desc = {'operation': 'rename_key', 'path': path + [rng.randrange(len(value['keys']))],
+                'newName': 'r{}'.format(version)}
+    else:
+        desc = {'operation': 'replace', 'path': path + [rng.randrange(len(children(value)))],
+                'newValue': random_jsval(rng, 2)}
+
+    desc.update(moduleId='m', version=version)
+    return desc
+
+
+def test_coalesced_descriptors_have_the_same_effect():
+    rng = random.Random(7)
+    n_before = n_after = 0
+
+    initial = from_jsval([
+        'o',
+        'a', ['a', ['l', '1'], ['o', 'x', ['l', '2']]],
+        'b', ['o', 'y', ['a']],
+        'c', ['l', '3']
+    ])
+
+    for i in range(500):
+        state = copy.deepcopy(initial)
+        descriptors = []
+        for version in range(1, rng.randint(2, 12)):
+            desc = random_descriptor(rng, state, version)
+            apply(state, desc)
+            descriptors.append(desc)
+
+        coalesced = coalesce(descriptors)
+        result = copy.deepcopy(initial)
+        for desc in coalesced:
+            apply(result, desc)
+        assert result == state, (descriptors, coalesced)
+
+        versions = [(desc['firstVersion'], desc['version']) for desc in coalesced]
+        if versions:
+            assert versions[0][0] == 1 and versions[-1][1] == len(descriptors)
+            assert all(v1 + 1 == f2 for (f1, v1), (f2, v2) in zip(versions, versions[1:]))
+
+        n_before += len(descriptors)
+        n_after += len(coalesced)
+
+    assert n_after < n_before * 0.9
+
+
+def test_examples():
+    def desc(version, operation, path, **attrs):
+        return dict(attrs, moduleId='m', version=version, operation=operation, path=path)
+
+    assert [(d['operation'], d['path'], d['firstVersion'], d['version']) for d in coalesce([
+        desc(1, 'replace', [0], newValue=['l', '1']),
+        desc(2, 'replace', [1], newValue=['l', '1']),
+        desc(3, 'replace', [0], newValue=['l', '2']),
+        desc(4, 'insert', [2], key='q', value=['l', '1']),
+        desc(5, 'replace', [2], newValue=['l', '3']),
+        desc(6, 'delete', [0]),
+        desc(7, 'replace', [1], newValue=['l', '5']),
+    ])] == [
+        ('replace', [1], 1, 2),
+        ('insert', [2], 3, 4),
+        ('delete', [0], 5, 6),
+        ('replace', [1], 7, 7),
+    ]
+
+    assert coalesce([
+        desc(3, 'insert', [2, 0], key=None, value=['l', '1']),
+        desc(4, 'delete', [2, 0]),
+    ]) == []
+
+    assert group_by_module([
+        {'moduleId': 'a', 'n': 0}, {'moduleId': 'b', 'n': 1}, {'moduleId': 'a', 'n': 2}
+    ]) == [[{'moduleId': 'a', 'n': 0}, {'moduleId': 'a', 'n': 2}], [{'moduleId': 'b', 'n': 1}]]
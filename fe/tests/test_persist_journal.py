@@ -0,0 +1,69 @@
+import os
+
+from live.common.persist_journal import Journal
+from live.common.persist_journal import journal_path
+from live.common.persist_journal import read_journal
+from live.common.persist_journal import recover
+from live.common.persist_journal import take_stamp
+
+
+def append_text(desc, buf):
+    buf.insert(None, buf.size(), desc['text'])
+
+
+def test_append_truncate_and_read(tmp_path):
+    project_path = str(tmp_path)
+    journal = Journal(project_path)
+
+    stamps = [journal.append('m', {'text': str(i)}) for i in range(3)]
+    assert stamps == sorted(set(stamps))
+    offset = journal.size()
+    journal.append('m', {'text': '3'})
+    journal.sync()
+    assert [r['desc']['text'] for r in read_journal(project_path)] == ['0', '1', '2', '3']
+
+    journal.truncate_upto(offset)
+    journal.append('n', {'text': '4'})
+    journal.close()
+    assert [(r['module'], r['desc']['text']) for r in read_journal(project_path)] == \
+        [('m', '3'), ('n', '4')]
+
+    # A record cut short by a crash is ignored
+    with open(journal_path(project_path), 'a') as fl:
+        fl.write('{"stamp": 1, "mod')
+    assert len(read_journal(project_path)) == 2
+
+
+def test_recover_replays_records_not_compacted(tmp_path):
+    project_path = str(tmp_path)
+
+    def module_filepath(name):
+        return os.path.join(project_path, name + '.js')
+
+    for name in ('a', 'b'):
+        with open(module_filepath(name), 'w') as fl:
+            fl.write(name)
+
+    journal = Journal(project_path)
+    journal.append('a', {'text': '1'})
+    journal.append('b', {'text': '1'})
+    # The compactor wrote 'a' with the first 2 records, but crashed before writing 'b'
+    stamp = take_stamp()
+    journal.append('a', {'text': '2'})
+    journal.append_compaction('a', stamp, 'a1')
+    journal.append_compaction('b', stamp, 'b1')
+    with open(module_filepath('a'), 'w') as fl:
+        fl.write('a1')
+    journal.append('c', {'text': '1'})  # the module is gone
+    journal.close()
+
+    # File times don't matter (they may be coarse)
+    for name in ('a', 'b'):
+        os.utime(module_filepath(name), ns=(0, 0))
+    assert recover(project_path, module_filepath, append_text) == 2
+
+    for name, text in [('a', 'a12'), ('b', 'b1')]:
+        with open(module_filepath(name)) as fl:
+            assert fl.read() == text
+    assert read_journal(project_path) == []
+    assert recover(project_path, module_filepath, append_text) == 0
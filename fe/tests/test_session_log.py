@@ -0,0 +1,90 @@
+import json
+import pytest
+
+from live.common.function_cache import FUNCTION_SOURCE_UNAVAILABLE
+from live.common.function_cache import FunctionSourceCache
+from live.common.function_cache import resolve_function_sources
+from live.lowlvl.session_log import INBOUND
+from live.lowlvl.session_log import OUTBOUND
+from live.lowlvl.session_log import SessionRecorder
+from live.lowlvl.session_log import read_session_log
+from live.lowlvl.session_log import replay_session_log
+
+
+def record(path):
+    recorder = SessionRecorder(str(path))
+    recorder.record(OUTBOUND, '{"operation": "getModuleObject"}')
+    recorder.record(INBOUND, bytearray('{"type": "result", "x": "ы"}'.encode('utf8')))
+    recorder.record(INBOUND, b'{"type": "persist"}')
+    recorder.close()
+
+
+def test_recorded_log_reads_back(tmpdir):
+    path = tmpdir.join('session.ljsrec')
+    record(path)
+
+    records = list(read_session_log(str(path)))
+    assert [(direction, payload) for direction, timestamp, payload in records] == [
+        (OUTBOUND, b'{"operation": "getModuleObject"}'),
+        (INBOUND, '{"type": "result", "x": "ы"}'.encode('utf8')),
+        (INBOUND, b'{"type": "persist"}'),
+    ]
+    timestamps = [timestamp for direction, timestamp, payload in records]
+    assert timestamps == sorted(timestamps)
+
+
+def test_truncated_log_is_detected(tmpdir):
+    path = tmpdir.join('session.ljsrec')
+    record(path)
+    path.write_binary(path.read_binary()[:-3])
+
+    with pytest.raises(ValueError):
+        list(read_session_log(str(path)))
+
+
+def test_replay_delivers_inbound_messages_only(tmpdir):
+    path = tmpdir.join('session.ljsrec')
+    record(path)
+
+    delivered = []
+    slept = []
+    count, nbytes, elapsed = replay_session_log(
+        str(path), delivered.append, speed=None, sleep=slept.append
+    )
+
+    assert delivered == [
+        '{"type": "result", "x": "ы"}'.encode('utf8'),
+        b'{"type": "persist"}'
+    ]
+    assert (count, nbytes) == (2, sum(len(d) for d in delivered))
+    assert slept == []
+
+
+def test_replay_with_empty_function_cache(tmpdir):
+    path = tmpdir.join('session.ljsrec')
+    recorder = SessionRecorder(str(path))
+    recorder.record(INBOUND, json.dumps({
+        'type': 'persist',
+        'hasFunctions': True,
+        'descriptors': [{
+            'operation': 'replace',
+            'newValue': ['o', 'f', ['f', 'h1'], 'g', {'type': 'function', 'hash': 'h2'}]
+        }]
+    }).encode('utf8'))
+    recorder.close()
+
+    # Sources sent before the recording started (or evicted since) are unknown
+    cache = FunctionSourceCache(10)
+    messages = []
+
+    def deliver(data):
+        message = json.loads(data.decode('utf8'))
+        resolve_function_sources(message, cache, FUNCTION_SOURCE_UNAVAILABLE)
+        messages.append(message)
+
+    replay_session_log(str(path), deliver, speed=None)
+
+    [message] = messages
+    value = message['descriptors'][0]['newValue']
+    assert value[2] == ['f', 'h1', FUNCTION_SOURCE_UNAVAILABLE]
+    assert value[4]['value'] == FUNCTION_SOURCE_UNAVAILABLE
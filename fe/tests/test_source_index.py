@@ -0,0 +1,144 @@
+import pytest
+
+from live.shared.source_index import SourceIndex
+from live.shared.js_text import UnexpectedText
+from live.shared.js_text import js_go
+
+
+source = """\
+(function () {
+   'use strict';
+
+   let $ = {
+      a: 1,
+      b: [
+         10,
+         {x: 'q,]', y: /[}]/ /* , */}
+      ],
+      'c d': "z" /* } */,
+      e: function (x) {
+         return {x};
+      }
+   };
+
+   return $;
+})();
+"""
+
+
+def dump(index):
+    """{path: (start, value, end)} with absolute positions, to compare indices"""
+    res = {}
+
+    def walk(container, pos, path):
+        res[tuple(path)] = ('close', pos + container.close)
+        for n, entry in enumerate(container.entries):
+            res[tuple(path + [n])] = (
+                pos + entry.start, pos + entry.value, pos + entry.end
+            )
+            if entry.container is not None:
+                walk(entry.container, pos + entry.value, path + [n])
+
+    walk(index.root, index.root_pos, [])
+    return res
+
+
+def check(index, text):
+    fresh = SourceIndex(text)
+    assert dump(index) == dump(fresh)
+
+
+def test_js_go_skips_strings_comments_and_regexes():
+    text = "f('a,b', /,/g, [1, 2] /* , */, // ,\n x), rest"
+    assert js_go(text, 2, ',') == (True, 7)
+    assert js_go(text, 8, ',', including=True) == (True, 14)
+    assert js_go(text, 14, ',') == (True, 29)
+    assert js_go(text, 30, ',') == (False, 30)
+    assert js_go(text, 30, ',', move_if_not_found=True) == (False, 38)
+
+
+def test_index_locates_entries():
+    index = SourceIndex(source)
+
+    def at(path):
+        return source[index.entry_pos(path):]
+
+    assert at([]).startswith('{\n      a: 1,')
+    assert at([1]).startswith('b: [')
+    assert at([1, 1]).startswith("{x: 'q,]'")
+    assert at([1, 1, 1]).startswith('y: /[}]/')
+    assert at([2]).startswith("'c d': \"z\"")
+    assert at([3]).startswith('e: function')
+    assert index.container_kind([1]) == 'array'
+    assert source[index.insertion_pos([1], 2):].startswith(']')
+    assert source[index.insertion_pos([1, 1], 2):].startswith('}')
+
+    with pytest.raises(UnexpectedText):
+        SourceIndex('let $ = {a: 1, b: [}')
+
+
+def test_index_follows_edits():
+    text = source
+    index = SourceIndex(text)
+
+    def edit(beg, end, new):
+        nonlocal text
+        text = text[:beg] + new + text[end:]
+        return len(new) - (end - beg)
+
+    # Replace [1, 0] which is 10
+    pos = index.entry_pos([1, 0])
+    edit(pos, pos + 2, '[\n            7\n         ]')
+    index.value_replaced([1, 0], '[\n            7\n         ]')
+    check(index, text)
+
+    # Delete the only entry of that array, then insert into the empty array
+    beg, end = index.entry_pos([1, 0]) + 1, index.insertion_pos([1, 0], 1)
+    index.entry_deleted([1, 0, 0], edit(beg, end, ''))
+    check(index, text)
+
+    pos = index.insertion_pos([1, 0], 0)
+    index.entry_inserted([1, 0, 0], pos + 1, pos + 1, '{q: 1}', edit(pos, pos, '\n{q: 1}\n'))
+    check(index, text)
+
+    # Rename 'c d' to cd
+    pos = index.entry_pos([2])
+    index.key_renamed([2], edit(pos, pos + 5, 'cd'))
+    check(index, text)
+
+    # Insert before the first top-level entry
+    pos = index.insertion_pos([], 0)
+    index.entry_inserted([0], pos, pos + 3, '[2]', edit(pos, pos, 'z: [2],\n      '))
+    check(index, text)
+    assert text[index.entry_pos([2, 0, 0]):].startswith('{q: 1}')
+
+    # Delete a middle entry, then the last one (along with the preceding comma)
+    beg, end = index.entry_pos([1]), index.entry_pos([2])
+    index.entry_deleted([1], edit(beg, end, ''))
+    check(index, text)
+
+    prev_end = index.root_pos + index.root.entries[2].end
+    end = index.root_pos + index.root.entries[3].end
+    index.entry_deleted([3], edit(prev_end, end, ''))
+    check(index, text)
+
+    # Append at the end of the root object
+    prev_end = index.root_pos + index.root.entries[2].end
+    index.entry_inserted(
+        [3], prev_end + 8, prev_end + 11, '0', edit(prev_end, prev_end, ',\n      w: 0')
+    )
+    check(index, text)
+    assert text[index.entry_pos([3]):].startswith('w: 0\n   };')
+
+    # Move the first entry (with a nested container) to the end, reusing its index
+    start, end = index.entry_span([0])
+    entry_text = text[start:end]
+    entry = index.entry_deleted([0], edit(start, index.entry_pos([1]), ''))
+    check(index, text)
+
+    prev_end = index.root_pos + index.root.entries[2].end
+    index.entry_reinserted(
+        [3], prev_end + 8, entry, edit(prev_end, prev_end, ',\n      ' + entry_text)
+    )
+    check(index, text)
+    assert text[index.entry_pos([3, 0]):].startswith('2]\n   };')
@@ -0,0 +1,62 @@
+import os
+import stat
+
+from live.common.misc import file_contents
+from live.common.misc import write_file_atomically
+from live.shared.string_buffer import Region
+from live.shared.string_buffer import StringBuffer
+
+
+def test_insertion_runs_and_edits():
+    buf = StringBuffer('let $ = {\n};\n')
+    pos = 9
+    for piece in ['\n', '   ', 'a', ': ', '[1, 2]']:
+        pos += buf.insert(None, pos, piece)
+
+    assert buf.size() == len('let $ = {\n   a: [1, 2]\n};\n')
+    assert buf.change_count() == 5
+    buf.insert(None, 0, '// x\n')
+    assert buf.text == '// x\nlet $ = {\n   a: [1, 2]\n};\n'
+
+    reg = buf.find(r'\[1, 2\]', 0)
+    assert buf.substr(reg) == '[1, 2]'
+    assert buf.rowcol(reg.a) == (2, 6)
+    assert buf.find('nope', 0) == Region(-1, -1)
+
+    buf.erase(None, Region(reg.a + 2, reg.b - 1))
+    buf.replace(None, Region(0, 4), '//')
+    assert buf.text == '//\nlet $ = {\n   a: [1]\n};\n'
+    assert buf.substr(buf.size() - 1) == '\n' and buf.substr(buf.size()) == ''
+    assert buf.change_count() == 8
+
+
+def test_write_file_atomically(tmp_path):
+    path = str(tmp_path / 'module.js')
+    write_file_atomically(path, 'let $ = {};\n')
+    os.chmod(path, 0o640)
+
+    write_file_atomically(path, 'let $ = {a: "ы"};\n')
+    with open(path, 'rb') as fl:
+        assert fl.read() == 'let $ = {a: "ы"};\n'.encode('utf-8')
+    assert file_contents(path) == 'let $ = {a: "ы"};\n'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(str(tmp_path)) == ['module.js']
+
+
+def test_write_file_atomically_is_durable_before_replacing(tmp_path, monkeypatch):
+    path = str(tmp_path / 'module.js')
+    events = []
+    real_replace = os.replace
+
+    def fsync(fd):
+        events.append(('fsync', stat.S_ISDIR(os.fstat(fd).st_mode)))
+
+    def replace(src, dst):
+        events.append(('replace', dst))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'fsync', fsync)
+    monkeypatch.setattr(os, 'replace', replace)
+    write_file_atomically(path, 'let $ = {};\n')
+
+    assert events == [('fsync', False), ('replace', path), ('fsync', True)]
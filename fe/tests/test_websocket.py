@@ -0,0 +1,230 @@
+import socket
+import threading
+
+from live.common.misc import FreeObj
+from live.lowlvl.eventloop import EventLoop
+from live.lowlvl.session_log import OUTBOUND
+from live.lowlvl.websocket import OpCode
+from live.lowlvl.websocket import TextStreamSink
+from live.lowlvl.websocket import WebSocket
+from live.lowlvl.websocket import iter_fragments
+from live.lowlvl.websocket import unmask
+
+
+def parse_server_frames(data):
+    """Parse unmasked frames sent by the server
+
+    :return: [(fin, opcode, payload)]
+    """
+    frames = []
+    i = 0
+    while i < len(data):
+        b0, b1 = data[i], data[i + 1]
+        i += 2
+        length = b1 & 0x7F
+        if length == 126:
+            length = int.from_bytes(data[i:i + 2], 'big')
+            i += 2
+        elif length == 127:
+            length = int.from_bytes(data[i:i + 8], 'big')
+            i += 8
+        frames.append((bool(b0 & 0x80), b0 & 0x0F, data[i:i + length]))
+        i += length
+
+    return frames
+
+
+def recv_all(sock):
+    sock.settimeout(1)
+    chunks = []
+    while True:
+        try:
+            chunk = sock.recv(65536)
+        except socket.timeout:
+            break
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def test_iter_fragments_splits_across_pieces():
+    fragments = list(iter_fragments(['abc', 'defg', 'hi'], 4))
+    assert fragments == [(b'abcd', False), (b'efgh', False), (b'i', True)]
+
+
+def test_iter_fragments_exact_multiple():
+    fragments = list(iter_fragments(['abcdefgh'], 4))
+    assert fragments == [(b'abcd', False), (b'efgh', True)]
+
+
+def test_iter_fragments_empty_message():
+    assert list(iter_fragments([], 4)) == [(b'', True)]
+
+
+def test_send_message_fragments_generator():
+    server, client = socket.socketpair()
+    try:
+        ws = WebSocket(FreeObj(sock=server), ws_handler=None, fragment_size=1000)
+        pieces = ('piece-{};'.format(i) for i in range(500))
+        EventLoop().run_coroutine(ws.send_message(pieces))
+        server.shutdown(socket.SHUT_WR)
+
+        frames = parse_server_frames(recv_all(client))
+    finally:
+        server.close()
+        client.close()
+
+    assert len(frames) > 1
+    assert frames[0][1] == OpCode.TEXT
+    assert all(opcode == OpCode.CONTINUATION for fin, opcode, payload in frames[1:])
+    assert [fin for fin, opcode, payload in frames] == [False] * (len(frames) - 1) + [True]
+    assert all(len(payload) <= 1000 for fin, opcode, payload in frames)
+    message = b''.join(payload for fin, opcode, payload in frames).decode('utf8')
+    assert message == ''.join('piece-{};'.format(i) for i in range(500))
+
+
+def client_frame(opcode, payload, fin=True):
+    """Make a masked frame, as a client would send"""
+    mask_key = b'\x01\x02\x03\x04'
+    masked = bytes(b ^ mask_key[i % 4] for i, b in enumerate(payload))
+    assert len(masked) < 126
+    return bytes([(0x80 if fin else 0) | opcode, 0x80 | len(masked)]) + mask_key + masked
+
+
+def test_heartbeat_drops_silent_peer():
+    server, client = socket.socketpair()
+    try:
+        ws = WebSocket(FreeObj(sock=server), ws_handler=None,
+                       ping_interval=0.01, max_missed_pongs=2)
+        EventLoop().run_coroutine(ws.communicate())
+        server.shutdown(socket.SHUT_WR)
+
+        frames = parse_server_frames(recv_all(client))
+    finally:
+        server.close()
+        client.close()
+
+    assert ws.is_closed
+    assert [opcode for fin, opcode, payload in frames] == [OpCode.PING, OpCode.PING]
+
+
+def test_heartbeat_measures_rtt():
+    server, client = socket.socketpair()
+    messages = []
+
+    def answer_ping_then_close():
+        [(fin, opcode, payload)] = parse_server_frames(client.recv(1024))
+        assert opcode == OpCode.PING
+        client.sendall(client_frame(OpCode.PONG, payload) +
+                       client_frame(OpCode.TEXT, b'hello') +
+                       client_frame(OpCode.CLOSE, b''))
+
+    responder = threading.Thread(target=answer_ping_then_close)
+    responder.start()
+    try:
+        ws = WebSocket(FreeObj(sock=server), ws_handler=messages.append,
+                       ping_interval=0.01)
+        EventLoop().run_coroutine(ws.communicate())
+    finally:
+        responder.join()
+        server.close()
+        client.close()
+
+    assert ws.rtt is not None and ws.rtt > 0
+    assert ws.pings_unanswered == {}
+    assert messages == ['hello']
+
+
+def run_with_client_frames(data, **ws_kwargs):
+    """Feed client frames to a WebSocket, collecting delivered messages and its replies
+
+    :return: (ws, [message], [(fin, opcode, payload)])
+    """
+    server, client = socket.socketpair()
+    messages = []
+    try:
+        client.sendall(data)
+        ws = WebSocket(FreeObj(sock=server), ws_handler=messages.append, **ws_kwargs)
+        EventLoop().run_coroutine(ws.communicate())
+        server.shutdown(socket.SHUT_WR)
+        frames = parse_server_frames(recv_all(client))
+    finally:
+        server.close()
+        client.close()
+
+    return ws, messages, frames
+
+
+def test_utf8_sequence_split_across_frames():
+    encoded = 'привет'.encode('utf8')
+    ws, messages, frames = run_with_client_frames(
+        client_frame(OpCode.TEXT, encoded[:3], fin=False) +
+        client_frame(OpCode.CONTINUATION, encoded[3:7], fin=False) +
+        client_frame(OpCode.CONTINUATION, encoded[7:]) +
+        client_frame(OpCode.CLOSE, b'')
+    )
+    assert messages == ['привет']
+
+
+def test_oversized_message_is_aborted_early():
+    ws, messages, frames = run_with_client_frames(
+        client_frame(OpCode.TEXT, b'x' * 60, fin=False) +
+        client_frame(OpCode.CONTINUATION, b'x' * 60, fin=False) +
+        client_frame(OpCode.CONTINUATION, b'x' * 60),
+        max_message_size=100
+    )
+    assert ws.is_closed
+    assert messages == []
+    assert frames == [(True, OpCode.CLOSE, (1009).to_bytes(2, 'big'))]
+
+
+def test_stream_sink_is_fed_before_final_fragment():
+    class Sink(TextStreamSink):
+        def __init__(self, opcode):
+            super().__init__()
+            self.chunks = []
+            chunks_by_sink.append(self.chunks)
+
+        def feed_text(self, text):
+            self.chunks.append(text)
+
+        def finish_text(self):
+            return len(self.chunks)
+
+    chunks_by_sink = []
+    encoded = '{"key": "значение"}'.encode('utf8')
+    ws, messages, frames = run_with_client_frames(
+        client_frame(OpCode.TEXT, encoded[:11], fin=False) +
+        client_frame(OpCode.CONTINUATION, encoded[11:]) +
+        client_frame(OpCode.CLOSE, b''),
+        sink_factory=Sink
+    )
+    assert chunks_by_sink == [['{"key": "з', 'начение"}']]
+    assert messages == [2]
+
+
+def test_unmask():
+    mask_key = b'\x01\x02\x03\x04'
+    payload = bytes(range(11))
+    masked = bytes(b ^ mask_key[i % 4] for i, b in enumerate(payload))
+    assert unmask(masked, mask_key) == payload
+    assert unmask(b'', mask_key) == b''
+
+
+def test_sent_message_is_recorded_whole():
+    recorded = []
+    recorder = FreeObj(record=lambda direction, payload: recorded.append((direction, payload)))
+    server, client = socket.socketpair()
+    try:
+        ws = WebSocket(FreeObj(sock=server), ws_handler=None, fragment_size=10,
+                       recorder=recorder)
+        pieces = ('piece-{};'.format(i) for i in range(10))
+        EventLoop().run_coroutine(ws.send_message(pieces))
+    finally:
+        server.close()
+        client.close()
+
+    assert recorded == [
+        (OUTBOUND, ''.join('piece-{};'.format(i) for i in range(10)).encode('ascii'))
+    ]